@@ -0,0 +1,61 @@
+"""
+Profile the import time of the Cloud Function entry point with python -X importtime,
+for a bare cold start, a validated request and a batch load's storage imports.
+Each step is run in a fresh interpreter and reports the modules it added.
+
+Run from the repository root: python -m benchmarks.cold_start_profile [budget_ms]
+"""
+import re
+import sys
+import subprocess
+
+FUNCTION_DIR = "tf/gcp/src"
+IMPORT_TIME_PATTERN = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \| ( *)(\S+)")
+STEPS = {
+    "cold start": "import main",
+    "validate request": "import main; main.get_dpuk().validate_months(['2023-03'])",
+    "batch load imports": "import main; import utils.cloud_storage_utils",
+}
+TOP_MODULES = 8
+# Cold start budget in milliseconds, a failed check exits non-zero
+DEFAULT_BUDGET_MS = 500
+
+
+def profile_imports(statement):
+    """
+    Cumulative microseconds of the top level imports made by running statement,
+    and of the modules each of them imported directly
+    """
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", statement],
+                            cwd=FUNCTION_DIR, capture_output=True, text=True, check=True)
+    imports, children, pending = {}, {}, {}
+    for line in result.stderr.splitlines():
+        match = IMPORT_TIME_PATTERN.match(line)
+        # A module's line follows those of the modules it imported
+        if match and not match[3]:
+            imports[match[4]] = int(match[2])
+            children[match[4]], pending = pending, {}
+        elif match and len(match[3]) == 2:
+            pending[match[4]] = int(match[2])
+    return imports, children
+
+
+def run(budget_ms=DEFAULT_BUDGET_MS):
+    baseline, _ = profile_imports("pass")
+    cold_start_ms = None
+    for name, statement in STEPS.items():
+        imports, children = profile_imports(statement)
+        added = [module for module in imports if module not in baseline]
+        total_ms = sum(imports[module] for module in added) / 1000
+        cold_start_ms = total_ms if cold_start_ms is None else cold_start_ms
+        print(f"{name:<20} {total_ms:8.1f} ms")
+        added_children = {child: micros for module in added for child, micros in children[module].items()}
+        for module, micros in sorted(added_children.items(), key=lambda item: -item[1])[:TOP_MODULES]:
+            print(f"    {module:<36} {micros / 1000:8.1f} ms")
+
+    print(f"cold start {cold_start_ms:.1f} ms of a {budget_ms} ms budget")
+    return cold_start_ms <= budget_ms
+
+
+if __name__ == "__main__":
+    sys.exit(0 if run(*[int(arg) for arg in sys.argv[1:2]]) else 1)
@@ -0,0 +1,42 @@
+"""
+The byte-level CSV concatenation against parsing and concatenating with pandas,
+on the street CSVs in the tests/data fixture archive. Each fixture's rows are
+repeated SCALE times so timings are measurable.
+
+Run from the repository root: python -m pytest benchmarks/test_csv_concat.py
+"""
+import io
+import pytest
+from zipfile import ZipFile
+from tf.gcp.src.utils.csv_concat import concat_csv_files
+from tf.gcp.src.utils.schemas import read_csv, concat_frames
+
+pytest.importorskip("pytest_benchmark")
+
+ZIP_PATH = "tests/data/2023-03.zip"
+SCALE = 500
+
+
+@pytest.fixture(scope="module")
+def street_csvs():
+    street_csvs = []
+    with ZipFile(ZIP_PATH) as zip_file:
+        for member in sorted(zip_file.namelist()):
+            if member.endswith("street.csv"):
+                header, body = zip_file.read(member).split(b"\n", 1)
+                street_csvs.append(header + b"\n" + (body.rstrip(b"\r\n") + b"\r\n") * SCALE)
+    return street_csvs
+
+
+@pytest.mark.benchmark(group="csv concat")
+def test_concat_csv_frames(benchmark, street_csvs):
+    def concat():
+        df_list = [read_csv(io.BytesIO(street_csv), "street") for street_csv in street_csvs]
+        concat_frames(df_list, "street").to_csv(io.BytesIO(), index=False)
+
+    benchmark(concat)
+
+
+@pytest.mark.benchmark(group="csv concat")
+def test_concat_csv_bytes(benchmark, street_csvs):
+    benchmark(lambda: concat_csv_files([io.BytesIO(street_csv) for street_csv in street_csvs], io.BytesIO()))
@@ -0,0 +1,99 @@
+"""
+End to end timings of the pipeline on a synthetic archive and the in-memory
+storage client, so no GCS project or network is needed.
+
+Run from the repository root: python -m pytest benchmarks
+"""
+import io
+import shutil
+import pandas as pd
+import pytest
+from zipfile import ZipFile
+from main import FileMgmtUtils
+from tf.gcp.src.utils.cloud_storage_utils import CloudStorageAPI
+from tf.gcp.src.utils.schemas import read_csv
+from tf.gcp.src.utils.row_keys import compute_row_keys
+from tf.gcp.src.utils.spatial_index import SpatialIndexBuilder
+from tests.fake_gcs import FakeStorageClient
+from tests.synthetic_archive import make_archive, make_months, make_forces
+
+pytest.importorskip("pytest_benchmark")
+
+ARCHIVE_MONTH = "2023-03"
+MONTHS = make_months(ARCHIVE_MONTH, 3)
+FORCES = make_forces(10)
+ROWS = 2000
+ROUNDS = 3
+API_REQUEST_INFO = {"record_months": MONTHS, "data_sets": ["street", "outcomes", "stop-and-search"]}
+raw_bucket = "crime-data-uk-raw-bench"
+curated_bucket = "crime-data-uk-curated-bench"
+
+
+@pytest.fixture(scope="module")
+def archive_path(tmp_path_factory):
+    return make_archive(str(tmp_path_factory.mktemp("archive") / f"{ARCHIVE_MONTH}.zip"), MONTHS, FORCES, ROWS)
+
+
+def make_gcs(archive_path):
+    storage_client = FakeStorageClient()
+    for bucket_name in [raw_bucket, curated_bucket]:
+        storage_client.create_bucket(storage_client.bucket(bucket_name))
+    gcs = CloudStorageAPI(storage_client=storage_client)
+    gcs.upload_file_to_gcs(raw_bucket, archive_path)
+    return gcs
+
+
+def test_extract_zip_file_to_bucket(benchmark, archive_path):
+    def setup():
+        return (make_gcs(archive_path),), {}
+
+    benchmark.pedantic(lambda gcs: gcs.extract_zip_file_to_bucket(raw_bucket, ARCHIVE_MONTH, API_REQUEST_INFO),
+                       setup=setup, rounds=ROUNDS)
+
+
+def test_curate_raw_data(benchmark, archive_path):
+    def setup():
+        gcs = make_gcs(archive_path)
+        gcs.extract_zip_file_to_bucket(raw_bucket, ARCHIVE_MONTH, API_REQUEST_INFO)
+        return (gcs,), {}
+
+    benchmark.pedantic(lambda gcs: gcs.curate_raw_data(raw_bucket, curated_bucket), setup=setup, rounds=ROUNDS)
+
+
+def test_unzip_concat_csvs(benchmark, archive_path, tmp_path):
+    file_utils = FileMgmtUtils(ARCHIVE_MONTH, str(tmp_path))
+    shutil.copy(archive_path, tmp_path / "latest.zip")
+    benchmark.pedantic(file_utils.unzip_concat_csvs, setup=file_utils.delete_local_concat_csv, rounds=ROUNDS)
+
+
+@pytest.fixture(scope="module")
+def street_csv(archive_path):
+    with ZipFile(archive_path) as zip_file:
+        return zip_file.read(f"{ARCHIVE_MONTH}/{ARCHIVE_MONTH}-{FORCES[0]}-street.csv")
+
+
+def test_read_csv_default(benchmark, street_csv):
+    benchmark(lambda: pd.read_csv(io.BytesIO(street_csv)))
+
+
+def test_read_csv_typed(benchmark, street_csv):
+    benchmark(lambda: read_csv(io.BytesIO(street_csv), "street"))
+
+
+@pytest.fixture(scope="module")
+def spatial_index(archive_path):
+    builder = SpatialIndexBuilder("street")
+    with ZipFile(archive_path) as zip_file:
+        for force in FORCES:
+            df = read_csv(io.BytesIO(zip_file.read(f"{ARCHIVE_MONTH}/{ARCHIVE_MONTH}-{force}-street.csv")), "street")
+            df["Row key"] = compute_row_keys(df, "street", force)
+            builder.add(df)
+    return builder.build()
+
+
+def test_spatial_index_query_bbox(benchmark, spatial_index):
+    benchmark(lambda: spatial_index.query_bbox(51.3, -0.5, 51.7, 0.3))
+
+
+def test_spatial_index_hotspots(benchmark, spatial_index):
+    benchmark(lambda: spatial_index.hotspots(top=10, type_label="Burglary"))
@@ -0,0 +1,54 @@
+"""
+Selecting archive members with the per-file target_month/target_data_set scans
+against the ZipMemberIndex, on an "all" sized archive directory.
+
+Run from the repository root: python -m pytest benchmarks/test_zip_member_filter.py
+"""
+import io
+import pytest
+from zipfile import ZipFile
+from tf.gcp.src.utils.cloud_storage_utils import CloudStorageAPI
+from tf.gcp.src.utils.zip_index import ZipMemberIndex
+
+pytest.importorskip("pytest_benchmark")
+
+MONTHS = [f"{2010 + i // 12}-{i % 12 + 1:02d}" for i in range(150)]
+FORCES = [f"force-{i}" for i in range(45)]
+DATA_SETS = ["street", "outcomes", "stop-and-search"]
+
+
+@pytest.fixture(scope="module")
+def zip_file():
+    """An in-memory zip with an empty member for every month, force and data set"""
+    buffer = io.BytesIO()
+    with ZipFile(buffer, 'w') as zip_file:
+        for month in MONTHS:
+            for force in FORCES:
+                for data_set in DATA_SETS:
+                    zip_file.writestr(f"{month}/{month}-{force}-{data_set}.csv", b"")
+    buffer.seek(0)
+    return ZipFile(buffer)
+
+
+def linear_scan(gcs, zip_file):
+    return [file for file in zip_file.namelist()
+            if gcs.target_month(file) and gcs.target_data_set(file)]
+
+
+@pytest.mark.benchmark(group="zip member filter")
+def test_target_month_data_set_scan(benchmark, zip_file):
+    gcs = CloudStorageAPI(storage_client=object())
+    gcs.api_request_info = {"record_months": MONTHS, "data_sets": DATA_SETS}
+    members = benchmark(linear_scan, gcs, zip_file)
+    assert sorted(members) == ZipMemberIndex.from_zip_file(zip_file).select(MONTHS, DATA_SETS)
+
+
+@pytest.mark.benchmark(group="zip member filter")
+def test_index_build_and_select(benchmark, zip_file):
+    benchmark(lambda: ZipMemberIndex.from_zip_file(zip_file).select(MONTHS, DATA_SETS))
+
+
+@pytest.mark.benchmark(group="zip member filter")
+def test_persisted_index_load_and_select(benchmark, zip_file):
+    persisted_json = ZipMemberIndex.from_zip_file(zip_file).to_json()
+    benchmark(lambda: ZipMemberIndex.from_json(persisted_json).select(MONTHS, DATA_SETS))
@@ -1,9 +1,21 @@
-from google.cloud import storage
 from zipfile import ZipFile
+from contextlib import ExitStack
 import os
-import shutil
-import pandas as pd
+import mmap
 import wget
+# The local script shares CSV concatenation, parsing and blob deletion with the Cloud Function's
+# utils package, so it is run from the repository root like the tests
+from tf.gcp.src.utils.csv_concat import concat_csv_files, SchemaMismatchError
+from tf.gcp.src.utils.bulk_delete import BulkDeleter
+from tf.gcp.src.utils.storage_client import get_storage_client
+from tf.gcp.src.utils.schemas import read_csv, concat_frames
+
+
+class MappedFile(mmap.mmap):
+    """Read-only memory map ZipFile can use as a file, mmap only gained seekable() in Python 3.13"""
+
+    def seekable(self):
+        return True
 
 
 class DataPoliceUKAPI():
@@ -16,13 +28,12 @@ class CloudStorageAPI():
 
     def __init__(self, bucket_name) -> None:
         self.bucket_name = bucket_name
-        self.storage_client = storage.Client()
+        self.storage_client = get_storage_client()
 
 
     def list_buckets(self) -> object:
         """Lists all buckets."""
 
-        self.storage_client = storage.Client()
         buckets = self.storage_client.list_buckets()
         bucket_names = []
         if buckets:
@@ -35,8 +46,8 @@ class CloudStorageAPI():
 
     def delete_bucket(self):
         """Deletes a bucket. The bucket must be empty."""
-        if self.bucket_name in self.list_buckets():
-            bucket = self.storage_client.get_bucket(self.bucket_name)
+        if self.check_bucket_exists():
+            bucket = self.storage_client.bucket(self.bucket_name)
             bucket.delete()
             print(f"Bucket {self.bucket_name} deleted")
         else:
@@ -44,13 +55,11 @@ class CloudStorageAPI():
 
 
     def check_bucket_exists(self) -> bool:
-        if self.bucket_name in self.list_buckets():
-            return True
-        return False
+        return self.storage_client.lookup_bucket(self.bucket_name) is not None
 
 
     def create_bucket(self, bucket_name, storage_class="STANDARD", storage_loc="EUROPE-WEST2"):
-        if bucket_name in self.list_buckets():
+        if self.storage_client.lookup_bucket(bucket_name) is not None:
             print(f"Bucket {bucket_name} already created")
         else:
             bucket = self.storage_client.bucket(bucket_name)
@@ -61,30 +70,27 @@ class CloudStorageAPI():
 
     def delete_blob(self, bucket_name, blob_name):
         """Deletes a blob from the bucket."""
-        storage_client = storage.Client()
-
-        bucket = storage_client.bucket(bucket_name)
+        bucket = self.storage_client.bucket(bucket_name)
         blob = bucket.blob(blob_name)
         blob.delete()
 
         print(f"Blob {blob_name} deleted.")
 
 
-    def delete_all_blobs(self, bucket_name):
-        blob_names = self.list_blobs(bucket_name)
+    def delete_all_blobs(self, bucket_name, prefix=None):
+        """Deletes every blob in the bucket, or only those under prefix, in concurrent batches"""
+        blob_names = self.list_blobs(bucket_name, prefix)
 
         if blob_names:
-            for blob in blob_names:
-                self.delete_blob(bucket_name, blob)
-
-            print(f"All blobs in {bucket_name} bucket deleted.")
+            deleted = BulkDeleter(self.storage_client).delete_blobs(bucket_name, blob_names)
+            print(f"{deleted} blobs in {bucket_name} bucket deleted.")
 
         else:
             print(f"{bucket_name} bucket already empty.")
 
 
     def get_bucket_object(self, bucket_name):
-        return self.storage_client.get_bucket(bucket_name)
+        return self.storage_client.bucket(bucket_name)
 
 
     def upload_file_to_gcs(self, file_path):
@@ -97,9 +103,9 @@ class CloudStorageAPI():
         print("Upload complete!")
 
 
-    def list_blobs(self, bucket_name):
+    def list_blobs(self, bucket_name, prefix=None):
         """Lists all the blobs in the bucket."""
-        blobs = self.storage_client.list_blobs(bucket_name)
+        blobs = self.storage_client.list_blobs(bucket_name, prefix=prefix)
         blob_names = []
         for blob in blobs:
             blob_names.append(blob.name)
@@ -113,43 +119,53 @@ class FileMgmtUtils():
     def __init__(self, query_date, working_dir) -> None:
         self.query_date = query_date
         self.working_dir = working_dir
-        self.extract_dir  = os.path.join(working_dir, query_date)
+        self.concat_csv_path = os.path.join(working_dir, f'{query_date}-street.csv')
 
 
-    def delete_local_unzipped_file(self):
-        if os.path.exists(self.extract_dir) and os.path.isdir(self.extract_dir):
-            shutil.rmtree(self.extract_dir)
+    def delete_local_concat_csv(self):
+        if os.path.exists(self.concat_csv_path):
+            os.remove(self.concat_csv_path)
 
 
-    def unzip_file(self):
-        """Extract all street-outcome CSVs for a particular month"""
+    def unzip_concat_csvs(self):
+        """
+        Decompress the month's street CSVs from a memory mapped latest.zip straight into
+        a single CSV, without extracting them to disk first
+        """
         self.zip_file_path = os.path.join(self.working_dir, "latest.zip")
-        with ZipFile(self.zip_file_path, 'r') as zip_file:
-            for file in zip_file.namelist():
-                if file.startswith(f'{self.query_date}') and file.endswith('street.csv'):
-                    zip_file.extract(file, self.working_dir)
-                    print(f"File '{file}' extracted")
-
-            # Remove __MACOSX directory
-            macosx_dir  = os.path.join(self.working_dir, "__MACOSX")
-            if os.path.exists(macosx_dir) and os.path.isdir(macosx_dir):
-                shutil.rmtree(macosx_dir)
-
-
-    def concat_csvs(self):
-        """Concatenate all of these CSVs into a single data frame and save as CSV"""
-        df_list = []
-        concat_csv_path = os.path.join(self.working_dir, f'{self.query_date}-street.csv')
+        concat_csv_path = self.concat_csv_path
         if not os.path.exists(concat_csv_path):
-            for file in os.listdir(self.extract_dir):
-                df = pd.read_csv(f'{self.extract_dir}/{file}', index_col=None, header=0)
-                df_list.append(df)
-
-            concat_frame = pd.concat(df_list, axis=0, ignore_index=True)
-            concat_frame.to_csv(concat_csv_path,index=False)
+            with open(self.zip_file_path, 'rb') as zip_archive_file, \
+                    MappedFile(zip_archive_file.fileno(), 0, access=mmap.ACCESS_READ) as zip_map, \
+                    ZipFile(zip_map) as zip_file:
+                # __MACOSX/ members never match, so there is nothing to clean up
+                members = sorted(file for file in zip_file.namelist()
+                                 if file.startswith(f'{self.query_date}') and file.endswith('street.csv'))
+                try:
+                    with open(concat_csv_path, 'wb') as concat_file:
+                        concat_csv_files(self.open_members(zip_file, members), concat_file)
+                except SchemaMismatchError as err:
+                    print(f"{err}, concatenating with pandas instead")
+                    with ExitStack() as stack:
+                        member_files = [stack.enter_context(zip_file.open(member)) for member in members]
+                        self.concat_csv_frames(member_files, concat_csv_path)
+                print(f"{len(members)} files concatenated into '{concat_csv_path}'")
         return concat_csv_path
 
 
+    def open_members(self, zip_file, members):
+        for member in members:
+            with zip_file.open(member) as member_file:
+                yield member_file
+
+
+    def concat_csv_frames(self, csv_files, concat_csv_path):
+        """Concatenate the CSVs on column name, for months whose headers differ"""
+        df_list = [read_csv(csv_file, "street") for csv_file in csv_files]
+        concat_frame = concat_frames(df_list, "street")
+        concat_frame.to_csv(concat_csv_path, index=False)
+
+
 
 def run_app():
 
@@ -163,14 +179,12 @@ def run_app():
     gcs = CloudStorageAPI(BUCKET_NAME)
     fileUtils = FileMgmtUtils(LATEST_DATE, WORKING_DIR)
 
-    fileUtils.delete_local_unzipped_file()
     if gcs.check_bucket_exists():
         gcs.delete_all_blobs(BUCKET_NAME)
     # gcs.delete_bucket()
 
     # gcs.create_bucket(BUCKET_NAME)
-    fileUtils.unzip_file()
-    csv_path = fileUtils.concat_csvs()
+    csv_path = fileUtils.unzip_concat_csvs()
     gcs.upload_file_to_gcs(csv_path)
 
 
@@ -13,8 +13,8 @@ fileUtils = FileMgmtUtils(LATEST_DATE, WORKING_DIR)
 
 
 @pytest.fixture
-def delete_local_unzipped_file():
-    fileUtils.delete_local_unzipped_file()
+def delete_local_concat_csv():
+    fileUtils.delete_local_concat_csv()
 
 
 @pytest.fixture
@@ -35,14 +35,13 @@ def test_create_bucket():
     assert gcs.check_bucket_exists() == True
 
 
-def test_unzip_files(delete_local_unzipped_file):
-    fileUtils.unzip_file()
-    EXTRACT_DIR = os.path.join(WORKING_DIR, LATEST_DATE)
-    assert (os.path.exists(EXTRACT_DIR) and os.path.isdir(EXTRACT_DIR)) == True
+def test_unzip_concat_csvs(delete_local_concat_csv):
+    csv_path = fileUtils.unzip_concat_csvs()
+    assert os.path.isfile(csv_path) == True
 
 
 def test_upload_directory_gcs():
-    csv_path = fileUtils.concat_csvs()
+    csv_path = fileUtils.unzip_concat_csvs()
     gcs.upload_file_to_gcs(csv_path)
     test_blob_name = "2023-01-street.csv"
     wait_counter = 0
@@ -4,8 +4,7 @@ CREATE OR REPLACE DATABASE CRIME_DATA_UK;
 USE DATABASE CRIME_DATA_UK;
 
 CREATE TABLE IF NOT EXISTS street_level_crime (
-  id STRING UNIQUE PRIMARY KEY
-, crime_id STRING DEFAULT NULL
+  crime_id STRING DEFAULT NULL
 , month STRING DEFAULT NULL
 , reported_by STRING DEFAULT NULL
 , falls_within STRING DEFAULT NULL
@@ -17,6 +16,8 @@ CREATE TABLE IF NOT EXISTS street_level_crime (
 , crime_type STRING DEFAULT NULL
 , last_outcome_category STRING DEFAULT NULL
 , context STRING DEFAULT NULL
+-- Content hash of the row, in the same column order as the curated files for Snowpipe
+, row_key NUMBER(20,0) UNIQUE PRIMARY KEY
 )
 ;
 
@@ -32,7 +32,10 @@ CREATE PIPE CRIME_DATA_PIPE
   INTEGRATION = 'CRIME_DATA_NOTIFICATION_INTEGRATION'
   AS
 COPY INTO crime_data_uk.public.street_level_crime
-  FROM @crime_data_uk.public.crime_data_stage;
+  FROM @crime_data_uk.public.crime_data_stage/data_set=street/
+  -- Curated files are Hive-style partitions, data_set=street/month=2023-03/force=.../part-0.csv,
+  -- load the part files only and not the _stats.json sidecars next to them
+  PATTERN = '.*/part-[0-9]+[.]csv';
 
 
 -- List the staged files to check we have registered it
@@ -43,4 +46,27 @@ LIST @crime_data_stage;
 CREATE OR REPLACE FILE FORMAT gcs_csv_format
     TYPE = 'csv'
     FIELD_DELIMITER = ','
-    SKIP_HEADER = 1;
\ No newline at end of file
+    SKIP_HEADER = 1;
+
+-- JSON file format for the partition stats sidecars
+CREATE OR REPLACE FILE FORMAT gcs_json_format
+    TYPE = 'json';
+
+-- Parquet file format for curated files written with "output_format": "parquet".
+-- Columns are typed in the file, so they can be selected by name, e.g. $1:"Latitude"::NUMERIC(9,6)
+CREATE OR REPLACE FILE FORMAT gcs_parquet_format
+    TYPE = 'parquet'
+    BINARY_AS_TEXT = FALSE;
+
+
+-- Each partition's _stats.json sidecar holds its rows, latitude and longitude [min, max] and
+-- distinct crime types, so partitions can be picked out before loading them
+SELECT
+      METADATA$FILENAME AS stats_file
+    , $1:rows::NUMBER AS row_count
+    , $1:latitude[0]::FLOAT AS min_latitude
+    , $1:latitude[1]::FLOAT AS max_latitude
+    , $1:longitude[0]::FLOAT AS min_longitude
+    , $1:longitude[1]::FLOAT AS max_longitude
+    , $1:types AS crime_types
+FROM @crime_data_stage/data_set=street/ (file_format => 'gcs_json_format', pattern => '.*/force=.*/_stats[.]json');
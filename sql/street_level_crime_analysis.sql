@@ -2,7 +2,6 @@
 MERGE INTO crime_data_uk.public.street_level_crime AS dest
 USING
 (
-WITH staged_data AS (
     SELECT
           t.$1 AS crime_id
         , t.$2 AS month
@@ -16,45 +15,16 @@ WITH staged_data AS (
         , t.$10 AS crime_type
         , t.$11 AS last_outcome_category
         , t.$12 AS context
-    FROM @crime_data_stage (file_format => 'gcs_csv_format') t
-)
-SELECT
-    UUID_STRING() AS id
-    , crime_id
-    , month
-    , reported_by
-    , falls_within
-    , longitude
-    , latitude
-    , location
-    , lsoa_code
-    , lsoa_name
-    , crime_type
-    , last_outcome_category
-    , context
-FROM staged_data
-)
-AS stg
-ON dest.id = stg.id
-WHEN MATCHED THEN
-UPDATE SET
-      dest.crime_id              = stg.crime_id
-    , dest.month                 = stg.month
-    , dest.reported_by           = stg.reported_by
-    , dest.falls_within          = stg.falls_within
-    , dest.longitude             = stg.longitude
-    , dest.latitude              = stg.latitude
-    , dest.location              = stg.location
-    , dest.lsoa_code             = stg.lsoa_code
-    , dest.lsoa_name             = stg.lsoa_name
-    , dest.crime_type            = stg.crime_type
-    , dest.last_outcome_category = stg.last_outcome_category
-    , dest.context               = stg.context
+        , t.$13 AS row_key
+    -- Narrow the path to a month, e.g. @crime_data_stage/data_set=street/month=2023-03/, to only merge that month
+    FROM @crime_data_stage/data_set=street/ (file_format => 'gcs_csv_format', pattern => '.*/part-[0-9]+[.]csv') t
+) AS stg
+-- Row keys hash each row's content, so a row already loaded is never inserted again
+ON dest.row_key = stg.row_key
 WHEN NOT MATCHED THEN
 INSERT
 (
-      id
-    , crime_id
+      crime_id
     , month
     , reported_by
     , falls_within
@@ -66,11 +36,11 @@ INSERT
     , crime_type
     , last_outcome_category
     , context
+    , row_key
 )
 VALUES
 (
-      stg.id
-    , stg.crime_id
+      stg.crime_id
     , stg.month
     , stg.reported_by
     , stg.falls_within
@@ -82,6 +52,7 @@ VALUES
     , stg.crime_type
     , stg.last_outcome_category
     , stg.context
+    , stg.row_key
 )
 ;
 
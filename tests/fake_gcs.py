@@ -0,0 +1,372 @@
+import io
+import os
+import zlib
+import base64
+import itertools
+import threading
+from collections.abc import MutableMapping
+
+
+class FakeBlob():
+    """Stand-in for google.cloud.storage.Blob, backed by its client's object store"""
+
+    def __init__(self, bucket, name) -> None:
+        self.bucket = bucket
+        self.name = name
+        # Like the real blob, metadata set before an upload is stored with it
+        self.metadata = bucket.client.object_metadata.get((bucket.name, name))
+
+
+    @property
+    def objects(self):
+        return self.bucket.client.buckets[self.bucket.name]
+
+
+    @property
+    def generation(self):
+        return self.bucket.client.get_generation(self.bucket.name, self.name)
+
+
+    @property
+    def crc32c(self):
+        if not self.exists():
+            return None
+        return base64.b64encode(zlib.crc32(self.objects[self.name]).to_bytes(4, 'big')).decode()
+
+
+    @property
+    def size(self):
+        return len(self.objects[self.name]) if self.exists() else None
+
+
+    def upload_from_string(self, data, content_type=None):
+        self.bucket.client.maybe_fail()
+        self.objects[self.name] = data.encode('utf-8') if isinstance(data, str) else bytes(data)
+        self.bucket.client.set_generation(self.bucket.name, self.name)
+        self.bucket.client.object_metadata[(self.bucket.name, self.name)] = self.metadata
+
+
+    def upload_from_filename(self, filename):
+        with open(filename, 'rb') as upload_file:
+            self.upload_from_string(upload_file.read())
+
+
+    def download_as_bytes(self, start=None, end=None):
+        data = self.objects[self.name]
+        if start is not None or end is not None:
+            # GCS ranges are inclusive of end
+            data = data[start or 0:None if end is None else end + 1]
+        return data
+
+
+    def download_as_string(self, start=None, end=None):
+        return self.download_as_bytes(start, end)
+
+
+    def download_to_filename(self, filename):
+        with open(filename, 'wb') as download_file:
+            download_file.write(self.download_as_bytes())
+
+
+    def open(self, mode='r', **kwargs):
+        if 'r' in mode:
+            data = io.BytesIO(self.download_as_bytes())
+            return data if 'b' in mode else io.TextIOWrapper(data, encoding='utf-8')
+        writer = FakeBlobWriter(self)
+        return writer if 'b' in mode else io.TextIOWrapper(writer, encoding='utf-8', newline='')
+
+
+    def compose(self, sources):
+        self.upload_from_string(b"".join(source.download_as_bytes() for source in sources))
+
+
+    def delete(self):
+        del self.objects[self.name]
+
+
+    def exists(self):
+        return self.name in self.objects
+
+
+class FakeBlobWriter(io.BytesIO):
+    """Buffer writes and store them on the blob when closed, like a resumable upload"""
+
+    def __init__(self, blob) -> None:
+        super().__init__()
+        self.blob = blob
+
+
+    def close(self):
+        if not self.closed:
+            self.blob.upload_from_string(self.getvalue())
+        super().close()
+
+
+class FakeBucket():
+
+    def __init__(self, client, name) -> None:
+        self.client = client
+        self.name = name
+
+
+    def blob(self, blob_name):
+        return FakeBlob(self, blob_name)
+
+
+    def get_blob(self, blob_name):
+        blob = FakeBlob(self, blob_name)
+        return blob if blob.exists() else None
+
+
+    def copy_blob(self, blob, destination_bucket, new_name=None):
+        new_blob = destination_bucket.blob(new_name or blob.name)
+        new_blob.upload_from_string(blob.download_as_bytes())
+        return new_blob
+
+
+    def delete_blobs(self, blobs):
+        for blob in blobs:
+            blob.delete()
+
+
+    def delete_blob(self, blob_name):
+        batch = self.client.current_batch
+        if batch is not None:
+            batch.deferred.append((self.name, blob_name))
+        else:
+            FakeBlob(self, blob_name).delete()
+
+
+    def delete(self):
+        del self.client.buckets[self.name]
+
+
+class FakeBatch():
+    """
+    Stand-in for bulk_delete.DeleteBatch. Deletes are deferred until the batch
+    exits, then applied in one go with a status code recorded for each, and
+    injected failures give a 503 for that delete only.
+    """
+
+    def __init__(self, client) -> None:
+        self.client = client
+        self.deferred = []
+        self.status_codes = []
+
+
+    def __enter__(self):
+        self.client.local.batch = self
+        return self
+
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.client.local.batch = None
+        if exc_type is None:
+            with self.client.lock:
+                self.client.batch_requests += 1
+            self.status_codes = [self.apply(bucket_name, blob_name) for bucket_name, blob_name in self.deferred]
+
+
+    def apply(self, bucket_name, blob_name):
+        try:
+            self.client.maybe_fail()
+        except ConnectionError:
+            return 503
+        blob = FakeBlob(self.client.bucket(bucket_name), blob_name)
+        if not blob.exists():
+            return 404
+        blob.delete()
+        return 204
+
+
+class FakeBatchSession():
+    """
+    Stand-in for a storage client's HTTP session that answers every request with a
+    multipart batch response, one part per status code, so the real Batch is run
+    """
+
+    def __init__(self, status_codes) -> None:
+        self.status_codes = status_codes
+        self.requests = []
+
+
+    def request(self, method, url, **kwargs):
+        import requests
+        self.requests.append((method, url))
+        response = requests.Response()
+        response.status_code = 200
+        response.headers["content-type"] = 'multipart/mixed; boundary="batch"'
+        response._content = b"".join(
+            b"--batch\r\nContent-Type: application/http\r\nContent-ID: <response-%d>\r\n\r\n"
+            b"HTTP/1.1 %d Status\r\nContent-Length: 0\r\n\r\n\r\n" % (position, status_code)
+            for position, status_code in enumerate(self.status_codes)) + b"--batch--\r\n"
+        return response
+
+
+class FakeStorageClient():
+    """
+    In-memory stand-in for google.cloud.storage.Client. The first `failures`
+    uploads, or deletes in a batch, fail, to exercise retries.
+    """
+
+    def __init__(self, failures=0) -> None:
+        self.buckets = {}
+        self.generations = {}
+        self.object_metadata = {}
+        self.generation_counter = itertools.count(1)
+        self.failures = failures
+        self.lock = threading.Lock()
+        # Like the real client, the current batch is per thread
+        self.local = threading.local()
+        self.batch_requests = 0
+
+
+    @property
+    def current_batch(self):
+        return getattr(self.local, "batch", None)
+
+
+    def maybe_fail(self):
+        with self.lock:
+            if self.failures > 0:
+                self.failures -= 1
+                raise ConnectionError("Injected failure")
+
+
+    def get_generation(self, bucket_name, blob_name):
+        return self.generations.get((bucket_name, blob_name))
+
+
+    def set_generation(self, bucket_name, blob_name):
+        self.generations[(bucket_name, blob_name)] = next(self.generation_counter)
+
+
+    def bucket(self, bucket_name):
+        return FakeBucket(self, bucket_name)
+
+
+    def get_bucket(self, bucket_name):
+        if bucket_name not in self.buckets:
+            raise KeyError(f"Bucket {bucket_name} not found")
+        return FakeBucket(self, bucket_name)
+
+
+    def lookup_bucket(self, bucket_name):
+        return FakeBucket(self, bucket_name) if bucket_name in self.buckets else None
+
+
+    def create_bucket(self, bucket, location=None):
+        self.buckets.setdefault(bucket.name, {})
+        return bucket
+
+
+    def list_buckets(self):
+        return [FakeBucket(self, bucket_name) for bucket_name in self.buckets]
+
+
+    def list_blobs(self, bucket_name, prefix=None):
+        bucket = FakeBucket(self, bucket_name)
+        return [FakeBlob(bucket, blob_name) for blob_name in sorted(self.buckets[bucket_name])
+                if prefix is None or blob_name.startswith(prefix)]
+
+
+class DirectoryObjects(MutableMapping):
+    """The objects of one bucket, stored as files under a directory"""
+
+    def __init__(self, path) -> None:
+        self.path = path
+
+
+    def __getitem__(self, blob_name):
+        try:
+            with open(os.path.join(self.path, blob_name), 'rb') as object_file:
+                return object_file.read()
+        except (FileNotFoundError, IsADirectoryError):
+            raise KeyError(blob_name)
+
+
+    def __setitem__(self, blob_name, data):
+        object_path = os.path.join(self.path, blob_name)
+        os.makedirs(os.path.dirname(object_path), exist_ok=True)
+        # Write then rename, so other processes never see a partial object
+        temp_path = f"{object_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temp_path, 'wb') as object_file:
+            object_file.write(data)
+        os.replace(temp_path, object_path)
+
+
+    def __delitem__(self, blob_name):
+        try:
+            os.remove(os.path.join(self.path, blob_name))
+        except FileNotFoundError:
+            raise KeyError(blob_name)
+
+
+    def __contains__(self, blob_name):
+        return os.path.isfile(os.path.join(self.path, blob_name))
+
+
+    def __iter__(self):
+        for dir_path, _, file_names in os.walk(self.path):
+            for file_name in file_names:
+                if not file_name.endswith(".tmp"):
+                    yield os.path.relpath(os.path.join(dir_path, file_name), self.path).replace(os.sep, "/")
+
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+
+class DirectoryBuckets(MutableMapping):
+    """Buckets stored as directories under a root directory"""
+
+    def __init__(self, root) -> None:
+        self.root = root
+
+
+    def __getitem__(self, bucket_name):
+        if not os.path.isdir(os.path.join(self.root, bucket_name)):
+            raise KeyError(bucket_name)
+        return DirectoryObjects(os.path.join(self.root, bucket_name))
+
+
+    def __setitem__(self, bucket_name, objects):
+        os.makedirs(os.path.join(self.root, bucket_name), exist_ok=True)
+        for blob_name, data in objects.items():
+            self[bucket_name][blob_name] = data
+
+
+    def __delitem__(self, bucket_name):
+        os.rmdir(os.path.join(self.root, bucket_name))
+
+
+    def __iter__(self):
+        return iter(sorted(os.listdir(self.root)))
+
+
+    def __len__(self):
+        return len(os.listdir(self.root))
+
+
+class LocalStorageClient(FakeStorageClient):
+    """
+    Stand-in for google.cloud.storage.Client that keeps buckets as directories
+    under root, so it can be shared with worker processes. Generations are
+    file modification times.
+    """
+
+    def __init__(self, root, failures=0) -> None:
+        super().__init__(failures)
+        os.makedirs(root, exist_ok=True)
+        self.buckets = DirectoryBuckets(root)
+
+
+    def get_generation(self, bucket_name, blob_name):
+        try:
+            return os.stat(os.path.join(self.buckets.root, bucket_name, blob_name)).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+
+    def set_generation(self, bucket_name, blob_name):
+        pass
@@ -0,0 +1,75 @@
+import os
+import re
+import threading
+from contextlib import contextmanager
+from functools import partial
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+
+class RangeRequestHandler(SimpleHTTPRequestHandler):
+    """Serve files from a directory, honouring single byte-range requests like data.police.uk"""
+
+    def do_HEAD(self):
+        self.server.head_requests += 1
+        self.serve(send_body=False)
+
+
+    def do_GET(self):
+        self.serve(send_body=True)
+
+
+    def serve(self, send_body):
+        path = self.translate_path(self.path)
+        if not os.path.isfile(path):
+            self.send_error(404)
+            return
+        if send_body and self.server.failures > 0:
+            self.server.failures -= 1
+            self.send_error(503)
+            return
+
+        with open(path, 'rb') as served_file:
+            data = served_file.read()
+        size = len(data)
+
+        match = re.match(r"bytes=(\d+)-(\d*)", self.headers.get("Range", ""))
+        if match:
+            start = int(match[1])
+            end = int(match[2]) if match[2] else size - 1
+            data = data[start:end + 1]
+            self.server.range_requests.append((start, end))
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+        else:
+            self.send_response(200)
+        self.send_header("Accept-Ranges", "bytes")
+        self.send_header("Content-Length", str(len(data)))
+        if self.server.content_md5 and not match:
+            self.send_header("Content-MD5", self.server.content_md5)
+        self.end_headers()
+        if send_body:
+            self.wfile.write(data)
+
+
+    def log_message(self, format, *args):
+        pass
+
+
+@contextmanager
+def serve_directory(directory, failures=0, content_md5=None):
+    """
+    Run a local range-capable HTTP server, failing the first `failures` GET requests,
+    and sending `content_md5` as the Content-MD5 of whole files when given
+    """
+    server = ThreadingHTTPServer(("127.0.0.1", 0), partial(RangeRequestHandler, directory=directory))
+    server.failures = failures
+    server.content_md5 = content_md5
+    server.range_requests = []
+    server.head_requests = 0
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield server, f"http://127.0.0.1:{server.server_port}"
+    finally:
+        server.shutdown()
+        server.server_close()
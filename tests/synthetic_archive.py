@@ -0,0 +1,56 @@
+import os
+import hashlib
+from glob import glob
+from zipfile import ZipFile, ZIP_DEFLATED
+import numpy as np
+import pandas as pd
+
+EXAMPLES_DIR = "tests/data/.examples"
+DATA_SETS = ["street", "outcomes", "stop-and-search"]
+
+
+def make_months(end_month, count):
+    """The count months up to and including end_month, oldest first"""
+    end = pd.Period(end_month, freq="M")
+    return [str(end - i) for i in reversed(range(count))]
+
+
+def make_forces(count):
+    return [f"force-{i}" for i in range(count)]
+
+
+def load_template(data_set):
+    template_path = sorted(glob(os.path.join(EXAMPLES_DIR, f"*-{data_set}.csv")))[0]
+    return pd.read_csv(template_path, dtype=str, keep_default_na=False)
+
+
+def make_member(template, month, force, rows):
+    """
+    A police.uk shaped CSV of rows cycled from the template. Crime IDs depend on
+    month, force and row only, so street crimes and outcomes share them.
+    """
+    df = template.iloc[np.arange(rows) % len(template)].reset_index(drop=True)
+    force_name = f"{force.replace('-', ' ').title()} Police"
+    if "Month" in df:
+        df["Month"] = month
+    if "Date" in df:
+        df["Date"] = month + df["Date"].str[7:]
+    if "Reported by" in df:
+        df["Reported by"] = force_name
+        df["Falls within"] = force_name
+    if "Crime ID" in df:
+        df["Crime ID"] = [hashlib.sha256(f"{month}-{force}-{row}".encode()).hexdigest() if crime_id else ""
+                          for row, crime_id in enumerate(df["Crime ID"])]
+    return df.to_csv(index=False).encode('utf-8')
+
+
+def make_archive(path, months, forces, rows, data_sets=DATA_SETS):
+    """Write a data.police.uk style archive of months x forces x data sets members with rows rows each"""
+    templates = {data_set: load_template(data_set) for data_set in data_sets}
+    with ZipFile(path, 'w', ZIP_DEFLATED) as zip_file:
+        for month in months:
+            for force in forces:
+                for data_set in data_sets:
+                    zip_file.writestr(f"{month}/{month}-{force}-{data_set}.csv",
+                                      make_member(templates[data_set], month, force, rows))
+    return path
@@ -0,0 +1,118 @@
+import os
+import base64
+import hashlib
+import pytest
+from zipfile import ZipFile
+from tf.gcp.src.utils.archive_downloader import ArchiveDownloader, get_header_md5
+from tests.range_server import serve_directory
+from tests.synthetic_archive import make_archive, make_months, make_forces
+
+
+ARCHIVE_NAME = "2023-03.zip"
+ARCHIVE_PATH = os.path.join("tests/data", ARCHIVE_NAME)
+
+
+def read_archive():
+    with open(ARCHIVE_PATH, 'rb') as archive_file:
+        return archive_file.read()
+
+
+@pytest.fixture
+def downloader():
+    return ArchiveDownloader(segments=4, chunk_size=1024, backoff=0)
+
+
+def test_download_segments(downloader, tmp_path):
+    out_path = str(tmp_path / ARCHIVE_NAME)
+    with serve_directory("tests/data") as (server, base_url):
+        downloader.download(f"{base_url}/{ARCHIVE_NAME}", out_path)
+
+    assert open(out_path, 'rb').read() == read_archive()
+    assert len(server.range_requests) == 4
+    assert not [path for path in os.listdir(tmp_path) if ".part" in path]
+
+
+def test_download_resumes_partial_segment(downloader, tmp_path):
+    out_path = str(tmp_path / ARCHIVE_NAME)
+    first_start, first_end = downloader.get_segment_ranges(len(read_archive()))[0]
+    with open(f"{out_path}.part0", 'wb') as part_file:
+        part_file.write(read_archive()[first_start:first_end // 2])
+
+    with serve_directory("tests/data") as (server, base_url):
+        downloader.download(f"{base_url}/{ARCHIVE_NAME}", out_path)
+
+    assert open(out_path, 'rb').read() == read_archive()
+    assert (first_end // 2, first_end) in server.range_requests
+
+
+def test_download_keeps_segments_after_network_failure(downloader, tmp_path):
+    out_path = str(tmp_path / ARCHIVE_NAME)
+    with open(f"{out_path}.part0", 'wb') as part_file:
+        part_file.write(read_archive()[:100])
+
+    with serve_directory("tests/data", failures=100) as (server, base_url):
+        with pytest.raises(Exception):
+            downloader.download(f"{base_url}/{ARCHIVE_NAME}", out_path)
+
+    assert open(f"{out_path}.part0", 'rb').read() == read_archive()[:100]
+
+
+def test_remove_download_removes_leftover_segments(downloader, tmp_path):
+    out_path = str(tmp_path / ARCHIVE_NAME)
+    for part in range(2):
+        with open(f"{out_path}.part{part}", 'wb') as part_file:
+            part_file.write(b"partial")
+    downloader.remove_download(out_path)
+
+    assert not os.listdir(tmp_path)
+
+
+def test_download_retries_failed_requests(downloader, tmp_path):
+    with serve_directory("tests/data", failures=2) as (server, base_url):
+        downloader.download(f"{base_url}/{ARCHIVE_NAME}", str(tmp_path / ARCHIVE_NAME))
+
+    assert open(tmp_path / ARCHIVE_NAME, 'rb').read() == read_archive()
+
+
+def test_download_verifies_content_md5(downloader, tmp_path):
+    content_md5 = base64.b64encode(hashlib.md5(read_archive()).digest()).decode()
+    with serve_directory("tests/data", content_md5=content_md5) as (server, base_url):
+        downloader.download(f"{base_url}/{ARCHIVE_NAME}", str(tmp_path / ARCHIVE_NAME))
+
+    assert open(tmp_path / ARCHIVE_NAME, 'rb').read() == read_archive()
+
+
+def test_download_checksum_mismatch(downloader, tmp_path):
+    content_md5 = base64.b64encode(hashlib.md5(b"").digest()).decode()
+    with serve_directory("tests/data", content_md5=content_md5) as (server, base_url):
+        with pytest.raises(Exception):
+            downloader.download(f"{base_url}/{ARCHIVE_NAME}", str(tmp_path / ARCHIVE_NAME))
+    assert not os.listdir(tmp_path)
+
+
+def test_get_header_md5():
+    assert get_header_md5({"x-goog-hash": "crc32c=n03x6A==,md5=Ojk9c3dhfxgoKVVHYwFbHQ=="}) == "Ojk9c3dhfxgoKVVHYwFbHQ=="
+    assert get_header_md5({"ETag": '"3a393d73"'}) is None
+
+
+def test_open_remote_reads_only_needed_ranges(downloader, tmp_path):
+    archive_path = make_archive(str(tmp_path / ARCHIVE_NAME), make_months("2023-03", 6), make_forces(8), 200)
+    member = "2023-01/2023-01-force-3-street.csv"
+    with ZipFile(archive_path) as zip_file:
+        expected = zip_file.read(member)
+
+    with serve_directory(str(tmp_path)) as (server, base_url):
+        with downloader.open_remote(f"{base_url}/{ARCHIVE_NAME}", block_size=16 * 1024) as archive:
+            with ZipFile(archive) as zip_file:
+                assert zip_file.read(member) == expected
+
+    assert archive.bytes_fetched < os.path.getsize(archive_path) / 4
+    assert len(server.range_requests) == archive.range_requests
+
+
+def test_download_reuses_cached_archive_headers(downloader, tmp_path):
+    with serve_directory("tests/data") as (server, base_url):
+        for _ in range(2):
+            downloader.download(f"{base_url}/{ARCHIVE_NAME}", str(tmp_path / ARCHIVE_NAME))
+
+    assert server.head_requests == 1
@@ -0,0 +1,449 @@
+import io
+import time
+from functools import partial
+import pandas as pd
+import pytest
+from zipfile import ZipFile
+from google.auth.credentials import AnonymousCredentials
+from google.cloud import storage
+from tf.gcp.src.utils import cloud_storage_utils, bulk_delete, schemas, storage_client as storage_client_module
+from tf.gcp.src.utils.cloud_storage_utils import CloudStorageAPI
+from tf.gcp.src.utils.upload_engine import ConcurrentUploader
+from tf.gcp.src.utils.zip_index import ZipMemberIndex
+from tf.gcp.src.utils.curated_layout import PartitionStats
+from tf.gcp.src.utils.row_keys import RowKeyIndex
+from tf.gcp.src.utils.instrumentation import metrics
+from tf.gcp.src.utils.archive_downloader import ArchiveDownloader
+from tests.range_server import serve_directory
+from tests.fake_gcs import FakeStorageClient, LocalStorageClient, FakeBatch, FakeBatchSession
+from tests.synthetic_archive import make_archive, make_months, make_forces
+
+
+ZIP_PATH = "tests/data/2023-03.zip"
+raw_bucket = "crime-data-uk-raw-test"
+curated_bucket = "crime-data-uk-curated-test"
+
+
+@pytest.fixture
+def storage_client():
+    client = FakeStorageClient()
+    for bucket_name in [raw_bucket, curated_bucket]:
+        client.create_bucket(client.bucket(bucket_name))
+    return client
+
+
+@pytest.fixture
+def gcs(storage_client):
+    obj = CloudStorageAPI(storage_client=storage_client, upload_workers=4)
+    obj.upload_file_to_gcs(raw_bucket, ZIP_PATH)
+    return obj
+
+
+def test_extract_zip_file_to_bucket_retries(gcs, storage_client):
+    # First run persists the member index, so the injected failures hit member uploads
+    gcs.extract_zip_file_to_bucket(raw_bucket, "2023-03", {"record_months": ["2023-03"], "data_sets": ["outcomes"]})
+    storage_client.failures = 2
+    api_request_info = {"record_months": ["2023-03"], "data_sets": ["street"]}
+    gcs.extract_zip_file_to_bucket(raw_bucket, "2023-03", api_request_info)
+
+    with ZipFile(ZIP_PATH) as zip_file:
+        expected = {name: zip_file.read(name) for name in zip_file.namelist()
+                    if name.startswith("2023-03") and name.endswith("street.csv")}
+    raw_objects = storage_client.buckets[raw_bucket]
+    assert {name: raw_objects[name] for name in expected} == expected
+
+
+def test_zip_member_index_persisted_next_to_zip(gcs, storage_client):
+    api_request_info = {"record_months": ["2023-03"], "data_sets": ["street"]}
+    gcs.extract_zip_file_to_bucket(raw_bucket, "2023-03", api_request_info)
+    index = ZipMemberIndex.from_json(storage_client.buckets[raw_bucket]["2023-03.zip.index.json"])
+
+    assert index.source["size"] == len(storage_client.buckets[raw_bucket]["2023-03.zip"])
+    assert index.select(["2021-12"], ["outcomes"]) == ["2021-12/2021-12-metropolitan-outcomes.csv",
+                                                       "2021-12/2021-12-norfolk-outcomes.csv"]
+
+
+def test_extract_zip_file_from_remote_archive(storage_client):
+    """Extracting straight from a range capable server matches extracting the staged zip"""
+    gcs = CloudStorageAPI(storage_client=storage_client)
+    api_request_info = {"record_months": ["2021-12", "2023-03"], "data_sets": ["street", "outcomes"]}
+    with serve_directory("tests/data") as (server, base_url):
+        archive = ArchiveDownloader(backoff=0).open_remote(f"{base_url}/2023-03.zip")
+        gcs.extract_zip_file_to_bucket(raw_bucket, "2023-03", api_request_info, archive)
+
+    with ZipFile(ZIP_PATH) as zip_file:
+        expected = {name: zip_file.read(name) for name in zip_file.namelist()
+                    if name[:7] in api_request_info["record_months"]
+                    and name.endswith(("street.csv", "outcomes.csv"))}
+    raw_objects = storage_client.buckets[raw_bucket]
+    assert "2023-03.zip" not in raw_objects
+    assert {name: raw_objects[name] for name in expected} == expected
+    assert ZipMemberIndex.from_json(raw_objects["2023-03.zip.index.json"]).source["url"].endswith("2023-03.zip")
+
+
+def test_stream_zip_file_to_curated_parquet(gcs, storage_client):
+    api_request_info = {"record_months": ["2023-03"], "data_sets": ["street"], "output_format": "parquet",
+                        "layout": "flat"}
+    gcs.stream_zip_file_to_curated(raw_bucket, "2023-03", api_request_info, curated_bucket)
+
+    actual = pd.read_parquet(io.BytesIO(storage_client.buckets[curated_bucket]["street/2023-03-street.parquet"]))
+    expected = pd.read_csv("tests/data/expected/street/2023-03-street.csv")
+    assert actual["Crime type"].dtype == "category"
+    assert actual["Longitude"].dtype == "float32"
+    expected["Longitude"] = expected["Longitude"].astype("float32")
+    assert actual.astype(object).where(actual.notna(), None).values.tolist() == \
+        expected.astype(object).where(expected.notna(), None).values.tolist()
+
+
+def test_stream_zip_file_to_curated_uses_persisted_index(gcs, storage_client, monkeypatch):
+    """With a valid persisted index, members are streamed without reading the central directory"""
+    api_request_info = {"record_months": ["2023-03"], "data_sets": ["street"], "layout": "flat"}
+    gcs.extract_zip_file_to_bucket(raw_bucket, "2023-03", api_request_info)
+    monkeypatch.setattr(cloud_storage_utils, "ZipFile", None)
+    gcs.stream_zip_file_to_curated(raw_bucket, "2023-03", api_request_info, curated_bucket)
+
+    actual = pd.read_csv(io.BytesIO(storage_client.buckets[curated_bucket]["street/2023-03-street.csv"]))
+    assert actual.equals(pd.read_csv("tests/data/expected/street/2023-03-street.csv"))
+
+
+def test_stream_zip_file_to_hive_in_blocks_matches_curated(gcs, storage_client, monkeypatch):
+    """Members streamed a small block at a time give the same partitions as raw blobs curated whole"""
+    api_request_info = {"record_months": ["2023-03"], "data_sets": ["street", "outcomes"]}
+    gcs.extract_zip_file_to_bucket(raw_bucket, "2023-03", api_request_info)
+    gcs.curate_raw_data(raw_bucket, curated_bucket)
+    curated_objects = dict(storage_client.buckets[curated_bucket])
+
+    storage_client.buckets[curated_bucket].clear()
+    monkeypatch.setattr(schemas, "CSV_BLOCK_SIZE", 1024)
+    gcs.stream_zip_file_to_curated(raw_bucket, "2023-03", api_request_info, curated_bucket)
+    streamed_objects = storage_client.buckets[curated_bucket]
+    part_names = sorted(name for name in curated_objects if "/part-" in name)
+    assert part_names == sorted(name for name in streamed_objects if "/part-" in name)
+    for name in part_names + [name for name in curated_objects if name.endswith(".npy")]:
+        assert streamed_objects[name] == curated_objects[name]
+
+
+def test_curate_raw_data_matches_expected(gcs, storage_client):
+    api_request_info = {"record_months": ["2023-03", "2021-12"], "data_sets": ["street", "outcomes"], "layout": "flat"}
+    gcs.extract_zip_file_to_bucket(raw_bucket, "2023-03", api_request_info)
+    gcs.curate_raw_data(raw_bucket, curated_bucket)
+
+    for blob_name, data in storage_client.buckets[curated_bucket].items():
+        assert pd.read_csv(io.BytesIO(data)).equals(pd.read_csv(f"tests/data/expected/{blob_name}"))
+
+
+def test_curate_raw_data_records_stage_metrics(gcs, storage_client):
+    metrics.reset()
+    api_request_info = {"record_months": ["2023-03"], "data_sets": ["street"], "layout": "flat"}
+    gcs.extract_zip_file_to_bucket(raw_bucket, "2023-03", api_request_info)
+    gcs.curate_raw_data(raw_bucket, curated_bucket)
+
+    curated_bytes = len(storage_client.buckets[curated_bucket]["street/2023-03-street.csv"])
+    assert metrics.totals["member_extract"]["calls"] == 3
+    assert metrics.totals["raw_upload"]["bytes"] == metrics.totals["member_extract"]["bytes"]
+    assert metrics.totals["curated_upload"]["bytes"] == curated_bytes
+    assert "zip_scan" in metrics.summary_table()
+
+
+def test_extract_zip_file_to_bucket_missing_archive(gcs):
+    with pytest.raises(FileNotFoundError, match="2021-12.zip"):
+        gcs.extract_zip_file_to_bucket(raw_bucket, "2021-12", {"record_months": ["2021-12"], "data_sets": ["street"]})
+
+
+def test_curate_raw_data_removes_partial_file(gcs, storage_client, monkeypatch):
+    api_request_info = {"record_months": ["2023-03"], "data_sets": ["street"], "layout": "flat"}
+    gcs.extract_zip_file_to_bucket(raw_bucket, "2023-03", api_request_info)
+    storage_client.buckets[raw_bucket]["2023-03/2023-03-thames-valley-street.csv"] = b"not,a\n\"csv"
+
+    with pytest.raises(Exception):
+        gcs.curate_raw_data(raw_bucket, curated_bucket)
+    assert storage_client.buckets[curated_bucket] == {}
+    # The partial file was only ever finalized under its staging name
+    assert [blob_name for bucket_name, blob_name in storage_client.generations
+            if bucket_name == curated_bucket] == ["_staging/street/2023-03-street.csv"]
+
+
+def test_curate_raw_data_hive_retry_does_not_duplicate_rows(gcs, storage_client):
+    api_request_info = {"record_months": ["2023-03"], "data_sets": ["street"]}
+    gcs.extract_zip_file_to_bucket(raw_bucket, "2023-03", api_request_info)
+    raw_objects = storage_client.buckets[raw_bucket]
+    raw_data = raw_objects["2023-03/2023-03-thames-valley-street.csv"]
+    raw_objects["2023-03/2023-03-thames-valley-street.csv"] = b"not,a\n\"csv"
+    with pytest.raises(Exception):
+        gcs.curate_raw_data(raw_bucket, curated_bucket)
+
+    # The forces written before the failure are already in the row key index
+    raw_objects["2023-03/2023-03-thames-valley-street.csv"] = raw_data
+    gcs.curate_raw_data(raw_bucket, curated_bucket)
+    assert sorted(name for name in storage_client.buckets[curated_bucket] if "/part-" in name) == [
+        f"data_set=street/month=2023-03/force={force}/part-0.csv" for force in ["durham", "sussex", "thames-valley"]]
+
+
+def test_curate_raw_data_skips_unchanged_partitions(gcs, storage_client):
+    api_request_info = {"record_months": ["2023-03", "2021-12"], "data_sets": ["street", "outcomes"], "layout": "flat"}
+    gcs.extract_zip_file_to_bucket(raw_bucket, "2023-03", api_request_info)
+    gcs.curate_raw_data(raw_bucket, curated_bucket)
+    generations = dict(storage_client.generations)
+
+    # Extracting the same archive again uploads new raw generations, but nothing is rebuilt
+    gcs.extract_zip_file_to_bucket(raw_bucket, "2023-03", api_request_info)
+    gcs.curate_raw_data(raw_bucket, curated_bucket)
+    assert [name for name, generation in storage_client.generations.items()
+            if name[0] == curated_bucket and generation != generations[name]] == []
+
+    # Change one raw file, only its partition should be rebuilt
+    changed_blob = storage_client.bucket(raw_bucket).blob("2021-12/2021-12-norfolk-outcomes.csv")
+    changed_blob.upload_from_string(changed_blob.download_as_bytes().rstrip(b"\r\n").rsplit(b"\n", 1)[0] + b"\n")
+    gcs.curate_raw_data(raw_bucket, curated_bucket)
+
+    rebuilt = [blob_name for (bucket_name, blob_name), generation in storage_client.generations.items()
+               if bucket_name == curated_bucket and blob_name in storage_client.buckets[curated_bucket]
+               and generation != generations[(bucket_name, blob_name)]]
+    assert rebuilt == ["outcomes/2021-12-outcomes.csv"]
+    assert sorted(storage_client.buckets[curated_bucket]) == ["outcomes/2021-12-outcomes.csv",
+                                                              "outcomes/2023-03-outcomes.csv",
+                                                              "street/2023-03-street.csv"]
+
+
+def test_curate_raw_data_hive_partitions_with_stats(gcs, storage_client):
+    api_request_info = {"record_months": ["2023-03", "2021-12"], "data_sets": ["street", "outcomes"]}
+    gcs.extract_zip_file_to_bucket(raw_bucket, "2023-03", api_request_info)
+    gcs.curate_raw_data(raw_bucket, curated_bucket)
+    curated_objects = storage_client.buckets[curated_bucket]
+
+    expected = pd.read_csv("tests/data/expected/street/2023-03-street.csv")
+    prefix = "data_set=street/month=2023-03/"
+    part_names = sorted(name for name in curated_objects if name.startswith(prefix) and name.endswith("part-0.csv"))
+    assert part_names[0] == "data_set=street/month=2023-03/force=durham/part-0.csv"
+    actual = pd.concat([pd.read_csv(io.BytesIO(curated_objects[name])) for name in part_names], ignore_index=True)
+    assert actual.drop(columns="Row key").equals(expected)
+    row_key_index = RowKeyIndex.from_bytes(curated_objects[f"{prefix}_row_keys.csv.npy"])
+    assert sorted(actual["Row key"].astype("uint64")) == row_key_index.keys.tolist()
+
+    month_stats = PartitionStats.from_json(curated_objects[f"{prefix}_stats.json"])
+    assert month_stats.rows == len(expected)
+    assert month_stats.latitude == [expected["Latitude"].min(), expected["Latitude"].max()]
+    assert month_stats.longitude == [expected["Longitude"].min(), expected["Longitude"].max()]
+    assert month_stats.types == sorted(expected["Crime type"].unique())
+    force_stats = [PartitionStats.from_json(curated_objects[name.replace("part-0.csv", "_stats.json")])
+                   for name in part_names]
+    assert sum(stats.rows for stats in force_stats) == month_stats.rows
+
+    spatial_index = gcs.load_spatial_index(curated_bucket, "street", "2023-03")
+    assert len(spatial_index) == actual["Latitude"].notna().sum()
+    assert spatial_index.hotspots(top=1000)["Count"].sum() == len(spatial_index)
+    assert gcs.load_spatial_index(curated_bucket, "street", "2021-12") is None
+
+    rollup = gcs.load_rollup(curated_bucket, "street")
+    assert rollup["Month"].astype(str).unique().tolist() == ["2023-03"]
+    assert rollup["Count"].sum() == len(expected)
+    assert gcs.load_rollup(curated_bucket, "stop-and-search") is None
+
+
+def test_curate_raw_data_hive_skips_bad_force_partition(gcs, storage_client):
+    api_request_info = {"record_months": ["2023-03"], "data_sets": ["street"]}
+    gcs.extract_zip_file_to_bucket(raw_bucket, "2023-03", api_request_info)
+    storage_client.buckets[raw_bucket]["2023-03/2023-03-thames-valley-street.csv"] = b"not,a\n\"csv"
+
+    with pytest.raises(Exception):
+        gcs.curate_raw_data(raw_bucket, curated_bucket)
+    assert not [name for name in storage_client.buckets[curated_bucket] if "force=thames-valley" in name]
+
+
+def test_curate_raw_data_hive_only_uploads_new_rows(gcs, storage_client):
+    api_request_info = {"record_months": ["2023-03"], "data_sets": ["street"]}
+    gcs.extract_zip_file_to_bucket(raw_bucket, "2023-03", api_request_info)
+    gcs.curate_raw_data(raw_bucket, curated_bucket)
+    part_names = sorted(name for name in storage_client.buckets[curated_bucket] if "/part-" in name)
+
+    # Re-publishing the same rows writes no new part, one new row is written on its own
+    raw_blob = storage_client.bucket(raw_bucket).blob("2023-03/2023-03-durham-street.csv")
+    raw_data = raw_blob.download_as_bytes()
+    raw_blob.upload_from_string(raw_data)
+    gcs.curate_raw_data(raw_bucket, curated_bucket)
+    assert sorted(name for name in storage_client.buckets[curated_bucket] if "/part-" in name) == part_names
+
+    new_row = raw_data.splitlines()[-1].replace(b"Durham Constabulary", b"Durham Police", 1) + b"\n"
+    raw_blob.upload_from_string(raw_data.rstrip(b"\n") + b"\n" + new_row)
+    gcs.curate_raw_data(raw_bucket, curated_bucket)
+    new_part = pd.read_csv(io.BytesIO(
+        storage_client.buckets[curated_bucket]["data_set=street/month=2023-03/force=durham/part-1.csv"]))
+    assert new_part["Reported by"].tolist() == ["Durham Police"]
+    stats = PartitionStats.from_json(storage_client.buckets[curated_bucket]["data_set=street/month=2023-03/_stats.json"])
+    assert stats.rows == len(pd.read_csv("tests/data/expected/street/2023-03-street.csv")) + 1
+    assert gcs.load_rollup(curated_bucket, "street")["Count"].sum() == stats.rows
+
+
+def test_curate_raw_data_hive_joins_latest_outcomes(gcs, storage_client):
+    api_request_info = {"record_months": ["2023-03"], "data_sets": ["street", "outcomes"]}
+    gcs.extract_zip_file_to_bucket(raw_bucket, "2023-03", api_request_info)
+    street = pd.read_csv("tests/data/expected/street/2023-03-street.csv")
+    crime_id = street["Crime ID"].dropna().iloc[0]
+
+    # A later outcome of a street crime, published with the same month's outcomes
+    raw_blob = next(blob for blob in storage_client.list_blobs(raw_bucket, prefix="2023-03/")
+                    if blob.name.endswith("-outcomes.csv"))
+    raw_data = raw_blob.download_as_bytes().rstrip(b"\n")
+    new_row = f"{crime_id},2023-04,Durham Constabulary,Durham Constabulary,,,No location,,,Offender fined"
+    raw_blob.upload_from_string(raw_data + b"\n" + new_row.encode() + b"\n")
+    gcs.curate_raw_data(raw_bucket, curated_bucket)
+
+    outcome_index = gcs.load_outcome_index(gcs.get_bucket(curated_bucket))
+    assert len(outcome_index) == len(pd.read_csv("tests/data/expected/outcomes/2023-03-outcomes.csv")) + 1
+    latest_outcomes = gcs.load_latest_outcomes(curated_bucket, "2023-03")
+    assert latest_outcomes["Crime ID"].tolist() == [crime_id]
+    assert latest_outcomes["Outcome type"].tolist() == ["Offender fined"]
+    assert latest_outcomes["Outcome month"].astype(str).tolist() == ["2023-04"]
+    curated_objects = storage_client.buckets[curated_bucket]
+    curated_street = pd.concat([pd.read_csv(io.BytesIO(data)) for name, data in curated_objects.items()
+                                if name.startswith("data_set=street/") and "/part-" in name], ignore_index=True)
+    assert latest_outcomes["Row key"].tolist() == \
+        curated_street[curated_street["Crime ID"] == crime_id]["Row key"].astype("uint64").tolist()
+
+
+def test_curate_raw_data_hive_rejoins_street_months_with_later_outcomes(gcs, storage_client):
+    street = pd.read_csv("tests/data/expected/street/2023-03-street.csv")
+    crime_id = street["Crime ID"].dropna().iloc[0]
+    gcs.extract_zip_file_to_bucket(raw_bucket, "2023-03", {"record_months": ["2023-03"], "data_sets": ["street"]})
+    gcs.curate_raw_data(raw_bucket, curated_bucket)
+    assert gcs.load_latest_outcomes(curated_bucket, "2023-03").empty
+
+    # Outcomes curated in a later run reach the street month curated before them
+    api_request_info = {"record_months": ["2023-03"], "data_sets": ["street", "outcomes"]}
+    gcs.extract_zip_file_to_bucket(raw_bucket, "2023-03", api_request_info)
+    raw_blob = next(blob for blob in storage_client.list_blobs(raw_bucket, prefix="2023-03/")
+                    if blob.name.endswith("-outcomes.csv"))
+    new_row = f"{crime_id},2023-04,Durham Constabulary,Durham Constabulary,,,No location,,,Offender fined"
+    raw_blob.upload_from_string(raw_blob.download_as_bytes().rstrip(b"\n") + b"\n" + new_row.encode() + b"\n")
+    street_part = storage_client.buckets[curated_bucket]["data_set=street/month=2023-03/force=durham/part-0.csv"]
+    gcs.curate_raw_data(raw_bucket, curated_bucket)
+
+    assert storage_client.buckets[curated_bucket]["data_set=street/month=2023-03/force=durham/part-0.csv"] == street_part
+    latest_outcomes = gcs.load_latest_outcomes(curated_bucket, "2023-03")
+    assert latest_outcomes["Crime ID"].tolist() == [crime_id]
+    assert latest_outcomes["Outcome type"].tolist() == ["Offender fined"]
+
+    # Outcomes that change no crime's latest outcome leave it as it is
+    latest_outcomes_blob = gcs.get_bucket(curated_bucket).get_blob("data_set=street/month=2023-03/_latest_outcomes.csv")
+    generation = latest_outcomes_blob.generation
+    gcs.merge_outcome_indexes(gcs.get_bucket(curated_bucket), ["2023-03-outcomes.csv"])
+    assert gcs.get_bucket(curated_bucket).get_blob(latest_outcomes_blob.name).generation == generation
+
+
+def test_curate_raw_data_process_pool_matches_inline(tmp_path):
+    """Worker processes share the local filesystem client and give the same curated files as curating inline"""
+    months = make_months("2023-03", 3)
+    archive_path = make_archive(str(tmp_path / "2023-03.zip"), months, make_forces(3), rows=50)
+    api_request_info = {"record_months": months, "data_sets": ["street", "outcomes", "stop-and-search"]}
+
+    curated_objects = []
+    for storage_client, curation_workers in [(FakeStorageClient(), 1), (LocalStorageClient(str(tmp_path / "gcs")), 2)]:
+        for bucket_name in [raw_bucket, curated_bucket]:
+            storage_client.create_bucket(storage_client.bucket(bucket_name))
+        storage_client_factory = partial(LocalStorageClient, str(tmp_path / "gcs"))
+        gcs = CloudStorageAPI(storage_client=storage_client, curation_workers=curation_workers,
+                              storage_client_factory=storage_client_factory)
+        gcs.upload_file_to_gcs(raw_bucket, archive_path)
+        gcs.extract_zip_file_to_bucket(raw_bucket, "2023-03", api_request_info)
+        gcs.curate_raw_data(raw_bucket, curated_bucket)
+        curated_objects.append(dict(storage_client.buckets[curated_bucket]))
+
+    # A part file and stats sidecar per force, and a stats sidecar, row key index, spatial
+    # index and rollup per month, for 3 months and data sets, and a rollup table per data set.
+    # Outcomes months also get an outcome index, merged into one, and street months their
+    # outcomes and crime keys.
+    assert len(curated_objects[0]) == 3 * 3 * (3 * 2 + 4) + 3 + 3 + 1 + 3 + 3
+    assert curated_objects[0] == curated_objects[1]
+
+
+def test_move_temp_file_to_bucket_composes_parts(gcs, storage_client, monkeypatch):
+    monkeypatch.setattr(cloud_storage_utils, "MIN_COMPOSITE_PART_SIZE", 1024)
+    storage_client.buckets[raw_bucket].clear()
+    gcs.move_temp_file_to_bucket(raw_bucket, ZIP_PATH)
+
+    with open(ZIP_PATH, 'rb') as zip_file:
+        assert storage_client.buckets[raw_bucket] == {"2023-03.zip": zip_file.read()}
+
+
+class SlowBlob():
+
+    def __init__(self, uploader, name) -> None:
+        self.uploader = uploader
+        self.name = name
+        self.peak_bytes = 0
+
+
+    def upload_from_string(self, data):
+        self.peak_bytes = self.uploader.bytes_in_flight
+        time.sleep(0.01)
+
+
+def test_uploader_limits_bytes_in_flight():
+    with ConcurrentUploader(max_workers=8, max_bytes_in_flight=300) as uploader:
+        blobs = [SlowBlob(uploader, str(i)) for i in range(20)]
+        for blob in blobs:
+            uploader.submit(blob, b"x" * 100)
+
+    assert max(blob.peak_bytes for blob in blobs) <= 300
+    assert uploader.bytes_in_flight == 0
+
+
+def test_delete_all_blobs_batches_and_retries(gcs, storage_client, monkeypatch):
+    monkeypatch.setattr(bulk_delete, "DeleteBatch", FakeBatch)
+    raw_objects = storage_client.buckets[raw_bucket]
+    for i in range(250):
+        raw_objects[f"2023-03/force-{i}-street.csv"] = b"Crime ID\n"
+    storage_client.failures = 3
+
+    gcs.delete_all_blobs(raw_bucket, prefix="2023-03/")
+
+    assert list(raw_objects) == ["2023-03.zip"]
+    # Three batches of at most 100, plus one retry of the failed deletes
+    assert storage_client.batch_requests == 4
+
+
+def test_delete_batch_keeps_every_status_code():
+    """The real DeleteBatch, over a mocked batch response, reports failures without raising"""
+    client = storage.Client(project="crime-data-uk-test", credentials=AnonymousCredentials())
+    client._http_internal = FakeBatchSession([204, 404, 503])
+
+    failed = bulk_delete.BulkDeleter(client).send_batch(client.bucket(raw_bucket), ["a.csv", "b.csv", "c.csv"])
+    assert failed == ["c.csv"]
+    assert client._http_internal.requests == [("POST", "https://storage.googleapis.com/batch/storage/v1")]
+
+
+def test_bucket_handles_cached_without_metadata_requests(gcs, storage_client, monkeypatch):
+    def get_bucket(bucket_name):
+        raise AssertionError("Bucket metadata should not be fetched")
+    monkeypatch.setattr(storage_client, "get_bucket", get_bucket)
+
+    api_request_info = {"record_months": ["2023-03"], "data_sets": ["street"]}
+    gcs.extract_zip_file_to_bucket(raw_bucket, "2023-03", api_request_info)
+    gcs.curate_raw_data(raw_bucket, curated_bucket)
+
+    assert gcs.get_bucket(raw_bucket) is gcs.get_bucket(raw_bucket)
+    assert gcs.check_bucket_exists(curated_bucket)
+    assert not gcs.check_bucket_exists("crime-data-uk-missing-test")
+
+
+def test_make_storage_client_pools_connections(monkeypatch):
+    monkeypatch.setattr(storage_client_module.google.auth, "default",
+                        lambda scopes: (AnonymousCredentials(), "crime-data-uk-test"))
+    client = storage_client_module.make_storage_client(pool_size=16)
+
+    assert client.project == "crime-data-uk-test"
+    assert client._http.get_adapter("https://storage.googleapis.com")._pool_maxsize == 16
+
+
+def test_raw_archive_current_after_move(storage_client, tmp_path):
+    gcs = CloudStorageAPI(storage_client=storage_client)
+    source = {"size": 15195, "etag": '"abc"'}
+    assert not gcs.is_raw_archive_current(raw_bucket, "2023-03", source)
+
+    gcs.move_temp_file_to_bucket(raw_bucket, ZIP_PATH, source)
+
+    assert gcs.is_raw_archive_current(raw_bucket, "2023-03", source)
+    # A cold cache reads the source back from the blob metadata
+    cold_gcs = CloudStorageAPI(storage_client=storage_client)
+    assert cold_gcs.is_raw_archive_current(raw_bucket, "2023-03", source)
+    assert not cold_gcs.is_raw_archive_current(raw_bucket, "2023-03", {"size": 15195, "etag": '"def"'})
@@ -23,6 +23,8 @@ def parse_cloud_event(cloud_event_data):
     months, data_sets = dpuk.validate_message(cloud_event_data)
     api_request_info = dpuk.validate_months(months)
     api_request_info["data_sets"] = dpuk.validate_crime_data_sets(data_sets)
+    api_request_info["output_format"] = dpuk.validate_output_format(cloud_event_data.get("output_format", "csv"))
+    api_request_info["layout"] = dpuk.validate_layout(cloud_event_data.get("layout", "hive"))
 
     return api_request_info
 
@@ -74,7 +76,7 @@ def upload_zip_to_gcs():
 def test_run_batch_load(create_test_buckets, create_zip_file, upload_zip_to_gcs):
     """Start the test assuming we have already loaded the zip file into the raw bucket."""
     logger.info('Logging started')
-    data_msg = {"months": ["2023-03", "2021-12", "2020-04"], "data_sets": ["street", "outcomes"]}
+    data_msg = {"months": ["2023-03", "2021-12", "2020-04"], "data_sets": ["street", "outcomes"], "layout": "flat"}
     api_request_info = parse_cloud_event(data_msg)
 
     logger.info(f"api_request_data['interval_months']: {api_request_info['interval_months']}")
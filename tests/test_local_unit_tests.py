@@ -1,6 +1,25 @@
+import io
+import os
+import threading
 import pytest
+import numpy as np
+import pandas as pd
+from zipfile import ZipFile
 from tf.gcp.src.utils.data_police_uk_api import DataPoliceUKAPI
+from tf.gcp.src.utils.cloud_storage_utils import CloudStorageAPI
+from tf.gcp.src.utils.zip_index import ZipMemberIndex
+from tf.gcp.src.utils.csv_concat import concat_csv_files, SchemaMismatchError
+from tf.gcp.src.utils.metadata_cache import MetadataCache
+from tf.gcp.src.utils.schemas import read_csv, concat_frames
+from tf.gcp.src.utils.pipeline import StagedPipeline, Stage
+from tf.gcp.src.utils.row_keys import compute_row_keys, ContentCounts, RowKeyIndex
+from tf.gcp.src.utils.spatial_index import SpatialIndexBuilder, SpatialIndex
+from tf.gcp.src.utils.rollups import compute_rollup, combine_rollups, merge_rollups
+from tf.gcp.src.utils.outcome_index import OutcomeIndex, read_latest_outcomes
+from tf.gcp.src.utils.curated_writer import CuratedFileWriter
 from datetime import datetime
+from main import FileMgmtUtils
+from tests.synthetic_archive import make_archive, make_months, make_forces
 
 
 @pytest.fixture
@@ -9,6 +28,13 @@ def dpuk():
     return obj
 
 
+@pytest.fixture
+def gcs():
+    obj = CloudStorageAPI(storage_client=object())
+    obj.api_request_info = {"record_months": ["2023-03"], "data_sets": ["street"]}
+    return obj
+
+
 def test_get_last_updated(dpuk):
     """Test we get a date back in expected format"""
     latest_date = dpuk.get_last_updated()
@@ -48,7 +74,298 @@ def test_get_records_months(dpuk):
     assert expected == records_months
 
 
+def test_get_range_months_intervals(dpuk):
+    assert dpuk.get_range_months_intervals(["2023-03", "2021-12", "2020-04"]) == ["2023-03"]
+    assert dpuk.get_range_months_intervals(["2023-03", "2020-03", "2019-01"]) == ["2023-03", "2020-03"]
+
+
+def test_plan_archive_months(dpuk):
+    """Each month is taken from the newest archive containing it, unused archives are dropped"""
+    archive_plan = dpuk.plan_archive_months(["2017-04", "2020-04", "2023-01", "2023-03"],
+                                            ["2014-04", "2014-05", "2020-03", "2020-04", "2023-02"])
+    assert archive_plan == {"2017-04": ["2014-05"], "2023-01": ["2020-03"], "2023-03": ["2020-04", "2023-02"]}
+
+
 def test_validate_crime_data_sets(dpuk):
     invalid_crime_data_sets = ["stre1et", "outcomes", "stop-and-search"]
     with pytest.raises(Exception):
-        dpuk.validate_crime_data_sets(invalid_crime_data_sets)
\ No newline at end of file
+        dpuk.validate_crime_data_sets(invalid_crime_data_sets)
+
+
+def test_validate_output_format(dpuk):
+    assert dpuk.validate_output_format("parquet") == "parquet"
+    with pytest.raises(Exception):
+        dpuk.validate_output_format("xlsx")
+
+
+def test_validate_layout(dpuk):
+    assert dpuk.validate_layout("flat") == "flat"
+    with pytest.raises(Exception):
+        dpuk.validate_layout("month")
+
+
+def test_validate_stage_workers(dpuk):
+    assert dpuk.validate_stage_workers({"fetch": 3}, {"fetch": 2, "curate": 1}) == {"fetch": 3, "curate": 1}
+    with pytest.raises(Exception):
+        dpuk.validate_stage_workers({"fetch": 0}, {"fetch": 2})
+    with pytest.raises(Exception):
+        dpuk.validate_stage_workers({"unzip": 1}, {"fetch": 2})
+
+
+def test_stream_members_to_writer(gcs):
+    """Streaming members in small chunks gives the same CSV as the raw bucket curation"""
+    curated_file = io.BytesIO()
+    with ZipFile("tests/data/2023-03.zip") as zip_file:
+        index = ZipMemberIndex.from_zip_file(zip_file)
+    members_dict = gcs.make_month_data_set_members_dict(index, "2023-03")
+    with open("tests/data/2023-03.zip", 'rb') as archive_file:
+        with gcs.make_curated_writer(curated_file, "2023-03-street") as writer:
+            gcs.stream_members_to_writer(archive_file, index, members_dict["2023-03-street"], writer,
+                                         block_size=1024)
+    curated_file.seek(0)
+
+    expected = pd.read_csv("tests/data/expected/street/2023-03-street.csv")
+    assert pd.read_csv(curated_file).equals(expected)
+
+
+def test_zip_member_index_read_member():
+    """Members read from their indexed offsets match ZipFile, and non-crime files are skipped"""
+    with ZipFile("tests/data/2023-03.zip") as zip_file, open("tests/data/2023-03.zip", 'rb') as archive_file:
+        index = ZipMemberIndex.from_zip_file(zip_file)
+        for member in index.entries:
+            assert index.read_member(archive_file, member) == zip_file.read(member)
+
+    assert len(index.entries) == 15
+    assert ("2020-03", "west-yorkshire", "stop-and-search") in index.keys
+
+
+def test_zip_member_index_open_member_chunks():
+    """Members opened in small chunks match ZipFile, and a bad CRC is caught at the end"""
+    with ZipFile("tests/data/2023-03.zip") as zip_file, open("tests/data/2023-03.zip", 'rb') as archive_file:
+        index = ZipMemberIndex.from_zip_file(zip_file)
+        member = next(iter(index.entries))
+        with index.open_member(archive_file, member, chunk_size=64) as member_file:
+            assert member_file.read(100) + member_file.read() == zip_file.read(member)
+
+        index.entries[member]["crc"] ^= 1
+        with pytest.raises(Exception, match="CRC"):
+            with index.open_member(archive_file, member, chunk_size=64) as member_file:
+                member_file.read()
+
+
+def test_concat_csv_files():
+    """Headers after the first are dropped and a missing final newline is added"""
+    out_file = io.BytesIO()
+    concat_csv_files([io.BytesIO(b"a,b\n1,2"), io.BytesIO(b"\xef\xbb\xbfa,b\n3,4\n")], out_file)
+    assert out_file.getvalue() == b"a,b\n1,2\n3,4\n"
+
+    with pytest.raises(SchemaMismatchError):
+        concat_csv_files([io.BytesIO(b"a,b\n1,2\n"), io.BytesIO(b"a,c\n3,4\n")], io.BytesIO())
+
+
+def test_concat_csv_files_keeps_crlf():
+    """data.police.uk CSVs end lines with CRLF, which the header and added newlines keep"""
+    out_file = io.BytesIO()
+    concat_csv_files([io.BytesIO(b"\xef\xbb\xbfa,b\r\n1,2"), io.BytesIO(b"a,b\r\n3,4\r\n")], out_file)
+    assert out_file.getvalue() == b"a,b\r\n1,2\r\n3,4\r\n"
+
+
+def test_unzip_concat_csvs_matches_members(tmp_path):
+    """Members are concatenated straight from the zip, leaving only the output next to it"""
+    file_utils = FileMgmtUtils("2023-01", str(tmp_path))
+    make_archive(str(tmp_path / "latest.zip"), make_months("2023-01", 2), make_forces(3), 20)
+    with ZipFile(tmp_path / "latest.zip") as zip_file:
+        expected = pd.concat([pd.read_csv(zip_file.open(f"2023-01/2023-01-{force}-street.csv"))
+                              for force in make_forces(3)], ignore_index=True)
+
+    assert pd.read_csv(file_utils.unzip_concat_csvs()).equals(expected)
+    assert sorted(os.listdir(tmp_path)) == ["2023-01-street.csv", "latest.zip"]
+
+
+def test_unzip_concat_csvs_falls_back_to_pandas(tmp_path):
+    file_utils = FileMgmtUtils("2023-01", str(tmp_path))
+    make_archive(str(tmp_path / "latest.zip"), ["2023-01"], make_forces(2), 5)
+    with ZipFile(tmp_path / "latest.zip", 'a') as zip_file:
+        zip_file.writestr("2023-01/2023-01-force-9-street.csv", b"Crime ID,Month,Extra\r\nabc,2023-01,x\r\n")
+
+    concat_frame = pd.read_csv(file_utils.unzip_concat_csvs())
+    assert len(concat_frame) == 2 * 5 + 1
+    assert concat_frame["Extra"].notna().sum() == 1
+
+
+def test_metadata_cache_expires_and_evicts():
+    now = [0]
+    cache = MetadataCache(maxsize=2, ttl=10, timer=lambda: now[0])
+    loads = []
+    load = lambda key: lambda: loads.append(key) or key
+
+    cache.get("a", load("a"))
+    cache.get("a", load("a"))
+    assert loads == ["a"]
+
+    now[0] = 11
+    cache.get("a", load("a"))
+    cache.get("b", load("b"))
+    cache.get("c", load("c"))
+    cache.get("a", load("a"))
+    assert loads == ["a", "a", "b", "c", "a"]
+
+
+def test_read_csv_typed(tmp_path):
+    """Typed parsing gives categorical labels and the same values in a fraction of the memory"""
+    archive_path = make_archive(str(tmp_path / "2023-03.zip"), ["2023-03"], ["force-0"], 2000, ["street"])
+    with ZipFile(archive_path) as zip_file:
+        data = zip_file.read("2023-03/2023-03-force-0-street.csv")
+
+    typed = read_csv(io.BytesIO(data), "street")
+    default = pd.read_csv(io.BytesIO(data))
+
+    assert typed["Crime type"].dtype == "category"
+    assert typed["Longitude"].dtype == "float32"
+    assert typed.memory_usage(deep=True).sum() * 2 < default.memory_usage(deep=True).sum()
+    typed_csv = typed.to_csv(index=False)
+    assert pd.read_csv(io.StringIO(typed_csv)).equals(default)
+
+
+def test_concat_frames_keeps_categoricals():
+    first = read_csv(io.BytesIO(b"Crime ID,Crime type,Latitude\na,Burglary,51.5\n"), "street")
+    second = read_csv(io.BytesIO(b"Crime ID,Crime type\nb,Drugs\n"), "street")
+    concat_frame = concat_frames([first, second], "street")
+
+    assert concat_frame["Crime type"].dtype == "category"
+    assert concat_frame["Crime type"].tolist() == ["Burglary", "Drugs"]
+    assert concat_frame["Latitude"].isna().tolist() == [False, True]
+
+
+def test_row_keys_stable_and_distinct():
+    df = read_csv("tests/data/expected/street/2023-03-street.csv", "street")
+    keys = compute_row_keys(df, "street", "durham")
+    # The same rows parsed by pandas, with object columns and float64 coordinates, get the same keys
+    assert (compute_row_keys(pd.read_csv("tests/data/expected/street/2023-03-street.csv"), "street", "durham") == keys).all()
+    assert not (compute_row_keys(df, "street", "norfolk") == keys).any()
+
+    # Identical rows get distinct keys, and adding a copy of a row only adds one new key
+    doubled_keys = compute_row_keys(pd.concat([df.iloc[:1], df], ignore_index=True), "street", "durham")
+    assert len(set(doubled_keys)) == len(df) + 1
+    assert set(keys) < set(doubled_keys)
+
+
+def test_row_keys_in_blocks_match_whole_file():
+    df = read_csv("tests/data/expected/street/2023-03-street.csv", "street")
+    df = pd.concat([df, df.iloc[:5], df.iloc[:2]], ignore_index=True)
+    content_counts = ContentCounts()
+    block_keys = [compute_row_keys(df.iloc[start:start + 4], "street", "durham", content_counts)
+                  for start in range(0, len(df), 4)]
+    assert np.concatenate(block_keys).tolist() == compute_row_keys(df, "street", "durham").tolist()
+
+
+def test_row_key_index_contains_and_round_trips():
+    index = RowKeyIndex()
+    index.add(np.array([30, 10, 20], dtype="uint64"))
+    index = RowKeyIndex.from_bytes(index.to_bytes())
+    assert index.keys.tolist() == [10, 20, 30]
+    assert index.contains(np.array([5, 10, 25, 30, 40], dtype="uint64")).tolist() == [False, True, False, True, False]
+
+
+def test_spatial_index_bbox_and_hotspots():
+    df = read_csv("tests/data/expected/street/2023-03-street.csv", "street")
+    df["Row key"] = compute_row_keys(df, "street", "durham")
+    builder = SpatialIndexBuilder("street")
+    builder.add(df.iloc[:10])
+    builder.add(df.iloc[10:])
+    spatial_index = SpatialIndex.from_bytes(builder.build().to_bytes())
+
+    bbox = (51.0, -2.0, 53.0, 0.0)
+    inside = df[df["Latitude"].between(bbox[0], bbox[2]) & df["Longitude"].between(bbox[1], bbox[3])]
+    assert 0 < len(inside) < len(df)
+    assert sorted(spatial_index.query_bbox(*bbox)["Row key"]) == sorted(inside["Row key"])
+
+    # Counts are per cell, so the top cell's count is the most rows sharing a cell
+    hotspots = spatial_index.hotspots(top=1, type_label="Criminal damage and arson")
+    cells = df[df["Crime type"] == "Criminal damage and arson"].groupby(
+        [(df["Latitude"] // 0.01), (df["Longitude"] // 0.01)]).size()
+    assert hotspots["Count"].tolist() == [cells.max()]
+    assert spatial_index.hotspots(type_label="Bicycle theft").empty
+
+
+def test_rollups_count_missing_labels_and_merge_by_month():
+    df = read_csv("tests/data/expected/street/2023-03-street.csv", "street")
+    rollup = combine_rollups([compute_rollup(df.iloc[:10], "street", "2023-03", "durham"),
+                              compute_rollup(df.iloc[10:], "street", "2023-03", "durham")], "street")
+    assert rollup["Count"].sum() == len(df)
+    assert rollup["Crime type"].dtype == "category"
+    # Rows without an outcome are counted rather than dropped
+    missing_outcomes = rollup[rollup["Last outcome category"].isna()]["Count"].sum()
+    assert missing_outcomes == df["Last outcome category"].isna().sum()
+
+    # Merging a month again replaces its rows, other months are kept
+    previous = rollup.assign(Month="2023-02")
+    merged = merge_rollups(merge_rollups(previous, [rollup], ["2023-03"], "street"), [rollup], ["2023-03"], "street")
+    assert merged.groupby("Month")["Count"].sum().tolist() == [len(df), len(df)]
+
+
+def test_outcome_index_keeps_latest_outcome():
+    outcomes = read_csv("tests/data/expected/outcomes/2023-03-outcomes.csv", "outcomes")
+    later = outcomes.iloc[:2].assign(Month="2023-04", **{"Outcome type": "Offender fined"})
+    earlier = outcomes.iloc[2:3].assign(Month="2022-01", **{"Outcome type": "Offender fined"})
+    index = OutcomeIndex.from_frame(outcomes, "2023-03")
+    index = OutcomeIndex.from_bytes(index.merge(OutcomeIndex.from_frame(pd.concat([later, earlier]), "2023-04")).to_bytes())
+    assert len(index) == len(outcomes)
+    # Only the later outcomes change a crime's latest outcome
+    assert len(index.get_changed_keys(OutcomeIndex.from_frame(outcomes, "2023-03"))) == 2
+
+    street = outcomes[["Crime ID"]].iloc[:4].assign(**{"Row key": np.arange(4, dtype="uint64")})
+    street.loc[4] = [None, 4]
+    latest_outcomes = index.apply(street)
+    assert latest_outcomes["Row key"].tolist() == [0, 1, 2, 3]
+    assert latest_outcomes["Outcome month"].tolist() == ["2023-04", "2023-04", "2023-02", "2023-02"]
+    assert latest_outcomes["Outcome type"].tolist()[2:] == outcomes["Outcome type"].tolist()[2:4]
+
+
+@pytest.mark.parametrize("output_format", ["csv", "parquet"])
+def test_latest_outcomes_keep_row_keys_over_2_63(output_format):
+    row_keys = np.array([12345678901234567890, 2 ** 64 - 1, 1], dtype="uint64")
+    latest_outcomes = pd.DataFrame({"Row key": row_keys, "Crime ID": ["a", "b", "c"],
+                                    "Outcome type": "Offender fined", "Outcome month": "2023-04"})
+    out_file = io.BytesIO()
+    with CuratedFileWriter(out_file, "outcomes", output_format) as writer:
+        writer.write(latest_outcomes)
+
+    read_back = read_latest_outcomes(out_file.getvalue(), output_format)
+    assert read_back["Row key"].dtype == "uint64"
+    assert read_back["Row key"].tolist() == row_keys.tolist()
+
+
+def test_staged_pipeline_overlaps_stages():
+    """The first item can only finish its second stage once the second item has started its first"""
+    second_started = threading.Event()
+
+    def first(item):
+        if item == 1:
+            second_started.set()
+        return item * 10
+
+    def second(item):
+        assert second_started.wait(timeout=5)
+        return item + 1
+
+    pipeline = StagedPipeline([Stage("first", first), Stage("second", second, workers=2)])
+    assert pipeline.run(range(4)) == [1, 11, 21, 31]
+
+
+def test_staged_pipeline_cancels_on_error():
+    fetched, discarded = [], []
+
+    def fetch(item):
+        fetched.append(item)
+        return item
+
+    def fail(item):
+        raise ValueError(f"bad item {item}")
+
+    pipeline = StagedPipeline([Stage("fetch", fetch), Stage("fail", fail, discard=discarded.append)])
+    with pytest.raises(ValueError, match="bad item 0"):
+        pipeline.run(range(100))
+    # The bounded queue stopped fetch from running ahead, and what it had fetched was discarded
+    assert len(fetched) < 5
+    assert sorted(discarded) == fetched[1:]
@@ -81,6 +81,10 @@ resource "google_cloudfunctions2_function" "batch-load-crime-data" {
     available_memory    = "4Gi"
     timeout_seconds     = 540
     available_cpu = "4"
+    environment_variables = {
+      # Curation worker processes, each needs memory for its own pandas and pyarrow
+      CURATION_WORKERS = "1"
+    }
     # ingress_settings = "ALLOW_INTERNAL_ONLY"
     # all_traffic_on_latest_revision = true
     # service_account_email = google_service_account.account.email
@@ -1,50 +1,162 @@
 import os
 import tempfile
+import threading
 import base64
 import json
 import functions_framework
-from utils.data_police_uk_api import DataPoliceUKAPI
-from utils.cloud_storage_utils import CloudStorageAPI
 from utils import log
+from utils.instrumentation import metrics
+from utils.pipeline import StagedPipeline, Stage, PipelineCancelled, POLL_INTERVAL
 
 # setup logging
 logger = log.setup_custom_logger('root')
-dpuk = DataPoliceUKAPI()
-gcs = CloudStorageAPI()
+log.setup_json_logger('root.metrics')
+# Created on first use and reused by warm invocations, so cold starts only
+# import pandas, google-cloud-storage and requests once a request is valid
+dpuk = None
+gcs = None
+# Worker threads per load stage, overridden by "stage_workers" in the message
+STAGE_WORKERS = {"fetch": 2, "stage": 1, "extract": 1, "curate": 1}
+# Downloaded archives held in the in-memory /tmp at once, whatever the fetch workers,
+# e.g. one being staged to the raw bucket while the next downloads
+MAX_ARCHIVES_ON_DISK = 2
+# Curation worker processes, set with the CURATION_WORKERS environment variable. Each one
+# imports pandas and pyarrow, so more than one only fits a function with memory to spare.
+DEFAULT_CURATION_WORKERS = 1
+
+
+def get_dpuk():
+    global dpuk
+    if dpuk is None:
+        from utils.data_police_uk_api import DataPoliceUKAPI
+        dpuk = DataPoliceUKAPI()
+    return dpuk
+
+
+def get_gcs():
+    global gcs
+    if gcs is None:
+        from utils.cloud_storage_utils import CloudStorageAPI
+        gcs = CloudStorageAPI(curation_workers=get_curation_workers())
+    return gcs
+
+
+def get_curation_workers():
+    """CURATION_WORKERS, capped by the CPUs this process may run on rather than the host's"""
+    workers = int(os.environ.get("CURATION_WORKERS", DEFAULT_CURATION_WORKERS))
+    available_cpus = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else os.cpu_count()
+    return max(1, min(workers, available_cpus))
 
 
 def parse_cloud_event(cloud_event):
     """Parse cloud event data to get months and crime data sets to request"""
     cloud_event_data = base64.b64decode(cloud_event.data["message"]["data"]).decode()
     cloud_event_data = json.loads(cloud_event_data)
+    dpuk = get_dpuk()
 
     months, data_sets = dpuk.validate_message(cloud_event_data)
 
     api_request_info = dpuk.validate_months(months)
     api_request_info["data_sets"] = dpuk.validate_crime_data_sets(data_sets)
+    api_request_info["streaming"] = cloud_event_data.get("streaming", False)
+    api_request_info["output_format"] = dpuk.validate_output_format(cloud_event_data.get("output_format", "csv"))
+    api_request_info["layout"] = dpuk.validate_layout(cloud_event_data.get("layout", "hive"))
+    api_request_info["summary_table"] = cloud_event_data.get("summary_table", False)
+    api_request_info["direct"] = cloud_event_data.get("direct", False)
+    api_request_info["stage_workers"] = dpuk.validate_stage_workers(cloud_event_data.get("stage_workers", {}),
+                                                                    STAGE_WORKERS)
 
     return api_request_info
 
 
+def make_load_pipeline(api_request_info, raw_bucket, curated_bucket):
+    """
+    Fetch, stage, extract and curate each archive month in turn, with the stages
+    overlapping so the next archive downloads while this one is extracted and curated
+    """
+    dpuk = get_dpuk()
+    gcs = get_gcs()
+    disk_slots = threading.Semaphore(MAX_ARCHIVES_ON_DISK)
+
+    def reserve_disk_slot():
+        while not disk_slots.acquire(timeout=POLL_INTERVAL):
+            if pipeline.cancelled.is_set():
+                raise PipelineCancelled("Pipeline cancelled")
+
+    def remove_download(load):
+        try:
+            dpuk.remove_zip_file(load["temp_file_path"])
+        finally:
+            disk_slots.release()
+
+    def fetch(month):
+        if api_request_info["direct"]:
+            # Range read only the central directory and required members from data.police.uk
+            return {"month": month, "archive": dpuk.open_zip_file(month)}
+        source = dpuk.get_archive_source(month)
+        # Archives already staged in the raw bucket and unchanged upstream are not downloaded again
+        if gcs.is_raw_archive_current(raw_bucket, month, source):
+            logger.info(f"{month}.zip is already staged in {raw_bucket} and unchanged")
+            return {"month": month, "archive": None}
+        load = {"month": month, "archive": None, "source": source,
+                "temp_file_path": os.path.join(tempfile.gettempdir(), f"{month}.zip")}
+        reserve_disk_slot()
+        try:
+            dpuk.get_zip_file(month, load["temp_file_path"])
+        except Exception:
+            # Segments of a download cut short are kept for the retried invocation to resume
+            disk_slots.release()
+            raise
+        return load
+
+    def stage(load):
+        if "temp_file_path" in load:
+            try:
+                gcs.move_temp_file_to_bucket(raw_bucket, load["temp_file_path"], load["source"])
+            finally:
+                # /tmp is in memory on Cloud Functions, free it once the zip is staged or staging failed
+                remove_download(load)
+        return load
+
+    def discard_download(load):
+        if "temp_file_path" in load:
+            remove_download(load)
+
+    def extract(load):
+        if api_request_info["streaming"]:
+            gcs.stream_zip_file_to_curated(raw_bucket, load["month"], api_request_info, curated_bucket, load["archive"])
+        else:
+            gcs.extract_zip_file_to_bucket(raw_bucket, load["month"], api_request_info, load["archive"])
+        return load
+
+    def curate(load):
+        # Each record month comes from one archive, so its months can be curated once it is extracted
+        gcs.curate_raw_data(raw_bucket, curated_bucket, api_request_info["archive_plan"][load["month"]])
+        return load
+
+    workers = api_request_info["stage_workers"]
+    stages = [
+        Stage("fetch", fetch, workers["fetch"]),
+        Stage("stage", stage, workers["stage"], discard=discard_download),
+        Stage("extract", extract, workers["extract"]),
+    ]
+    if not api_request_info["streaming"]:
+        stages.append(Stage("curate", curate, workers["curate"]))
+    pipeline = StagedPipeline(stages)
+    return pipeline
+
+
 @functions_framework.cloud_event
 def run_batch_load(cloud_event):
     logger.info('Logging started')
+    metrics.reset()
 
     project = "crime-data-uk"
     raw_bucket = f"{project}-raw"
     curated_bucket = f"{project}-curated"
     api_request_info = parse_cloud_event(cloud_event)
 
-    for interval_month in api_request_info["interval_months"]:
-        file_name = f"{interval_month}.zip"
-        temp_file_path = os.path.join(tempfile.gettempdir(), file_name)
-
-        dpuk.get_zip_file(interval_month, temp_file_path)
-        gcs.move_temp_file_to_bucket(raw_bucket, temp_file_path)
-        gcs.extract_zip_file_to_bucket(raw_bucket, interval_month, api_request_info)
-        gcs.curate_raw_data(raw_bucket, curated_bucket)
+    make_load_pipeline(api_request_info, raw_bucket, curated_bucket).run(api_request_info["interval_months"])
 
+    metrics.log_summary(table=api_request_info["summary_table"])
     logger.info('Cloud function complete!')
-
-
-
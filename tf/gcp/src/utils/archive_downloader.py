@@ -0,0 +1,219 @@
+import os
+import glob
+import base64
+import hashlib
+import logging
+import requests
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from .retry import retry_with_backoff
+from .range_file import RangeFile, RANGE_BLOCK_SIZE
+from .metadata_cache import MetadataCache
+from .instrumentation import metrics
+
+logger = logging.getLogger('root')
+
+# Failures a later attempt can resume from, keeping the segments already downloaded
+RESUMABLE_ERRORS = (requests.exceptions.RequestException, IOError)
+
+
+def get_header_md5(headers):
+    """Base64 MD5 of the whole file from Content-MD5 or, as GCS sends it, x-goog-hash, else None"""
+    if headers.get("Content-MD5"):
+        return headers["Content-MD5"]
+    for digest in headers.get("x-goog-hash", "").split(","):
+        name, _, value = digest.strip().partition("=")
+        if name == "md5":
+            return value
+    return None
+
+
+class ArchiveDownloader():
+    """
+    Download archives over HTTP with parallel Range requests per archive and
+    resume from partial segment files
+    """
+
+    def __init__(self, segments=4, chunk_size=1024 * 1024,
+                 retries=3, backoff=1.0, timeout=60, session=None, cache=None) -> None:
+        self.segments = segments
+        self.chunk_size = chunk_size
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.session = session if session else self.make_session()
+        self.cache = cache if cache is not None else MetadataCache()
+
+
+    def make_session(self):
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_maxsize=self.segments)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        return session
+
+
+    def download(self, url, path):
+        """
+        Download url to path, resuming any partial segments left by a previous attempt, and
+        verify its size and the MD5 the server gives for it. A download that fails
+        verification is removed, as resuming it would fail again.
+        """
+        with metrics.stage("download", url=url) as stage:
+            headers = self.get_archive_headers(url)
+            size, accept_ranges = headers["size"], headers["accept_ranges"]
+
+            try:
+                if size and os.path.isfile(path) and os.path.getsize(path) == size:
+                    logger.info(f"{path} already downloaded")
+                elif size and accept_ranges:
+                    self.download_segments(url, path, size)
+                else:
+                    retry_with_backoff(lambda: self.download_whole(url, path),
+                                       retries=self.retries, backoff=self.backoff,
+                                       exceptions=(requests.exceptions.RequestException,))
+
+                self.verify(path, size, headers["md5"])
+            except Exception as err:
+                # The cached headers may be stale if the archive was replaced
+                self.cache.invalidate(("archive", url))
+                if not isinstance(err, RESUMABLE_ERRORS):
+                    self.remove_download(path)
+                raise
+            stage.bytes = os.path.getsize(path)
+        return path
+
+
+    def get_archive_headers(self, url):
+        """Size, range support, ETag and MD5 of url, from a HEAD request cached for the cache's TTL"""
+        return self.cache.get(("archive", url), lambda: self.request_archive_headers(url))
+
+
+    def request_archive_headers(self, url):
+        response = retry_with_backoff(lambda: self.head(url), retries=self.retries,
+                                      backoff=self.backoff,
+                                      exceptions=(requests.exceptions.RequestException,))
+        return {"size": int(response.headers.get("Content-Length", 0)),
+                "accept_ranges": response.headers.get("Accept-Ranges") == "bytes",
+                "etag": response.headers.get("ETag"),
+                "md5": get_header_md5(response.headers)}
+
+
+    def open_remote(self, url, block_size=RANGE_BLOCK_SIZE):
+        """Open url as a seekable file that only transfers the byte ranges read from it"""
+        headers = self.get_archive_headers(url)
+        size = headers["size"]
+        if not size or not headers["accept_ranges"]:
+            err_msg = f"{url} does not support range requests"
+            logger.error(err_msg)
+            raise Exception(err_msg)
+
+        source = {"url": url, "size": size, "etag": headers["etag"]}
+        return RangeFile(url, size, lambda start, end: self.fetch_range(url, start, end),
+                         source=source, block_size=block_size)
+
+
+    def fetch_range(self, url, start, end):
+        return retry_with_backoff(lambda: self.get_range(url, start, end),
+                                  retries=self.retries, backoff=self.backoff,
+                                  exceptions=(requests.exceptions.RequestException, IOError))
+
+
+    def get_range(self, url, start, end):
+        headers = {"Range": f"bytes={start}-{end}"}
+        response = self.session.get(url, headers=headers, timeout=self.timeout)
+        response.raise_for_status()
+        if response.status_code != 206:
+            raise IOError(f"Server ignored range request for {url}")
+        return response.content
+
+
+    def head(self, url):
+        response = self.session.head(url, allow_redirects=True, timeout=self.timeout)
+        response.raise_for_status()
+        return response
+
+
+    def get_segment_ranges(self, size):
+        """Split size bytes into contiguous inclusive (start, end) ranges"""
+        segment_size = -(-size // self.segments)
+        return [(start, min(start + segment_size, size) - 1)
+                for start in range(0, size, segment_size)]
+
+
+    def remove_download(self, path):
+        """Delete path and the segment files of a download to it, finished or not"""
+        for remove_path in [path] + glob.glob(f"{glob.escape(path)}.part*"):
+            if os.path.exists(remove_path):
+                os.remove(remove_path)
+
+
+    def download_segments(self, url, path, size):
+        ranges = self.get_segment_ranges(size)
+        part_paths = [f"{path}.part{i}" for i in range(len(ranges))]
+
+        with ThreadPoolExecutor(max_workers=len(ranges)) as executor:
+            futures = [executor.submit(retry_with_backoff,
+                                       lambda part=part, byte_range=byte_range:
+                                           self.download_segment(url, part, *byte_range),
+                                       self.retries, self.backoff, RESUMABLE_ERRORS)
+                       for part, byte_range in zip(part_paths, ranges)]
+            for future in futures:
+                future.result()
+
+        # The first segment becomes the archive and each later one is removed once appended,
+        # so stitching needs one segment of extra space rather than a second copy
+        os.replace(part_paths[0], path)
+        with open(path, 'ab') as archive_file:
+            for part_path in part_paths[1:]:
+                with open(part_path, 'rb') as part_file:
+                    while chunk := part_file.read(self.chunk_size):
+                        archive_file.write(chunk)
+                os.remove(part_path)
+
+
+    def download_segment(self, url, part_path, start, end):
+        """Fetch bytes start..end into part_path, continuing from what is already on disk"""
+        done = os.path.getsize(part_path) if os.path.isfile(part_path) else 0
+        if start + done > end:
+            return
+
+        headers = {"Range": f"bytes={start + done}-{end}"}
+        with self.session.get(url, headers=headers, stream=True, timeout=self.timeout) as response:
+            response.raise_for_status()
+            if response.status_code != 206:
+                raise IOError(f"Server ignored range request for {url}")
+            with open(part_path, 'ab') as part_file:
+                for chunk in response.iter_content(chunk_size=self.chunk_size):
+                    part_file.write(chunk)
+
+        if os.path.getsize(part_path) != end - start + 1:
+            raise IOError(f"Segment {part_path} incomplete")
+
+
+    def download_whole(self, url, path):
+        with self.session.get(url, stream=True, timeout=self.timeout) as response:
+            response.raise_for_status()
+            with open(path, 'wb') as archive_file:
+                for chunk in response.iter_content(chunk_size=self.chunk_size):
+                    archive_file.write(chunk)
+
+
+    def verify(self, path, size, expected_md5=None):
+        """Check the downloaded size and, when the server gave one, the base64 MD5 checksum"""
+        if size and os.path.getsize(path) != size:
+            err_msg = f"Downloaded {path} is {os.path.getsize(path)} bytes, expected {size}"
+            logger.error(err_msg)
+            raise Exception(err_msg)
+
+        if not expected_md5:
+            logger.info(f"No MD5 given for {path}, verified its size only")
+            return
+        md5 = hashlib.md5()
+        with open(path, 'rb') as archive_file:
+            while chunk := archive_file.read(self.chunk_size):
+                md5.update(chunk)
+        if base64.b64encode(md5.digest()).decode() != expected_md5:
+            err_msg = f"Checksum mismatch for {path}"
+            logger.error(err_msg)
+            raise Exception(err_msg)
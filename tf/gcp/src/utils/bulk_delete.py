@@ -0,0 +1,75 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from google.cloud.storage.batch import Batch
+from .retry import retry_with_backoff
+
+logger = logging.getLogger('root')
+
+# GCS accepts at most 100 calls in one batch request
+MAX_BATCH_SIZE = 100
+
+
+class DeleteBatch(Batch):
+    """
+    Batch that keeps the status of every deferred call instead of raising on the first
+    failure. Client.batch only gains raise_exception after the pinned google-cloud-storage
+    2.7.0, so this overrides the private hook Batch.finish calls with the responses.
+    test_delete_batch_keeps_every_status_code runs it against a batch response.
+    """
+
+    def _finish_futures(self, responses):
+        self.status_codes = [response.status_code for response in responses]
+
+
+class PartialBatchError(Exception):
+    """Raised when some deletes in a batch failed, so only those are retried"""
+
+
+class BulkDeleter():
+    """
+    Delete many blobs through one client, sending up to 100 deletes per batch
+    request and several batches at once. The client's batch stack is thread
+    local, so each worker thread builds its own batch. Objects already gone
+    count as deleted, other failed deletes are retried with backoff.
+    """
+
+    def __init__(self, storage_client, batch_size=MAX_BATCH_SIZE, max_workers=8,
+                 retries=3, backoff=1.0, batch_factory=None) -> None:
+        self.storage_client = storage_client
+        self.batch_size = min(batch_size, MAX_BATCH_SIZE)
+        self.max_workers = max_workers
+        self.retries = retries
+        self.backoff = backoff
+        self.batch_factory = batch_factory if batch_factory else DeleteBatch
+
+
+    def delete_blobs(self, bucket_name, blob_names):
+        """Delete the named blobs, returning how many were deleted"""
+        bucket = self.storage_client.bucket(bucket_name)
+        batches = [blob_names[i:i + self.batch_size] for i in range(0, len(blob_names), self.batch_size)]
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = [executor.submit(self.delete_batch, bucket, batch) for batch in batches]
+            return sum(future.result() for future in futures)
+
+
+    def delete_batch(self, bucket, blob_names):
+        remaining = list(blob_names)
+
+        def send():
+            failed = self.send_batch(bucket, remaining)
+            if failed:
+                remaining[:] = failed
+                raise PartialBatchError(f"{len(failed)} of {len(blob_names)} deletes failed in batch")
+
+        retry_with_backoff(send, retries=self.retries, backoff=self.backoff)
+        return len(blob_names)
+
+
+    def send_batch(self, bucket, blob_names):
+        """Send one batch request, returning the names whose delete failed"""
+        with self.batch_factory(self.storage_client) as batch:
+            for blob_name in blob_names:
+                bucket.delete_blob(blob_name)
+        # 404 means a previous attempt, or someone else, already deleted it
+        return [blob_name for blob_name, status_code in zip(blob_names, batch.status_codes)
+                if not 200 <= status_code < 300 and status_code != 404]
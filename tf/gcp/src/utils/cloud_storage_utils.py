@@ -1,21 +1,63 @@
 import os
 import io
-from google.cloud import storage
+import time
+from contextlib import contextmanager, ExitStack
 import logging
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 from zipfile import ZipFile
-import pandas as pd
+# pandas and pyarrow are imported only where frames are parsed, CSV runs concatenate bytes without them
+from .upload_engine import ConcurrentUploader
+from .bulk_delete import BulkDeleter
+from .storage_client import get_storage_client
+from .metadata_cache import MetadataCache
+from .zip_index import ZipMemberIndex, parse_member_name
+from .range_file import open_blob_range_file
+from .curated_writer import CuratedFileWriter
+from .curated_layout import PartitionStats, get_data_set_prefix, get_partition_prefix, get_partition_blob_name, \
+    get_next_parts, get_part_blob_names, get_stats_blob_name, get_row_key_index_blob_name, \
+    get_spatial_index_blob_name, get_rollup_blob_name, get_combined_rollup_blob_name, \
+    get_outcome_index_blob_name, get_latest_outcomes_blob_name, get_crime_keys_blob_name, get_crime_keys_months, \
+    get_staging_blob_name
+from .curation_manifest import CurationManifest
+from .csv_concat import concat_csv_files, SchemaMismatchError
+from .instrumentation import metrics
+from . import log
 
 logger = logging.getLogger('root')
 
+# Resumable upload chunk buffered in memory per curated file, a multiple of 256 KiB
+UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024
+# GCS composes at most 32 source objects into one
+MAX_COMPOSE_SOURCES = 32
+MIN_COMPOSITE_PART_SIZE = 32 * 1024 * 1024
+# Member index persisted next to each raw zip, e.g. 2023-03.zip.index.json
+ZIP_INDEX_SUFFIX = ".index.json"
+
 class CloudStorageAPI():
 
-    def __init__(self) -> None:
-        self.storage_client = storage.Client()
+    def __init__(self, storage_client=None, upload_workers=8,
+                 max_upload_bytes_in_flight=256 * 1024 * 1024,
+                 curation_workers=1, storage_client_factory=get_storage_client) -> None:
+        self.storage_client = storage_client if storage_client else storage_client_factory()
+        # Bucket handles by name, made without a metadata request
+        self.buckets = {}
+        # Sources of the archives staged in the raw bucket
+        self.cache = MetadataCache()
+        self.upload_workers = upload_workers
+        self.max_upload_bytes_in_flight = max_upload_bytes_in_flight
+        self.curation_workers = curation_workers
+        # Curation worker processes build their own client from this
+        self.storage_client_factory = storage_client_factory
+        # Archives can be curated concurrently, but share one manifest, outcome index and rollup table per data set
+        self.shared_blobs_lock = threading.Lock()
+        # The lock only orders this process, so worker processes leave joining outcomes to the parent
+        self.is_curation_worker = False
 
 
     def list_buckets(self) -> object:
         """Lists all buckets."""
-        self.storage_client = storage.Client()
         buckets = self.storage_client.list_buckets()
         bucket_names = []
         if buckets:
@@ -28,22 +70,21 @@ class CloudStorageAPI():
 
     def delete_bucket(self, bucket_name):
         """Deletes a bucket. The bucket must be empty."""
-        if bucket_name in self.list_buckets():
-            bucket = self.storage_client.get_bucket(bucket_name)
-            bucket.delete()
+        if self.check_bucket_exists(bucket_name):
+            self.get_bucket(bucket_name).delete()
+            self.buckets.pop(bucket_name, None)
             logger.info(f"Bucket {bucket_name} deleted")
         else:
             logger.info(f"Bucket {bucket_name} does not exist")
 
 
     def check_bucket_exists(self, bucket_name) -> bool:
-        if bucket_name in self.list_buckets():
-            return True
-        return False
+        """Look the bucket up by name, rather than listing every bucket in the project"""
+        return self.storage_client.lookup_bucket(bucket_name) is not None
 
 
     def create_bucket(self, bucket_name, storage_class="STANDARD", storage_loc="EUROPE-WEST2"):
-        if bucket_name in self.list_buckets():
+        if self.check_bucket_exists(bucket_name):
             logger.info(f"Bucket {bucket_name} already created")
         else:
             bucket = self.storage_client.bucket(bucket_name)
@@ -54,26 +95,36 @@ class CloudStorageAPI():
 
     def delete_blob(self, bucket_name, blob_name):
         """Deletes a blob from the bucket."""
-        storage_client = storage.Client()
-        bucket = storage_client.bucket(bucket_name)
+        bucket = self.storage_client.bucket(bucket_name)
         blob = bucket.blob(blob_name)
         blob.delete()
         logger.info(f"Blob {blob_name} deleted.")
 
 
-    def delete_all_blobs(self, bucket_name):
-        blob_names = self.list_blobs(bucket_name)
+    def delete_all_blobs(self, bucket_name, prefix=None):
+        """Deletes every blob in the bucket, or only those under prefix, in concurrent batches"""
+        blob_names = self.list_blobs(bucket_name, prefix)
         if blob_names:
-            for blob in blob_names:
-                self.delete_blob(bucket_name, blob)
-
-            logger.info(f"All blobs in {bucket_name} bucket deleted.")
+            deleted = self.make_deleter().delete_blobs(bucket_name, blob_names)
+            self.cache.clear()
+            logger.info(f"{deleted} blobs in {bucket_name} bucket deleted.")
         else:
             logger.info(f"{bucket_name} bucket already empty.")
 
 
+    def make_deleter(self):
+        return BulkDeleter(self.storage_client, max_workers=self.upload_workers)
+
+
+    def get_bucket(self, bucket_name):
+        """Cached handle to the bucket. No metadata GET is made, a missing bucket fails on first use."""
+        if bucket_name not in self.buckets:
+            self.buckets[bucket_name] = self.storage_client.bucket(bucket_name)
+        return self.buckets[bucket_name]
+
+
     def get_bucket_object(self, bucket_name):
-        return self.storage_client.get_bucket(bucket_name)
+        return self.get_bucket(bucket_name)
 
 
     def upload_file_to_gcs(self, bucket_name, file_path):
@@ -87,30 +138,241 @@ class CloudStorageAPI():
         logger.info("Upload complete!")
 
 
-    def move_temp_file_to_bucket(self, bucket_name, temp_blob_path):
+    def make_uploader(self):
+        return ConcurrentUploader(max_workers=self.upload_workers,
+                                  max_bytes_in_flight=self.max_upload_bytes_in_flight)
+
+
+    def move_temp_file_to_bucket(self, bucket_name, temp_blob_path, source=None):
         """
-        Extract zip file stored in tmp directory, move to gcs bucket
-        unzip required files to separate directory
+        Move the zip file stored in tmp directory to the gcs bucket, uploading
+        large files as concurrent parts composed into a single blob. The source
+        size and ETag it was downloaded with are kept in the blob's metadata.
         """
         logging.info("Extracting temp zip file to gcs bucket")
-        bucket = self.storage_client.get_bucket(bucket_name)
-        zip_blob = bucket.blob(os.path.basename(temp_blob_path))
-        zip_blob.upload_from_filename(temp_blob_path)
+        bucket = self.get_bucket(bucket_name)
+        blob_name = os.path.basename(temp_blob_path)
+        zip_blob = bucket.blob(blob_name)
+        if source:
+            zip_blob.metadata = {"source_size": str(source["size"]), "source_etag": source["etag"] or ""}
+        part_size = self.get_composite_part_size(os.path.getsize(temp_blob_path))
+
+        if os.path.getsize(temp_blob_path) <= part_size:
+            zip_blob.upload_from_filename(temp_blob_path)
+        else:
+            self.compose_temp_file(bucket, zip_blob, temp_blob_path, part_size)
+        self.cache.set(("raw_archive", bucket_name, blob_name), source)
+
+
+    def compose_temp_file(self, bucket, zip_blob, temp_blob_path, part_size):
+        blob_name = zip_blob.name
+        part_blobs = []
+        with self.make_uploader() as uploader:
+            with open(temp_blob_path, 'rb') as temp_file:
+                while data := temp_file.read(part_size):
+                    part_blob = bucket.blob(f"{blob_name}.part{len(part_blobs)}")
+                    uploader.submit(part_blob, data)
+                    part_blobs.append(part_blob)
+
+        zip_blob.compose(part_blobs)
+        bucket.delete_blobs(part_blobs)
+        logger.info(f"Composed {blob_name} from {len(part_blobs)} parts")
+
+
+    def get_raw_archive_source(self, bucket_name, query_month):
+        """Source of the month's zip staged in the raw bucket, or None if it is missing or unknown"""
+        blob_name = f"{query_month}.zip"
+        return self.cache.get(("raw_archive", bucket_name, blob_name),
+                              lambda: self.request_raw_archive_source(bucket_name, blob_name))
+
 
+    def request_raw_archive_source(self, bucket_name, blob_name):
+        zip_blob = self.get_bucket(bucket_name).get_blob(blob_name)
+        if zip_blob is None or not zip_blob.metadata or "source_size" not in zip_blob.metadata:
+            return None
+        return {"size": int(zip_blob.metadata["source_size"]),
+                "etag": zip_blob.metadata.get("source_etag") or None}
 
-    def extract_zip_file_to_bucket(self, bucket_name, query_month, api_request_info):
-        """Unzip the file and load contents into raw bucket"""
+
+    def is_raw_archive_current(self, bucket_name, query_month, source):
+        """Whether the staged zip was downloaded from the archive as it is now"""
+        return bool(source["size"]) and self.get_raw_archive_source(bucket_name, query_month) == source
+
+
+    def get_composite_part_size(self, file_size):
+        return max(MIN_COMPOSITE_PART_SIZE, -(-file_size // MAX_COMPOSE_SOURCES))
+
+
+    def extract_zip_file_to_bucket(self, bucket_name, query_month, api_request_info, archive=None):
+        """
+        Unzip the file and load contents into raw bucket. The zip is range read from
+        the raw bucket, or from archive, e.g. a remote data.police.uk RangeFile, if given.
+        """
         self.api_request_info = api_request_info
-        bucket = self.storage_client.get_bucket(bucket_name)
-        zip_blob = bucket.blob(f"{query_month}.zip")
+        bucket = self.get_bucket(bucket_name)
 
         logging.info("Extracting zip to GCS directories")
-        with zip_blob.open(mode='rb') as zip_archive_file:
+        with self.open_zip_archive(bucket, query_month, archive) as zip_archive_file:
+            index = self.get_zip_member_index(bucket, query_month, zip_archive_file)
+            # Only save an extracted file if it has our required month and data set
+            members = index.select(self.get_archive_record_months(query_month), api_request_info["data_sets"])
+            with self.make_uploader() as uploader:
+                for file in members:
+                    self.extract_blob(bucket, file, zip_archive_file, index, uploader)
+
+
+    @contextmanager
+    def open_zip_archive(self, bucket, query_month, archive=None):
+        """Yield a seekable range read file for the month's zip, with a source identifying its version"""
+        if archive is None:
+            zip_blob = bucket.get_blob(f"{query_month}.zip")
+            if zip_blob is None:
+                err_msg = f"Archive '{query_month}.zip' not found in {bucket.name}"
+                logger.error(err_msg)
+                raise FileNotFoundError(err_msg)
+            archive = open_blob_range_file(zip_blob)
+        with archive:
+            yield archive
+        logger.info(f"Read {archive.bytes_fetched} of {archive.size} bytes of {archive.name} "
+                    f"in {archive.range_requests} range requests")
+
+
+    def get_zip_member_index(self, bucket, query_month, zip_archive_file):
+        """Load the member index persisted in the raw bucket, rebuilding it when the zip has changed"""
+        index_name = f"{query_month}.zip{ZIP_INDEX_SUFFIX}"
+        index_blob = bucket.get_blob(index_name)
+        if index_blob:
+            index = ZipMemberIndex.from_json(index_blob.download_as_bytes())
+            if index.source == zip_archive_file.source:
+                logger.info(f"Using persisted member index for {zip_archive_file.name}")
+                return index
+
+        with metrics.stage("zip_scan", blob=zip_archive_file.name) as stage:
             with ZipFile(zip_archive_file) as zip_file:
-                for file in zip_file.namelist():
-                    # Only save an extracted file if it has our required month and data set
-                    if self.target_month(file) and self.target_data_set(file):
-                        self.extract_blob(bucket, file, zip_file)
+                index = ZipMemberIndex.from_zip_file(zip_file, zip_archive_file.source)
+            stage.rows = len(index.entries)
+        index_blob = bucket.blob(index_name)
+        index_blob.upload_from_string(index.to_json(), content_type="application/json")
+        return index
+
+
+    def stream_zip_file_to_curated(self, bucket_name, query_month, api_request_info, dest_bucket, archive=None):
+        """
+        Stream the required zip members straight into the curated bucket,
+        without staging the per-force CSVs in the raw bucket first
+        """
+        self.api_request_info = api_request_info
+        bucket = self.get_bucket(bucket_name)
+        curated_bucket = self.get_bucket(dest_bucket)
+
+        logging.info("Streaming zip members to curated bucket")
+        with self.open_zip_archive(bucket, query_month, archive) as zip_archive_file:
+            # Members are read from the index's offsets, without the central directory
+            index = self.get_zip_member_index(bucket, query_month, zip_archive_file)
+            members_dict = self.make_month_data_set_members_dict(index, query_month)
+            streamed_file_names = [file_name for file_name, members in members_dict.items() if members]
+            for file_names in self.get_curation_phases(streamed_file_names):
+                for file_name in file_names:
+                    members = members_dict[file_name]
+                    if self.get_layout() == "hive":
+                        self.write_hive_partitions(curated_bucket, file_name,
+                                                   self.read_zip_members(zip_archive_file, index, members))
+                        continue
+                    with self.open_curated_writer(curated_bucket, file_name) as writer:
+                        self.stream_members_to_writer(zip_archive_file, index, members, writer)
+                if self.get_layout() == "hive":
+                    self.merge_outcome_indexes(curated_bucket, file_names, streamed_file_names)
+        if self.get_layout() == "hive":
+            self.merge_rollups(curated_bucket, streamed_file_names)
+
+
+    def read_zip_members(self, zip_archive_file, index, members):
+        """Each member with its typed frames, parsed block by block as it is decompressed"""
+        for member in members:
+            yield member, self.iter_zip_member_frames(zip_archive_file, index, member)
+
+
+    def iter_zip_member_frames(self, zip_archive_file, index, member):
+        from .schemas import iter_csv_frames
+        _, data_set = self.get_file_month_and_data_set(member)
+        with index.open_member(zip_archive_file, member) as member_file:
+            yield from iter_csv_frames(member_file, data_set)
+
+
+    def get_archive_record_months(self, query_month):
+        """The record months planned to come from this archive, or all of them without a plan"""
+        archive_plan = self.api_request_info.get("archive_plan", {})
+        return archive_plan.get(query_month, self.api_request_info["record_months"])
+
+
+    def make_month_data_set_members_dict(self, index, query_month):
+        """Group the required zip members by month and data set, in bucket listing order"""
+        members_dict = self.make_month_data_set_dict()
+        for member in index.select(self.get_archive_record_months(query_month), self.api_request_info["data_sets"]):
+            month, data_set = index.get_month_and_data_set(member)
+            members_dict[f"{month}-{data_set}"].append(member)
+        return members_dict
+
+
+    def stream_members_to_writer(self, zip_archive_file, index, members, writer, block_size=None):
+        """Parse each member into typed frames block by block and append them to the curated file writer"""
+        from .schemas import iter_csv_frames
+        for member in members:
+            # Includes writing the frames, which are parsed and written in turn
+            with metrics.stage("parse", member=member) as stage:
+                with index.open_member(zip_archive_file, member) as member_file:
+                    for frame in iter_csv_frames(member_file, writer.data_set, block_size):
+                        writer.write(frame)
+                        stage.rows += len(frame)
+                stage.bytes = index.entries[member]["file_size"]
+            logger.info(f"File '{member}' streamed")
+
+
+    def get_output_format(self):
+        return self.api_request_info.get("output_format", "csv")
+
+
+    def get_layout(self):
+        return self.api_request_info.get("layout", "hive")
+
+
+    def make_curated_writer(self, out_file, file_name):
+        return CuratedFileWriter(out_file, self.get_key_data_set(file_name), self.get_output_format())
+
+
+    def open_curated_file(self, curated_bucket, file_name):
+        return self.open_curated_blob(curated_bucket, self.get_curated_blob_name(file_name))
+
+
+    @contextmanager
+    def open_curated_blob(self, curated_bucket, blob_name):
+        """
+        Write a curated file through a resumable upload to a staging name, and copy it to
+        its curated name once complete. Closing the upload finalizes it even when writing
+        failed, so a partial file must never be uploaded under a name Snowpipe loads.
+        """
+        staging_blob = curated_bucket.blob(get_staging_blob_name(blob_name))
+        try:
+            # Includes producing the data, as chunks are uploaded while it is written
+            with metrics.stage("curated_upload", blob=blob_name) as stage:
+                with staging_blob.open(mode='wb', ignore_flush=True, chunk_size=UPLOAD_CHUNK_SIZE) as curated_file:
+                    yield curated_file
+                    stage.bytes = curated_file.tell()
+                curated_bucket.copy_blob(staging_blob, curated_bucket, blob_name)
+        except Exception:
+            logger.error(f"Writing curated file '{blob_name}' failed, it was not published")
+            raise
+        finally:
+            if staging_blob.exists():
+                staging_blob.delete()
+        logger.info(f"Curated file '{blob_name}' written")
+
+
+    @contextmanager
+    def open_curated_writer(self, curated_bucket, file_name):
+        with self.open_curated_file(curated_bucket, file_name) as curated_file:
+            with self.make_curated_writer(curated_file, file_name) as writer:
+                yield writer
 
 
     def target_month(self, file):
@@ -131,46 +393,85 @@ class CloudStorageAPI():
         return target_data_set
 
 
-    def extract_blob(self,bucket, file, zip_file):
-        zip_blob = bucket.blob(file)
-        zip_blob.upload_from_string(zip_file.read(file))
+    def extract_blob(self, bucket, file, zip_archive_file, index, uploader):
+        """Read the member here, as the archive file is not thread safe, and upload it from the pool"""
+        with metrics.stage("member_extract", member=file) as stage:
+            data = index.read_member(zip_archive_file, file)
+            stage.bytes = len(data)
+        uploader.submit(bucket.blob(file), data)
         logger.info(f"File '{file}' extracted")
 
 
-    def curate_raw_data(self, raw_bucket, dest_bucket):
-        """Concatenate all of these CSVs into a single data frame and save as CSV"""
+    def curate_raw_data(self, raw_bucket, dest_bucket, record_months=None):
+        """
+        Curate the raw CSVs of each month and data set, into a partition per force or with
+        the flat layout a single file, skipping partitions whose raw blobs have not changed
+        since they were last curated. Defaults to all the requested record months.
+        """
         self.dest_bucket = dest_bucket
         self.raw_bucket = raw_bucket
-
-        self.df_dict = self.make_month_data_set_dict()
-        self.populate_month_data_set_dict()
-        self.concat_month_data_set_dict()
+        bucket = self.get_bucket(raw_bucket)
+        manifest = CurationManifest.load(bucket)
+
+        raw_blobs_dict = self.list_month_data_set_blobs(record_months)
+        dirty_partitions = {}
+        for file_name, blobs in raw_blobs_dict.items():
+            fingerprint = CurationManifest.fingerprint(blobs, self.get_output_format(), self.get_layout())
+            if blobs and manifest.is_dirty(file_name, fingerprint):
+                dirty_partitions[file_name] = fingerprint
+        logger.info(f"Curating {len(dirty_partitions)} changed partitions: {list(dirty_partitions)}")
+
+        for partitions in self.get_curation_phases(dirty_partitions):
+            self.concat_month_data_set_dict(raw_blobs_dict, partitions)
+            if self.get_layout() == "hive":
+                self.merge_outcome_indexes(self.get_bucket(dest_bucket), partitions, dirty_partitions)
+        if self.get_layout() == "hive":
+            self.merge_rollups(self.get_bucket(dest_bucket), dirty_partitions)
+
+        # Reloaded so partitions curated meanwhile by another archive are kept
+        with self.shared_blobs_lock:
+            manifest = CurationManifest.load(bucket, reload=True)
+            for file_name, fingerprint in dirty_partitions.items():
+                manifest.update(file_name, fingerprint)
+            manifest.save(bucket)
+
+
+    def get_curation_phases(self, file_names):
+        """
+        Partitions to curate one after another. With the hive layout outcomes come first,
+        so their index is merged before street months are joined with it.
+        """
+        if self.get_layout() != "hive":
+            return [list(file_names)]
+        outcomes = [file_name for file_name in file_names
+                    if self.get_file_month_and_data_set(file_name)[1] == "outcomes"]
+        return [outcomes, [file_name for file_name in file_names if file_name not in outcomes]]
 
 
-    def make_month_data_set_dict(self):
-        df_dict = {}
+    def make_month_data_set_dict(self, record_months=None):
+        month_data_set_dict = {}
         # Create a key with an empty list for each month and crime type combination
-        for record_month in self.api_request_info["record_months"]:
+        for record_month in record_months or self.api_request_info["record_months"]:
             for crime_type in self.api_request_info["data_sets"]:
-                df_dict[f"{record_month}-{crime_type}"] = []
-        logger.info(f"df_dict: {df_dict}")
-        return df_dict
-
+                month_data_set_dict[f"{record_month}-{crime_type}"] = []
+        return month_data_set_dict
 
-    def populate_month_data_set_dict(self):
-        # Loop through all the blobs in the raw bucket
-        logger.info("Loop through all the blobs in the raw bucket")
-        raw_blobs = self.storage_client.list_blobs(self.raw_bucket)
 
-        for blob in raw_blobs:
-            month, data_set = self.get_blob_month_and_data_set(blob)
-            if self.target_month_and_data_set(month, data_set):
-                self.append_to_df_dict(blob, month, data_set)
+    def list_month_data_set_blobs(self, record_months=None):
+        """Group the required blobs in the raw bucket by month and data set, listing each month's folder"""
+        blobs_dict = self.make_month_data_set_dict(record_months)
+        for record_month in record_months or self.api_request_info["record_months"]:
+            logger.info(f"Loop through the {record_month} blobs in the raw bucket")
+            for blob in self.storage_client.list_blobs(self.raw_bucket, prefix=f"{record_month}/"):
+                month, data_set = self.get_blob_month_and_data_set(blob)
+                if self.target_month_and_data_set(month, data_set):
+                    blobs_dict[f"{month}-{data_set}"].append(blob)
+        return blobs_dict
 
 
-    def list_blobs(self, bucket_name):
+    def list_blobs(self, bucket_name, prefix=None):
         """Lists all the blobs in the bucket."""
-        blobs = self.storage_client.list_blobs(bucket_name)
+        blobs = self.storage_client.list_blobs(bucket_name, prefix=prefix)
         blob_names = []
         for blob in blobs:
             blob_names.append(blob.name)
@@ -178,7 +479,10 @@ class CloudStorageAPI():
 
 
     def get_blob_month_and_data_set(self, blob):
-        blob_name = blob.name
+        return self.get_file_month_and_data_set(blob.name)
+
+
+    def get_file_month_and_data_set(self, blob_name):
         file_name = os.path.basename(blob_name).split('.')[0]
         file_month = file_name[:7]
         data_set = file_name.split('-')[-1]
@@ -192,33 +496,473 @@ class CloudStorageAPI():
                 and data_set in self.api_request_info["data_sets"]
 
 
-    def append_to_df_dict(self, blob, file_month, data_set):
-        csv_data = blob.download_as_string()
-        df_csv_data = pd.read_csv(io.StringIO(csv_data.decode('utf-8')), index_col=None, header=0)
-        self.df_dict[f"{file_month}-{data_set}"].append(df_csv_data)
+    def read_raw_blob(self, blob):
+        from .schemas import read_csv
+        _, data_set = self.get_blob_month_and_data_set(blob)
+        with metrics.stage("raw_download", blob=blob.name) as stage:
+            csv_data = blob.download_as_bytes()
+            stage.bytes = len(csv_data)
+        with metrics.stage("parse", blob=blob.name) as stage:
+            df_csv_data = read_csv(io.BytesIO(csv_data), data_set)
+            stage.bytes = len(csv_data)
+            stage.rows = len(df_csv_data)
+        return df_csv_data
 
 
-    def concat_month_data_set_dict(self):
+    def concat_month_data_set_dict(self, raw_blobs_dict, partitions):
+        """
+        Concatenate each partition's raw CSVs into its curated upload. CSV output is
+        copied as bytes, only falling back to pandas when the headers differ.
+        """
         logger.info("Looping through dict of CSVs and concatenating")
-        for file_name, df_list in self.df_dict.items():
-            if df_list:
-                concat_frame = pd.concat(df_list, axis=0, ignore_index=True)
-                csv_buffer = pd.DataFrame.to_csv(concat_frame, index=False)
-                curated_bucket = self.storage_client.get_bucket(self.dest_bucket)
-                data_set = file_name.split('-')[-1]
-                data_set = 'stop-and-search' if data_set == 'search' else data_set
-                csv_blob = curated_bucket.blob(f"{data_set}/{file_name}.csv")
-                csv_blob.upload_from_string(csv_buffer)
+        if self.curation_workers > 1 and len(partitions) > 1:
+            self.curate_partitions_in_pool(raw_blobs_dict, partitions)
+            return
+
+        curated_bucket = self.get_bucket(self.dest_bucket)
+        for file_name in partitions:
+            self.curate_partition(curated_bucket, file_name, raw_blobs_dict[file_name])
+
+
+    def curate_partitions_in_pool(self, raw_blobs_dict, partitions):
+        """
+        Curate each partition in a worker process. Workers are sent blob names rather
+        than data, and write separate curated files, so the output does not depend on
+        scheduling. Results are collected in partition order to raise the first failure.
+        """
+        logger.info(f"Curating {len(partitions)} partitions with {self.curation_workers} worker processes")
+        with ProcessPoolExecutor(max_workers=self.curation_workers,
+                                 mp_context=multiprocessing.get_context("spawn"),
+                                 initializer=init_curation_worker,
+                                 initargs=(self.storage_client_factory,)) as executor:
+            futures = [executor.submit(curate_partition_worker, self.raw_bucket, self.dest_bucket,
+                                       self.api_request_info, file_name,
+                                       [blob.name for blob in raw_blobs_dict[file_name]])
+                       for file_name in partitions]
+            for future in futures:
+                metrics.merge(future.result())
+        if self.get_layout() == "hive":
+            self.join_street_months(self.get_bucket(self.dest_bucket), partitions)
+
+
+    def curate_partition(self, curated_bucket, file_name, blobs):
+        if self.get_layout() == "hive":
+            self.write_hive_partitions(curated_bucket, file_name, self.download_raw_blobs(blobs))
+            return
+        if self.get_output_format() != "csv":
+            self.stream_raw_frames(curated_bucket, file_name, blobs)
+            return
+        try:
+            self.concat_raw_bytes(curated_bucket, file_name, blobs)
+        except SchemaMismatchError as err:
+            logger.warning(f"{err}, concatenating {file_name} with pandas instead")
+            self.concat_raw_frames(curated_bucket, file_name, blobs)
+
+
+    def concat_raw_bytes(self, curated_bucket, file_name, blobs):
+        with self.open_curated_file(curated_bucket, file_name) as curated_file:
+            # Raw blobs are streamed as they are copied, so this includes downloading them
+            with metrics.stage("concat", partition=file_name) as stage:
+                stage.bytes = concat_csv_files(self.open_raw_blobs(blobs), curated_file)
+
+
+    def download_raw_blobs(self, blobs):
+        """Each raw blob with its typed frames, parsed block by block once it is downloaded"""
+        from .schemas import iter_csv_frames
+        for blob in blobs:
+            _, data_set = self.get_blob_month_and_data_set(blob)
+            with metrics.stage("raw_download", blob=blob.name) as stage:
+                data = blob.download_as_bytes()
+                stage.bytes = len(data)
+            yield blob.name, iter_csv_frames(io.BytesIO(data), data_set)
+
+
+    def write_hive_partitions(self, curated_bucket, file_name, force_files):
+        """
+        Write the rows of each force's CSV, given as (name, frames) pairs, that are not in
+        the month's row key index as the next part of the force's partition, with a stats
+        sidecar, saving the month's row key index after each part. Then save the month's
+        combined stats, a spatial index and rollup of all its rows. Outcomes months also get an index of each crime's
+        latest outcome, and street months are joined with the merged one.
+        """
+        import numpy as np
+        from .spatial_index import SpatialIndexBuilder
+        from .rollups import compute_rollup
+        from .outcome_index import OutcomeIndex, hash_crime_ids
+        from .row_keys import RowKeyIndex
+        month, data_set = self.get_file_month_and_data_set(file_name)
+        row_key_index = self.load_row_key_index(curated_bucket, data_set, month)
+        spatial_index_builder = SpatialIndexBuilder(data_set)
+        next_parts = get_next_parts(self.list_blobs(curated_bucket.name, prefix=get_partition_prefix(data_set, month)),
+                                    self.get_output_format())
+        force_stats = []
+        rollups = []
+        month_outcome_index = OutcomeIndex()
+        joins_outcomes = data_set == "street" and not self.is_curation_worker
+        outcome_index = self.load_outcome_index(curated_bucket) if joins_outcomes else None
+        latest_outcomes = []
+        crime_keys = [np.empty(0, dtype="uint64")]
+        for name, frames in force_files:
+            _, force, _ = parse_member_name(name)
+            block_stats = []
+            for df in self.write_hive_partition(curated_bucket, data_set, month, force, frames, row_key_index,
+                                                next_parts.get(force, 0)):
+                # Stats, indexes and rollups cover all the force's rows, the part only those not curated before
+                block_stats.append(PartitionStats.from_frame(df, data_set))
+                spatial_index_builder.add(df)
+                rollups.append(compute_rollup(df, data_set, month, force))
+                if data_set == "outcomes":
+                    month_outcome_index = month_outcome_index.merge(OutcomeIndex.from_frame(df, month))
+                elif data_set == "street":
+                    crime_keys.append(hash_crime_ids(df["Crime ID"].dropna()))
+                    if joins_outcomes:
+                        latest_outcomes.append(outcome_index.apply(df))
+            stats = PartitionStats.merge(data_set, block_stats)
+            self.write_partition_stats(curated_bucket, get_stats_blob_name(data_set, month, force), stats)
+            force_stats.append(stats)
+        if data_set == "outcomes":
+            self.save_outcome_index(curated_bucket, month_outcome_index, month)
+        elif joins_outcomes:
+            self.join_latest_outcomes(curated_bucket, month, RowKeyIndex(np.unique(np.concatenate(crime_keys))),
+                                      outcome_index, latest_outcomes)
+        elif data_set == "street":
+            # Joined by the parent process once the pool is done, see join_street_months
+            self.save_crime_keys(curated_bucket, month, RowKeyIndex(np.unique(np.concatenate(crime_keys))))
+        self.save_spatial_index(curated_bucket, data_set, month, spatial_index_builder)
+        self.save_month_rollup(curated_bucket, data_set, month, rollups)
+        self.write_partition_stats(curated_bucket, get_stats_blob_name(data_set, month),
+                                   PartitionStats.merge(data_set, force_stats))
+
+
+    def write_hive_partition(self, curated_bucket, data_set, month, force, frames, row_key_index, part=0):
+        """
+        Write the force's rows missing from the row key index as a part, a parsed block at
+        a time, yielding each block with its row keys. The part is only created once a
+        block has new rows, and its keys are added to the index and saved once it is uploaded,
+        so a retry after a later force fails does not write its rows again.
+        """
+        import numpy as np
+        from .row_keys import compute_row_keys, ContentCounts
+        from .schemas import ROW_KEY_COLUMN
+        blob_name = get_partition_blob_name(data_set, month, force, self.get_output_format(), part)
+        content_counts = ContentCounts()
+        new_keys = [np.empty(0, dtype="uint64")]
+        rows = 0
+        with ExitStack() as stack:
+            writer = None
+            for df in self.time_parsing(frames, partition=blob_name):
+                df[ROW_KEY_COLUMN] = compute_row_keys(df, data_set, force, content_counts)
+                new_rows = df[~row_key_index.contains(df[ROW_KEY_COLUMN].to_numpy())]
+                if len(new_rows):
+                    if writer is None:
+                        curated_file = stack.enter_context(self.open_curated_blob(curated_bucket, blob_name))
+                        writer = stack.enter_context(CuratedFileWriter(curated_file, data_set,
+                                                                       self.get_output_format()))
+                    writer.write(new_rows)
+                    new_keys.append(new_rows[ROW_KEY_COLUMN].to_numpy())
+                rows += len(df)
+                yield df
+        new_keys = np.concatenate(new_keys)
+        if len(new_keys):
+            row_key_index.add(new_keys)
+            self.save_row_key_index(curated_bucket, data_set, month, row_key_index)
+        logger.info(f"{len(new_keys)} of {rows} rows for {force} are new, {rows - len(new_keys)} already curated")
+
+
+    def time_parsing(self, frames, **fields):
+        """Yield the frames, recording the time spent parsing them as one parse stage"""
+        seconds = 0.0
+        rows = 0
+        frames = iter(frames)
+        while True:
+            start_time = time.perf_counter()
+            df = next(frames, None)
+            seconds += time.perf_counter() - start_time
+            if df is None:
+                break
+            rows += len(df)
+            yield df
+        metrics.record("parse", seconds, rows=rows, **fields)
+
+
+    def load_row_key_index(self, curated_bucket, data_set, month):
+        from .row_keys import RowKeyIndex
+        index_blob = curated_bucket.get_blob(get_row_key_index_blob_name(data_set, month, self.get_output_format()))
+        if index_blob is None:
+            return RowKeyIndex()
+        return RowKeyIndex.from_bytes(index_blob.download_as_bytes())
+
+
+    def save_row_key_index(self, curated_bucket, data_set, month, row_key_index):
+        index_blob = curated_bucket.blob(get_row_key_index_blob_name(data_set, month, self.get_output_format()))
+        index_blob.upload_from_string(row_key_index.to_bytes(), content_type="application/octet-stream")
+
+
+    def write_partition_stats(self, curated_bucket, blob_name, stats):
+        curated_bucket.blob(blob_name).upload_from_string(stats.to_json(), content_type="application/json")
+
+
+    def save_spatial_index(self, curated_bucket, data_set, month, spatial_index_builder):
+        index_blob = curated_bucket.blob(get_spatial_index_blob_name(data_set, month))
+        with metrics.stage("index", blob=index_blob.name) as stage:
+            spatial_index = spatial_index_builder.build()
+            index_data = spatial_index.to_bytes()
+            stage.rows = len(spatial_index)
+            stage.bytes = len(index_data)
+        index_blob.upload_from_string(index_data, content_type="application/octet-stream")
+
+
+    def save_month_rollup(self, curated_bucket, data_set, month, rollups):
+        from .rollups import combine_rollups
+        blob_name = get_rollup_blob_name(data_set, month, self.get_output_format())
+        with metrics.stage("index", blob=blob_name) as stage:
+            rollup = combine_rollups(rollups, data_set)
+            stage.rows = len(rollup)
+        self.write_curated_frame(curated_bucket, blob_name, data_set, rollup)
+
+
+    def write_curated_frame(self, curated_bucket, blob_name, data_set, df):
+        """Write a whole frame as one curated blob, such as a rollup or sidecar table"""
+        with self.open_curated_blob(curated_bucket, blob_name) as curated_file:
+            with CuratedFileWriter(curated_file, data_set, self.get_output_format()) as writer:
+                writer.write(df)
+
+
+    def read_rollup(self, curated_bucket, blob_name, data_set):
+        from .rollups import read_rollup
+        rollup_blob = curated_bucket.get_blob(blob_name)
+        if rollup_blob is None:
+            return None
+        return read_rollup(rollup_blob.download_as_bytes(), data_set, self.get_output_format())
+
+
+    def merge_rollups(self, curated_bucket, file_names):
+        """Replace the curated months' rows of each data set's rollup table with their new month rollups"""
+        from .rollups import merge_rollups
+        months_by_data_set = {}
+        for file_name in file_names:
+            month, data_set = self.get_file_month_and_data_set(file_name)
+            months_by_data_set.setdefault(data_set, []).append(month)
+
+        output_format = self.get_output_format()
+        for data_set, months in months_by_data_set.items():
+            month_rollups = [self.read_rollup(curated_bucket, get_rollup_blob_name(data_set, month, output_format),
+                                              data_set) for month in months]
+            blob_name = get_combined_rollup_blob_name(data_set, output_format)
+            with self.shared_blobs_lock:
+                rollup = merge_rollups(self.read_rollup(curated_bucket, blob_name, data_set),
+                                       [month_rollup for month_rollup in month_rollups if month_rollup is not None],
+                                       months, data_set)
+                self.write_curated_frame(curated_bucket, blob_name, data_set, rollup)
+            logger.info(f"Merged {months} into the {data_set} rollup, {len(rollup)} rows")
+
+
+    def load_rollup(self, bucket_name, data_set):
+        """The data set's rollup table across all curated months, or None if it has none"""
+        return self.read_rollup(self.get_bucket(bucket_name),
+                                get_combined_rollup_blob_name(data_set, self.get_output_format()), data_set)
+
+
+    def load_outcome_index(self, curated_bucket, month=None):
+        """The month's outcome index, or the merged one without a month, empty if not saved yet"""
+        from .outcome_index import OutcomeIndex
+        index_blob = curated_bucket.get_blob(get_outcome_index_blob_name(month))
+        if index_blob is None:
+            return OutcomeIndex()
+        return OutcomeIndex.from_bytes(index_blob.download_as_bytes())
+
+
+    def save_outcome_index(self, curated_bucket, outcome_index, month=None):
+        index_blob = curated_bucket.blob(get_outcome_index_blob_name(month))
+        with metrics.stage("index", blob=index_blob.name) as stage:
+            index_data = outcome_index.to_bytes()
+            stage.rows = len(outcome_index)
+            stage.bytes = len(index_data)
+        index_blob.upload_from_string(index_data, content_type="application/octet-stream")
+
+
+    def merge_outcome_indexes(self, curated_bucket, file_names, curating_file_names=()):
+        """
+        Merge the curated outcomes months' indexes into the one street months are joined with,
+        and rejoin the curated street months whose crimes' latest outcomes changed. Street
+        months among the file names being curated are left to be joined once they are.
+        """
+        months = sorted(month for month, data_set in map(self.get_file_month_and_data_set, file_names)
+                        if data_set == "outcomes")
+        if not months:
+            return
+        curating_months = {month for month, data_set in map(self.get_file_month_and_data_set, curating_file_names)
+                           if data_set == "street"}
+        month_indexes = [self.load_outcome_index(curated_bucket, month) for month in months]
+        with self.shared_blobs_lock:
+            previous_index = outcome_index = self.load_outcome_index(curated_bucket)
+            for month_index in month_indexes:
+                outcome_index = outcome_index.merge(month_index)
+            self.save_outcome_index(curated_bucket, outcome_index)
+            changed_keys = outcome_index.get_changed_keys(previous_index)
+            logger.info(f"Merged the outcomes of {months} into the outcome index, {len(outcome_index)} crimes, "
+                        f"{len(changed_keys)} with a new latest outcome")
+            if len(changed_keys):
+                self.rejoin_street_months(curated_bucket, outcome_index, changed_keys, curating_months)
+
+
+    def rejoin_street_months(self, curated_bucket, outcome_index, changed_keys, skip_months):
+        """Rejoin each curated street month, besides the skipped ones, with a crime among the changed keys"""
+        months = get_crime_keys_months(self.list_blobs(curated_bucket.name, prefix=get_data_set_prefix("street")))
+        for month in sorted(set(months) - set(skip_months)):
+            if self.load_crime_keys(curated_bucket, month).contains(changed_keys).any():
+                self.rejoin_latest_outcomes(curated_bucket, month, outcome_index)
+
+
+    def join_latest_outcomes(self, curated_bucket, month, crime_keys, outcome_index, latest_outcomes):
+        """
+        Save the street month's crime keys and its latest outcomes from the outcome index it
+        was joined with, or rejoin it if outcomes merged since then reach its crimes
+        """
+        with self.shared_blobs_lock:
+            self.save_crime_keys(curated_bucket, month, crime_keys)
+            merged_index = self.load_outcome_index(curated_bucket)
+            if crime_keys.contains(merged_index.get_changed_keys(outcome_index)).any():
+                self.rejoin_latest_outcomes(curated_bucket, month, merged_index)
+            else:
+                self.write_latest_outcomes(curated_bucket, month, latest_outcomes)
+
+
+    def join_street_months(self, curated_bucket, file_names):
+        """Join the street months curated by worker processes with the merged outcome index"""
+        months = sorted(month for month, data_set in map(self.get_file_month_and_data_set, file_names)
+                        if data_set == "street")
+        if not months:
+            return
+        with self.shared_blobs_lock:
+            outcome_index = self.load_outcome_index(curated_bucket)
+            for month in months:
+                self.rejoin_latest_outcomes(curated_bucket, month, outcome_index)
+
+
+    def rejoin_latest_outcomes(self, curated_bucket, month, outcome_index):
+        """Join the Crime IDs and row keys of the street month's curated parts with the outcome index"""
+        from .schemas import read_curated, ROW_KEY_COLUMN
+        output_format = self.get_output_format()
+        part_names = get_part_blob_names(self.list_blobs(curated_bucket.name,
+                                                         prefix=get_partition_prefix("street", month)), output_format)
+        if not part_names:
+            return
+        latest_outcomes = [outcome_index.apply(read_curated(curated_bucket.blob(part_name).download_as_bytes(),
+                                                            "street", output_format, ["Crime ID", ROW_KEY_COLUMN]))
+                           for part_name in part_names]
+        self.write_latest_outcomes(curated_bucket, month, latest_outcomes)
+        logger.info(f"Rejoined {len(part_names)} {month} street parts with the outcome index")
+
+
+    def load_crime_keys(self, curated_bucket, month):
+        """Hashed Crime IDs of the street month, empty if it has not been curated"""
+        from .row_keys import RowKeyIndex
+        keys_blob = curated_bucket.get_blob(get_crime_keys_blob_name(month))
+        if keys_blob is None:
+            return RowKeyIndex()
+        return RowKeyIndex.from_bytes(keys_blob.download_as_bytes())
+
+
+    def save_crime_keys(self, curated_bucket, month, crime_keys):
+        keys_blob = curated_bucket.blob(get_crime_keys_blob_name(month))
+        keys_blob.upload_from_string(crime_keys.to_bytes(), content_type="application/octet-stream")
+
+
+    def write_latest_outcomes(self, curated_bucket, month, latest_outcomes):
+        """Write the street month's crimes with an outcome, typed as outcomes rows"""
+        from .schemas import concat_frames
+        blob_name = get_latest_outcomes_blob_name(month, self.get_output_format())
+        with metrics.stage("index", blob=blob_name) as stage:
+            latest_outcomes = concat_frames(latest_outcomes, "outcomes")
+            stage.rows = len(latest_outcomes)
+        self.write_curated_frame(curated_bucket, blob_name, "outcomes", latest_outcomes)
+
+
+    def load_latest_outcomes(self, bucket_name, month):
+        """Latest outcome of each of the street month's crimes with one, or None if it has not been curated"""
+        from .outcome_index import read_latest_outcomes
+        outcomes_blob = self.get_bucket(bucket_name).get_blob(
+            get_latest_outcomes_blob_name(month, self.get_output_format()))
+        if outcomes_blob is None:
+            return None
+        return read_latest_outcomes(outcomes_blob.download_as_bytes(), self.get_output_format())
+
+
+    def load_spatial_index(self, bucket_name, data_set, month):
+        """The month's spatial index, for bounding box and hotspot queries, or None if it has none"""
+        from .spatial_index import SpatialIndex
+        index_blob = self.get_bucket(bucket_name).get_blob(get_spatial_index_blob_name(data_set, month))
+        if index_blob is None:
+            return None
+        return SpatialIndex.from_bytes(index_blob.download_as_bytes())
+
+
+    def open_raw_blobs(self, blobs):
+        for blob in blobs:
+            with blob.open(mode='rb') as raw_file:
+                yield raw_file
+
+
+    def stream_raw_frames(self, curated_bucket, file_name, blobs):
+        """Append each raw CSV to the curated upload as soon as it is parsed, holding one force file at a time"""
+        with self.open_curated_writer(curated_bucket, file_name) as writer:
+            for blob in blobs:
+                writer.write(self.read_raw_blob(blob))
+
+
+    def concat_raw_frames(self, curated_bucket, file_name, blobs):
+        """Concatenate the parsed raw CSVs on column name, for partitions whose headers differ"""
+        from .schemas import concat_frames
+        df_list = [self.read_raw_blob(blob) for blob in blobs]
+        with metrics.stage("concat", partition=file_name) as stage:
+            concat_frame = concat_frames(df_list, self.get_key_data_set(file_name))
+            stage.rows = len(concat_frame)
+        with self.open_curated_writer(curated_bucket, file_name) as writer:
+            writer.write(concat_frame)
+
+
+    def get_key_data_set(self, file_name):
+        data_set = file_name.split('-')[-1]
+        return 'stop-and-search' if data_set == 'search' else data_set
+
+
+    def get_curated_blob_name(self, file_name):
+        return f"{self.get_key_data_set(file_name)}/{file_name}.{self.get_output_format()}"
 
 
     def download_blob_to_file(self, bucket, blob_name, path):
-        bucket = self.storage_client.get_bucket(bucket)
+        bucket = self.get_bucket(bucket)
         blob = bucket.blob(blob_name)
         if not os.path.exists(path):
             os.makedirs(path)
         blob.download_to_filename(f"{path}/{blob_name}")
 
 
+# Storage API of a curation worker process, created once by init_curation_worker
+worker_storage_api = None
+
+
+def init_curation_worker(storage_client_factory):
+    global worker_storage_api
+    # Spawned processes start without the parent's logging setup
+    log.setup_custom_logger('root')
+    log.setup_json_logger('root.metrics')
+    worker_storage_api = CloudStorageAPI(storage_client=storage_client_factory())
+    worker_storage_api.is_curation_worker = True
 
 
+def curate_partition_worker(raw_bucket, dest_bucket, api_request_info, file_name, blob_names):
+    """
+    Process pool entry point, curates one partition from the names of its raw blobs
+    and returns this process's stage totals for the parent to merge
+    """
+    gcs = worker_storage_api
+    gcs.raw_bucket = raw_bucket
+    gcs.dest_bucket = dest_bucket
+    gcs.api_request_info = api_request_info
 
+    bucket = gcs.storage_client.bucket(raw_bucket)
+    curated_bucket = gcs.storage_client.bucket(dest_bucket)
+    gcs.curate_partition(curated_bucket, file_name, [bucket.blob(blob_name) for blob_name in blob_names])
+    return metrics.drain()
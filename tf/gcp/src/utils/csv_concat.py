@@ -0,0 +1,50 @@
+import logging
+
+logger = logging.getLogger('root')
+
+COPY_BUFFER_SIZE = 1024 * 1024
+
+
+class SchemaMismatchError(Exception):
+    """Raised when a CSV's header differs from the first file's, so bytes cannot be concatenated"""
+
+
+def normalise_header(header):
+    return header.lstrip(b"\xef\xbb\xbf").rstrip(b"\r\n")
+
+
+def get_line_terminator(header_line):
+    return b"\r\n" if header_line.endswith(b"\r\n") else b"\n"
+
+
+def concat_csv_files(sources, out_file, buffer_size=COPY_BUFFER_SIZE):
+    """
+    Concatenate binary CSV streams into out_file without parsing them. The header
+    is written once and every other file's header is checked against it and
+    skipped. Bodies are copied through one reused buffer, so the header and any
+    missing final newline are written with the first file's line terminator.
+    """
+    header = None
+    line_terminator = b"\n"
+    buffer = bytearray(buffer_size)
+    view = memoryview(buffer)
+    body_bytes = 0
+
+    for source in sources:
+        source_header = source.readline()
+        if header is None:
+            header = normalise_header(source_header)
+            line_terminator = get_line_terminator(source_header)
+            out_file.write(header + line_terminator)
+        elif normalise_header(source_header) != header:
+            raise SchemaMismatchError(f"CSV header {source_header[:80]!r} does not match {header[:80]!r}")
+
+        last_byte = b"\n"
+        while size := source.readinto(buffer):
+            out_file.write(view[:size])
+            last_byte = buffer[size - 1:size]
+            body_bytes += size
+        if last_byte != b"\n":
+            out_file.write(line_terminator)
+
+    return body_bytes
@@ -0,0 +1,173 @@
+import re
+import json
+import logging
+
+logger = logging.getLogger('root')
+
+# hive: data_set=street/month=2023-03/force=avon-and-somerset/part-0.csv
+# flat: street/2023-03-street.csv, one file per month and data set
+LAYOUTS = ["hive", "flat"]
+# Later parts of a force partition hold rows that were new when it was curated again
+PART_PATTERN = re.compile(r"force=([^/]+)/part-(\d+)\.(\w+)$")
+STATS_BLOB_NAME = "_stats.json"
+# Keys of the rows in a month's parts of one output format, e.g. _row_keys.csv.npy
+ROW_KEY_INDEX_NAME = "_row_keys.{output_format}.npy"
+# Grid index of all the month's located rows, see spatial_index.py
+SPATIAL_INDEX_NAME = "_spatial_index.npz"
+# Row counts of a month, merged into one table per data set under ROLLUPS_PREFIX, see rollups.py
+ROLLUP_NAME = "_rollup"
+ROLLUPS_PREFIX = "rollups/"
+# Latest outcome of each crime, per outcomes month and merged across them, see outcome_index.py
+OUTCOME_INDEX_NAME = "_outcome_index.npz"
+# Latest outcomes of a street month's crimes, keyed by row key
+LATEST_OUTCOMES_NAME = "_latest_outcomes"
+# Hashed Crime IDs of a street month, to find the months a change of outcomes reaches
+CRIME_KEYS_NAME = "_crime_keys.npy"
+CRIME_KEYS_PATTERN = re.compile(rf"month=([^/]+)/{re.escape(CRIME_KEYS_NAME)}$")
+# Curated files are written here first and copied to their name once complete. Outside
+# the data set prefixes, so Snowpipe never loads a partial file.
+STAGING_PREFIX = "_staging/"
+# The label column whose distinct values each sidecar lists
+STATS_TYPE_COLUMNS = {
+    "street": "Crime type",
+    "outcomes": "Outcome type",
+    "stop-and-search": "Object of search",
+}
+# Coordinates are given to 6 decimal places
+COORDINATE_DECIMALS = 6
+
+
+def get_data_set_prefix(data_set):
+    return f"data_set={data_set}/"
+
+
+def get_partition_prefix(data_set, month, force=None):
+    prefix = f"{get_data_set_prefix(data_set)}month={month}/"
+    return f"{prefix}force={force}/" if force else prefix
+
+
+def get_partition_blob_name(data_set, month, force, output_format, part=0):
+    return f"{get_partition_prefix(data_set, month, force)}part-{part}.{output_format}"
+
+
+def get_next_parts(blob_names, output_format):
+    """Number of the next part of each force partition, from the names of a month's blobs"""
+    next_parts = {}
+    for blob_name in blob_names:
+        match = PART_PATTERN.search(blob_name)
+        if match and match[3] == output_format:
+            next_parts[match[1]] = max(next_parts.get(match[1], 0), int(match[2]) + 1)
+    return next_parts
+
+
+def get_part_blob_names(blob_names, output_format):
+    """Names of the force partitions' parts of one output format, from the names of a month's blobs"""
+    return [blob_name for blob_name in blob_names
+            if (match := PART_PATTERN.search(blob_name)) and match[3] == output_format]
+
+
+def get_staging_blob_name(blob_name):
+    return f"{STAGING_PREFIX}{blob_name}"
+
+
+def get_stats_blob_name(data_set, month, force=None):
+    return f"{get_partition_prefix(data_set, month, force)}{STATS_BLOB_NAME}"
+
+
+def get_row_key_index_blob_name(data_set, month, output_format):
+    return f"{get_partition_prefix(data_set, month)}{ROW_KEY_INDEX_NAME.format(output_format=output_format)}"
+
+
+def get_spatial_index_blob_name(data_set, month):
+    return f"{get_partition_prefix(data_set, month)}{SPATIAL_INDEX_NAME}"
+
+
+def get_rollup_blob_name(data_set, month, output_format):
+    return f"{get_partition_prefix(data_set, month)}{ROLLUP_NAME}.{output_format}"
+
+
+def get_combined_rollup_blob_name(data_set, output_format):
+    return f"{ROLLUPS_PREFIX}data_set={data_set}/rollup.{output_format}"
+
+
+def get_outcome_index_blob_name(month=None):
+    """The month's outcome index, or without a month the one merged across all months"""
+    prefix = get_partition_prefix("outcomes", month) if month else "data_set=outcomes/"
+    return f"{prefix}{OUTCOME_INDEX_NAME}"
+
+
+def get_latest_outcomes_blob_name(month, output_format):
+    return f"{get_partition_prefix('street', month)}{LATEST_OUTCOMES_NAME}.{output_format}"
+
+
+def get_crime_keys_blob_name(month):
+    return f"{get_partition_prefix('street', month)}{CRIME_KEYS_NAME}"
+
+
+def get_crime_keys_months(blob_names):
+    """Street months with saved crime keys, from the names of the street data set's blobs"""
+    return [match[1] for blob_name in blob_names if (match := CRIME_KEYS_PATTERN.search(blob_name))]
+
+
+class PartitionStats():
+    """
+    Row count, coordinate bounds and distinct labels of a curated partition, written
+    next to it so loaders and queries can prune partitions without reading them
+    """
+
+    def __init__(self, data_set, rows=0, latitude=None, longitude=None, types=None) -> None:
+        self.data_set = data_set
+        self.rows = rows
+        # [min, max], or None when the partition has no coordinates
+        self.latitude = latitude
+        self.longitude = longitude
+        self.types = types if types else []
+
+
+    @classmethod
+    def from_frame(cls, df, data_set):
+        type_column = STATS_TYPE_COLUMNS[data_set]
+        types = df[type_column].dropna().unique() if type_column in df else []
+        return cls(data_set, len(df), cls.get_bounds(df, "Latitude"), cls.get_bounds(df, "Longitude"),
+                   sorted(str(value) for value in types))
+
+
+    @staticmethod
+    def get_bounds(df, column):
+        if column not in df or df[column].isna().all():
+            return None
+        return [round(float(df[column].min()), COORDINATE_DECIMALS),
+                round(float(df[column].max()), COORDINATE_DECIMALS)]
+
+
+    @classmethod
+    def merge(cls, data_set, stats_list):
+        """Combined stats of a month's force partitions"""
+        def merge_bounds(bounds_list):
+            bounds_list = [bounds for bounds in bounds_list if bounds]
+            if not bounds_list:
+                return None
+            return [min(bounds[0] for bounds in bounds_list), max(bounds[1] for bounds in bounds_list)]
+
+        return cls(data_set,
+                   sum(stats.rows for stats in stats_list),
+                   merge_bounds([stats.latitude for stats in stats_list]),
+                   merge_bounds([stats.longitude for stats in stats_list]),
+                   sorted(set().union(*[stats.types for stats in stats_list])))
+
+
+    @classmethod
+    def from_json(cls, stats_json):
+        stats = json.loads(stats_json)
+        return cls(stats["data_set"], stats["rows"], stats["latitude"], stats["longitude"], stats["types"])
+
+
+    def to_json(self):
+        return json.dumps({
+            "data_set": self.data_set,
+            "rows": self.rows,
+            "latitude": self.latitude,
+            "longitude": self.longitude,
+            "type_column": STATS_TYPE_COLUMNS[self.data_set],
+            "types": self.types,
+        }, sort_keys=True)
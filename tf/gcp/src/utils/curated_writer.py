@@ -0,0 +1,57 @@
+import logging
+
+logger = logging.getLogger('root')
+
+OUTPUT_FORMATS = ["csv", "parquet"]
+PARQUET_COMPRESSION = "snappy"
+
+
+class CuratedFileWriter():
+    """Append data frames to a binary file object as one curated CSV or Parquet file"""
+
+    def __init__(self, out_file, data_set, output_format="csv") -> None:
+        self.out_file = out_file
+        self.data_set = data_set
+        self.output_format = output_format
+        self.header_written = False
+        self.parquet_writer = None
+        self.columns = None
+
+
+    def write(self, df):
+        # Later frames are aligned to the first one, so rows never shift under the wrong header
+        if self.columns is None:
+            self.columns = list(df.columns)
+        elif list(df.columns) != self.columns:
+            logger.warning(f"Columns {list(df.columns)} differ from {self.columns}, aligning them")
+            df = df.reindex(columns=self.columns)
+
+        if self.output_format == "parquet":
+            self.write_parquet(df)
+        else:
+            df.to_csv(self.out_file, header=not self.header_written, index=False)
+            self.header_written = True
+
+
+    def write_parquet(self, df):
+        # pyarrow is only imported when Parquet is written
+        import pyarrow.parquet as pq
+        from .schemas import to_arrow_table
+        table = to_arrow_table(df, self.data_set)
+        if self.parquet_writer is None:
+            self.parquet_writer = pq.ParquetWriter(self.out_file, table.schema,
+                                                   compression=PARQUET_COMPRESSION)
+        self.parquet_writer.write_table(table)
+
+
+    def close(self):
+        if self.parquet_writer is not None:
+            self.parquet_writer.close()
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -0,0 +1,51 @@
+import json
+import logging
+
+logger = logging.getLogger('root')
+
+# Kept in the raw bucket so Snowpipe never picks it up from the curated bucket
+MANIFEST_BLOB_NAME = "_manifests/curation.json"
+
+
+class CurationManifest():
+    """
+    Records the raw blob sizes and CRC32Cs each curated {month}-{data_set} partition
+    was built from, and its format and layout, so unchanged partitions can be skipped.
+    Generations are left out, as each extract uploads the members again.
+    """
+
+    def __init__(self, partitions=None) -> None:
+        self.partitions = partitions if partitions else {}
+
+
+    @classmethod
+    def load(cls, bucket, reload=False):
+        manifest_blob = bucket.get_blob(MANIFEST_BLOB_NAME)
+        if manifest_blob is None:
+            if not reload:
+                logger.info("No curation manifest found, curating all partitions")
+            return cls()
+        return cls(json.loads(manifest_blob.download_as_bytes()))
+
+
+    def save(self, bucket):
+        manifest_blob = bucket.blob(MANIFEST_BLOB_NAME)
+        manifest_blob.upload_from_string(json.dumps(self.partitions, sort_keys=True),
+                                         content_type="application/json")
+
+
+    @staticmethod
+    def fingerprint(blobs, output_format, layout):
+        return {
+            "output_format": output_format,
+            "layout": layout,
+            "blobs": {blob.name: f"{blob.size}:{blob.crc32c}" for blob in blobs},
+        }
+
+
+    def is_dirty(self, partition, fingerprint):
+        return self.partitions.get(partition) != fingerprint
+
+
+    def update(self, partition, fingerprint):
+        self.partitions[partition] = fingerprint
@@ -1,16 +1,41 @@
-import wget
 import logging
 import time
-import requests
 from datetime import datetime
 from dateutil.relativedelta import relativedelta
+from .curated_writer import OUTPUT_FORMATS
+from .curated_layout import LAYOUTS
+from .metadata_cache import MetadataCache
 
 logger = logging.getLogger('root')
 
+ARCHIVE_URL = "https://data.police.uk/data/archive/{month}.zip"
+# Each monthly archive holds that month and the 35 before it
+ARCHIVE_MONTH_WINDOW = 36
+
 class DataPoliceUKAPI():
 
+    def __init__(self, downloader=None, cache=None) -> None:
+        self._downloader = downloader
+        # Shared with the downloader, for last updated and archive headers
+        self.cache = cache if cache is not None else MetadataCache()
+
+
+    @property
+    def downloader(self):
+        """Created on first use, so validating a request does not import requests"""
+        if self._downloader is None:
+            from .archive_downloader import ArchiveDownloader
+            self._downloader = ArchiveDownloader(cache=self.cache)
+        return self._downloader
+
+
     def get_last_updated(self):
-        """Get the date the database was last updated"""
+        """Get the date the database was last updated, cached across warm invocations"""
+        return self.cache.get(("last_updated",), self.request_last_updated)
+
+
+    def request_last_updated(self):
+        import requests
         try:
             response = requests.get('https://data.police.uk/api/crime-last-updated')
             response.raise_for_status() # raise an exception if the request was unsuccessful
@@ -23,11 +48,11 @@ class DataPoliceUKAPI():
 
     def get_zip_file(self, month, temp_file_path):
         """Downloads batch compressed data from API and stores in temp directory"""
-        url = f"https://data.police.uk/data/archive/{month}.zip"
+        url = ARCHIVE_URL.format(month=month)
         logger.info(f"Downloading file from {url}...")
 
         start_time = time.time()
-        wget.download(url, out=temp_file_path)
+        self.downloader.download(url, temp_file_path)
         end_time = time.time()
 
         elapsed_time = end_time - start_time
@@ -38,6 +63,24 @@ class DataPoliceUKAPI():
         logger.info(f"Saving temp file to: {temp_file_path}")
 
 
+    def remove_zip_file(self, temp_file_path):
+        """Delete a downloaded archive and any segments left by an unfinished download"""
+        self.downloader.remove_download(temp_file_path)
+
+
+    def get_archive_source(self, month):
+        """Size and ETag of the month's archive, to tell if a staged copy is still current"""
+        headers = self.downloader.get_archive_headers(ARCHIVE_URL.format(month=month))
+        return {"size": headers["size"], "etag": headers["etag"]}
+
+
+    def open_zip_file(self, month):
+        """Open the month's archive for range reads, without downloading it"""
+        url = ARCHIVE_URL.format(month=month)
+        logger.info(f"Opening {url} for range reads...")
+        return self.downloader.open_remote(url)
+
+
     def validate_message(self, cloud_event_data):
         """Check we have the keys required in our dictionary"""
         try:
@@ -62,9 +105,39 @@ class DataPoliceUKAPI():
             api_request_data["interval_months"] = months
             api_request_data["record_months"] = months
 
+        api_request_data["archive_plan"] = self.plan_archive_months(api_request_data["interval_months"],
+                                                                    api_request_data["record_months"])
+        api_request_data["interval_months"] = [month for month in api_request_data["interval_months"]
+                                               if month in api_request_data["archive_plan"]]
         return api_request_data
 
 
+    def plan_archive_months(self, interval_months, record_months):
+        """
+        Assign every record month to exactly one archive, the newest one containing it,
+        so months in overlapping archives are only extracted once
+        """
+        archive_plan = {archive_month: [] for archive_month in interval_months}
+        newest_first = sorted(interval_months, reverse=True)
+        for record_month in record_months:
+            for archive_month in newest_first:
+                if self.archive_contains_month(archive_month, record_month):
+                    archive_plan[archive_month].append(record_month)
+                    break
+            else:
+                logger.warning(f"No archive in {interval_months} contains {record_month}, skipping it")
+
+        logger.info(f"Archive plan: {archive_plan}")
+        return {archive_month: months for archive_month, months in archive_plan.items() if months}
+
+
+    def archive_contains_month(self, archive_month, record_month):
+        archive_date = datetime.strptime(archive_month, "%Y-%m")
+        record_date = datetime.strptime(record_month, "%Y-%m")
+        diff = (archive_date.year - record_date.year) * 12 + (archive_date.month - record_date.month)
+        return 0 <= diff < ARCHIVE_MONTH_WINDOW
+
+
     def get_months_and_intervals(self, months=None):
         """
         Get all months between records start (2010-12-01) to the latest_update
@@ -90,15 +163,15 @@ class DataPoliceUKAPI():
 
 
     def get_range_months_intervals(self, months):
-        dates = [datetime.strptime(month, "%Y-%m") for month in months]
-        max_date = max(dates)
-        min_date = min(dates)
-        diff = (max_date.year - min_date.year) * 12 + (max_date.month - min_date.month)
-
-        max_date_year_month = max_date.strftime('%Y-%m')
-        month_window = 36
-        if diff < month_window:
-            return [max_date_year_month]
+        """Fewest archives covering the months, taking the newest month's archive first"""
+        dates = sorted({datetime.strptime(month, "%Y-%m") for month in months}, reverse=True)
+        interval_months = []
+        window_start = None
+        for date in dates:
+            if window_start is None or date < window_start:
+                interval_months.append(date.strftime('%Y-%m'))
+                window_start = date - relativedelta(months=ARCHIVE_MONTH_WINDOW - 1)
+        return interval_months
 
 
     def get_month_intervals(self, interval_start, records_end):
@@ -132,3 +205,32 @@ class DataPoliceUKAPI():
         return data_sets
 
 
+    def validate_output_format(self, output_format):
+        if output_format not in OUTPUT_FORMATS:
+            err_msg = f"Invalid output format entered, expected one of {OUTPUT_FORMATS}"
+            logger.error(err_msg)
+            raise Exception(err_msg)
+
+        return output_format
+
+
+    def validate_stage_workers(self, stage_workers, default_workers):
+        """Worker counts per pipeline stage, the defaults overridden by those entered"""
+        for stage, workers in stage_workers.items():
+            if stage not in default_workers or not isinstance(workers, int) or workers < 1:
+                err_msg = f"Invalid stage workers entered, expected positive integers for {list(default_workers)}"
+                logger.error(err_msg)
+                raise Exception(err_msg)
+
+        return {**default_workers, **stage_workers}
+
+
+    def validate_layout(self, layout):
+        if layout not in LAYOUTS:
+            err_msg = f"Invalid curated layout entered, expected one of {LAYOUTS}"
+            logger.error(err_msg)
+            raise Exception(err_msg)
+
+        return layout
+
+
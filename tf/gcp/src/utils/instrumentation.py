@@ -0,0 +1,92 @@
+import time
+import logging
+import threading
+from contextlib import contextmanager
+from . import log
+
+logger = logging.getLogger('root.metrics')
+
+STAGES = ["download", "range_read", "zip_scan", "member_extract", "raw_upload", "raw_download",
+          "parse", "concat", "curated_upload", "index"]
+
+
+class StageRecord():
+    """Bytes and rows for one timed stage, filled in by the caller while it runs"""
+
+    def __init__(self) -> None:
+        self.bytes = 0
+        self.rows = 0
+
+
+class PipelineMetrics():
+    """
+    Thread safe totals of duration, bytes and rows per pipeline stage. Each timed
+    stage is emitted as a JSON log record, and totals can be logged per run.
+    Stages can nest, e.g. curated_upload includes the concat feeding it.
+    """
+
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.totals = {}
+
+
+    @contextmanager
+    def stage(self, name, **fields):
+        record = StageRecord()
+        start_time = time.perf_counter()
+        try:
+            yield record
+        finally:
+            self.record(name, time.perf_counter() - start_time, record.bytes, record.rows, **fields)
+
+
+    def record(self, name, seconds, num_bytes=0, rows=0, **fields):
+        self.merge({name: {"calls": 1, "seconds": seconds, "bytes": num_bytes, "rows": rows}})
+        log.log_json(logger, f"stage {name}", stage=name, seconds=round(seconds, 6),
+                     bytes=num_bytes, rows=rows, **fields)
+
+
+    def merge(self, totals):
+        """Add stage totals, e.g. from a curation worker process"""
+        with self.lock:
+            for name, stage_totals in totals.items():
+                current = self.totals.setdefault(name, {"calls": 0, "seconds": 0.0, "bytes": 0, "rows": 0})
+                for key, value in stage_totals.items():
+                    current[key] += value
+
+
+    def drain(self):
+        """Return the totals so far and start again from zero"""
+        with self.lock:
+            totals, self.totals = self.totals, {}
+        return totals
+
+
+    def reset(self):
+        self.drain()
+
+
+    def summary_table(self):
+        names = [name for name in STAGES if name in self.totals] + \
+                sorted(name for name in self.totals if name not in STAGES)
+        lines = [f"{'stage':<16}{'calls':>8}{'seconds':>10}{'MB':>10}{'rows':>12}{'MB/s':>9}"]
+        for name in names:
+            totals = self.totals[name]
+            megabytes = totals["bytes"] / 1e6
+            throughput = megabytes / totals["seconds"] if totals["seconds"] else 0.0
+            lines.append(f"{name:<16}{totals['calls']:>8}{totals['seconds']:>10.2f}"
+                         f"{megabytes:>10.1f}{totals['rows']:>12}{throughput:>9.1f}")
+        return "\n".join(lines)
+
+
+    def log_summary(self, table=False):
+        """Emit the run totals as a JSON record, and optionally as a readable table"""
+        with self.lock:
+            totals = {name: dict(stage_totals) for name, stage_totals in self.totals.items()}
+        log.log_json(logger, "pipeline summary", stages=totals)
+        if table:
+            logger.info(f"Pipeline summary\n{self.summary_table()}")
+
+
+# Shared by every module in this process
+metrics = PipelineMetrics()
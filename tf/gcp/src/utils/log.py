@@ -1,3 +1,4 @@
+import json
 import logging
 
 def setup_custom_logger(name):
@@ -10,4 +11,28 @@ def setup_custom_logger(name):
     logger = logging.getLogger(name)
     logger.setLevel(logging.DEBUG)
     logger.addHandler(handler)
-    return logger
\ No newline at end of file
+    return logger
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line, which Cloud Logging parses into jsonPayload"""
+
+    def format(self, record):
+        payload = {"severity": record.levelname, "message": record.getMessage()}
+        payload.update(getattr(record, "json_fields", {}))
+        return json.dumps(payload)
+
+
+def setup_json_logger(name):
+    handler = logging.StreamHandler()
+    handler.setFormatter(JsonFormatter())
+
+    logger = logging.getLogger(name)
+    logger.setLevel(logging.DEBUG)
+    logger.addHandler(handler)
+    logger.propagate = False
+    return logger
+
+
+def log_json(logger, message, **fields):
+    logger.info(message, extra={"json_fields": fields})
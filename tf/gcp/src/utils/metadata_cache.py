@@ -0,0 +1,48 @@
+import time
+import logging
+import threading
+from cachetools import TTLCache
+
+logger = logging.getLogger('root')
+
+METADATA_CACHE_SIZE = 256
+METADATA_CACHE_TTL = 15 * 60
+
+
+class MetadataCache():
+    """
+    Thread safe cache of small metadata lookups, e.g. archive headers or whether
+    a raw blob exists. Entries expire after ttl seconds and the least recently
+    used are evicted beyond maxsize. Held by the long lived API objects, it
+    carries over between warm invocations.
+    """
+
+    def __init__(self, maxsize=METADATA_CACHE_SIZE, ttl=METADATA_CACHE_TTL, timer=time.monotonic) -> None:
+        self.entries = TTLCache(maxsize=maxsize, ttl=ttl, timer=timer)
+        self.lock = threading.Lock()
+
+
+    def get(self, key, load):
+        """The cached value for key, calling load() to fill it when missing or expired"""
+        with self.lock:
+            if key in self.entries:
+                logger.debug(f"Metadata cache hit for {key}")
+                return self.entries[key]
+        value = load()
+        self.set(key, value)
+        return value
+
+
+    def set(self, key, value):
+        with self.lock:
+            self.entries[key] = value
+
+
+    def invalidate(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
@@ -0,0 +1,137 @@
+import io
+import logging
+from .schemas import read_curated, ROW_KEY_COLUMN
+
+logger = logging.getLogger('root')
+
+# Columns of the latest outcomes joined onto each street month, keyed by row key
+OUTCOME_COLUMNS = [ROW_KEY_COLUMN, "Crime ID", "Outcome type", "Outcome month"]
+
+
+def hash_crime_ids(crime_ids):
+    """uint64 hash of each Crime ID, the same for string and object columns"""
+    import pandas as pd
+    return pd.util.hash_pandas_object(crime_ids.astype("string"), index=False).to_numpy()
+
+
+def encode_months(months):
+    """'2023-03' as 202303, so months order as integers"""
+    import numpy as np
+    months = np.asarray(months, dtype=str)
+    if not len(months):
+        return np.empty(0, dtype="int32")
+    return np.char.replace(months, "-", "").astype("int32")
+
+
+def decode_months(months):
+    return [f"{month // 100:04d}-{month % 100:02d}" for month in months.tolist()]
+
+
+def read_latest_outcomes(data, output_format):
+    return read_curated(data, "outcomes", output_format)
+
+
+def get_last_positions(keys):
+    """Position of the last of each run of equal keys in a sorted array"""
+    import numpy as np
+    return np.flatnonzero(np.append(keys[1:] != keys[:-1], True)) if len(keys) else np.empty(0, dtype="int64")
+
+
+class OutcomeIndex():
+    """
+    Latest outcome of each crime, as sorted arrays of hashed Crime IDs and the month
+    and outcome code of their latest outcome, so lookups are a vectorised binary search
+    rather than a dict of millions of strings. Persisted as a .npz, one per outcomes
+    month and one merged across all of them.
+    """
+
+    ARRAYS = ["keys", "months", "outcome_codes", "outcomes"]
+
+    def __init__(self, keys=None, months=None, outcome_codes=None, outcomes=None) -> None:
+        import numpy as np
+        self.keys = keys if keys is not None else np.empty(0, dtype="uint64")
+        self.months = months if months is not None else np.empty(0, dtype="int32")
+        self.outcome_codes = outcome_codes if outcome_codes is not None else np.empty(0, dtype="int32")
+        self.outcomes = outcomes if outcomes is not None else np.empty(0, dtype=str)
+
+
+    @classmethod
+    def from_frame(cls, df, month):
+        """Index of an outcomes partition, dated by each row's Month, else the partition's"""
+        import numpy as np
+        rows = df[df["Crime ID"].notna() & df["Outcome type"].notna()]
+        months = rows["Month"].astype(object).fillna(month) if "Month" in rows else [month] * len(rows)
+        outcomes, outcome_codes = np.unique(rows["Outcome type"].astype(str).to_numpy(dtype=str), return_inverse=True)
+        return cls().merge(cls(hash_crime_ids(rows["Crime ID"]), encode_months(months),
+                               outcome_codes.astype("int32"), outcomes))
+
+
+    @classmethod
+    def from_bytes(cls, data):
+        import numpy as np
+        with np.load(io.BytesIO(data), allow_pickle=False) as arrays:
+            return cls(*[arrays[name] for name in cls.ARRAYS])
+
+
+    def to_bytes(self):
+        import numpy as np
+        out_file = io.BytesIO()
+        np.savez_compressed(out_file, **{name: getattr(self, name) for name in self.ARRAYS})
+        return out_file.getvalue()
+
+
+    def __len__(self):
+        return len(self.keys)
+
+
+    def merge(self, other):
+        """
+        Index of the latest outcome of each crime in either index. Where both give an
+        outcome in the same month the other index's is kept, and within an index the
+        last one given.
+        """
+        import numpy as np
+        outcomes = np.union1d(self.outcomes, other.outcomes).astype(str)
+        keys = np.concatenate([self.keys, other.keys]).astype("uint64")
+        months = np.concatenate([self.months, other.months]).astype("int32")
+        outcome_codes = np.concatenate([np.searchsorted(outcomes, self.outcomes)[self.outcome_codes],
+                                        np.searchsorted(outcomes, other.outcomes)[other.outcome_codes]])
+        # Stable, so rows of equal key and month keep their order and the last is kept
+        order = np.lexsort((months, keys))
+        last = order[get_last_positions(keys[order])]
+        return OutcomeIndex(keys[last], months[last], outcome_codes[last].astype("int32"), outcomes)
+
+
+    def get_changed_keys(self, previous):
+        """Sorted keys whose latest outcome is new or differs from that in a previous index"""
+        import numpy as np
+        if not len(previous.keys):
+            return self.keys
+        positions = np.minimum(np.searchsorted(previous.keys, self.keys), len(previous.keys) - 1)
+        unchanged = (previous.keys[positions] == self.keys) & (previous.months[positions] == self.months) \
+            & (previous.outcomes[previous.outcome_codes[positions]] == self.outcomes[self.outcome_codes])
+        return self.keys[~unchanged]
+
+
+    def lookup(self, crime_ids):
+        """Position in the index of each Crime ID, or -1 where it has no outcome"""
+        import numpy as np
+        keys = hash_crime_ids(crime_ids)
+        positions = np.minimum(np.searchsorted(self.keys, keys), max(len(self.keys) - 1, 0))
+        found = crime_ids.notna().to_numpy() & (len(self.keys) > 0)
+        found[found] = self.keys[positions[found]] == keys[found]
+        return np.where(found, positions, -1)
+
+
+    def apply(self, df):
+        """Latest outcome of each row of a street partition with one, keyed by row key"""
+        import pandas as pd
+        positions = self.lookup(df["Crime ID"])
+        rows = df[positions >= 0]
+        positions = positions[positions >= 0]
+        return pd.DataFrame({
+            ROW_KEY_COLUMN: rows[ROW_KEY_COLUMN].to_numpy(),
+            "Crime ID": rows["Crime ID"].to_numpy(),
+            "Outcome type": pd.Categorical.from_codes(self.outcome_codes[positions], self.outcomes),
+            "Outcome month": decode_months(self.months[positions]),
+        }, columns=OUTCOME_COLUMNS)
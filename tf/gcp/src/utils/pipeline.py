@@ -0,0 +1,163 @@
+import queue
+import logging
+import threading
+
+logger = logging.getLogger('root')
+
+# Seconds a blocked worker waits before checking whether the pipeline was cancelled
+POLL_INTERVAL = 0.1
+# Marks the end of a stage's input, one is sent to each of its workers
+STOP = object()
+
+
+class PipelineCancelled(Exception):
+    """Raised from run when the pipeline was cancelled without a stage failing"""
+
+
+class Stage():
+    """One step of a StagedPipeline, func(item) returns the item passed on to the next stage"""
+
+    def __init__(self, name, func, workers=1, queue_size=1, discard=None) -> None:
+        self.name = name
+        self.func = func
+        self.workers = workers
+        # Items waiting for this stage, beyond which the stage before it blocks
+        self.queue_size = queue_size
+        # Called with each item left waiting for this stage when the pipeline is cancelled
+        self.discard = discard
+
+
+class StagedPipeline():
+    """
+    Run items through stages, each in its own worker threads, joined by bounded
+    queues. While one item is in a later stage the next can be in an earlier one,
+    so a run takes about as long as its slowest stage rather than the sum of them.
+    The queues bound how far a fast stage gets ahead. The first failure cancels
+    the run: workers stop taking new items, items left waiting are discarded and
+    the failure is raised from run.
+    """
+
+    def __init__(self, stages) -> None:
+        self.stages = stages
+        self.cancelled = threading.Event()
+        self.lock = threading.Lock()
+        self.errors = []
+
+
+    def run(self, items):
+        """Results of the last stage, in the order of items"""
+        self.cancelled.clear()
+        self.errors = []
+        # The last queue collects results, so it is never full
+        queues = [queue.Queue(maxsize=stage.queue_size) for stage in self.stages] + [queue.Queue()]
+        threads = [threading.Thread(target=self.feed, args=(items, queues[0]), name="pipeline-feed")]
+        for position, stage in enumerate(self.stages):
+            running = [stage.workers]
+            threads += [threading.Thread(target=self.work, args=(position, queues, running),
+                                         name=f"pipeline-{stage.name}-{worker}")
+                        for worker in range(stage.workers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        if self.cancelled.is_set():
+            self.discard_waiting(queues)
+            if self.errors:
+                raise self.errors[0]
+            raise PipelineCancelled("Pipeline cancelled")
+        results = self.drain(queues[-1])
+        return [result for _, result in sorted(results, key=lambda entry: entry[0])]
+
+
+    def cancel(self, err=None):
+        """Stop the run, recording err as its failure"""
+        with self.lock:
+            if err is not None:
+                self.errors.append(err)
+        self.cancelled.set()
+
+
+    def feed(self, items, first_queue):
+        try:
+            for index, item in enumerate(items):
+                self.put(first_queue, (index, item))
+            for _ in range(self.stages[0].workers):
+                self.put(first_queue, STOP)
+        except PipelineCancelled:
+            pass
+        except Exception as err:
+            logger.error(f"Reading pipeline items failed: {err}")
+            self.cancel(err)
+
+
+    def work(self, position, queues, running):
+        stage = self.stages[position]
+        in_queue, out_queue = queues[position], queues[position + 1]
+        next_stage = self.stages[position + 1] if position + 1 < len(self.stages) else None
+        try:
+            while (entry := self.get(in_queue)) is not STOP:
+                index, item = entry
+                result = stage.func(item)
+                try:
+                    self.put(out_queue, (index, result))
+                except PipelineCancelled:
+                    self.discard(next_stage, result)
+                    raise
+
+            # The last worker out tells each of the next stage's workers to stop
+            with self.lock:
+                running[0] -= 1
+                last_worker = running[0] == 0
+            if last_worker and next_stage:
+                for _ in range(next_stage.workers):
+                    self.put(out_queue, STOP)
+        except PipelineCancelled:
+            pass
+        except Exception as err:
+            logger.error(f"Pipeline stage '{stage.name}' failed: {err}")
+            self.cancel(err)
+
+
+    def get(self, in_queue):
+        while not self.cancelled.is_set():
+            try:
+                return in_queue.get(timeout=POLL_INTERVAL)
+            except queue.Empty:
+                continue
+        raise PipelineCancelled("Pipeline cancelled")
+
+
+    def put(self, out_queue, entry):
+        while not self.cancelled.is_set():
+            try:
+                return out_queue.put(entry, timeout=POLL_INTERVAL)
+            except queue.Full:
+                continue
+        raise PipelineCancelled("Pipeline cancelled")
+
+
+    def discard_waiting(self, queues):
+        for stage, stage_queue in zip(self.stages, queues):
+            for _, item in self.drain(stage_queue):
+                self.discard(stage, item)
+
+
+    def discard(self, stage, item):
+        if stage is None or stage.discard is None:
+            return
+        try:
+            stage.discard(item)
+        except Exception as err:
+            logger.warning(f"Discarding an item waiting for stage '{stage.name}' failed: {err}")
+
+
+    def drain(self, drain_queue):
+        entries = []
+        while True:
+            try:
+                entry = drain_queue.get_nowait()
+            except queue.Empty:
+                return entries
+            if entry is not STOP:
+                entries.append(entry)
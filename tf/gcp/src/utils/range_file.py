@@ -0,0 +1,134 @@
+import io
+import logging
+from collections import OrderedDict
+from .instrumentation import metrics
+
+logger = logging.getLogger('root')
+
+RANGE_BLOCK_SIZE = 1024 * 1024
+MAX_CACHED_BLOCKS = 32
+
+
+class RangeFile(io.RawIOBase):
+    """
+    Read-only seekable file over a remote object, fetching byte ranges on demand.
+    Reads are rounded out to whole blocks, which are kept in a small LRU cache,
+    so ZipFile can read the central directory and selected members without the
+    rest of the archive being transferred. fetch_range(start, end) is inclusive.
+    """
+
+    def __init__(self, name, size, fetch_range, source=None,
+                 block_size=RANGE_BLOCK_SIZE, max_cached_blocks=MAX_CACHED_BLOCKS) -> None:
+        super().__init__()
+        self.name = name
+        self.size = size
+        self.fetch_range = fetch_range
+        self.source = source
+        self.block_size = block_size
+        self.max_cached_blocks = max_cached_blocks
+        self.blocks = OrderedDict()
+        self.position = 0
+        self.bytes_fetched = 0
+        self.range_requests = 0
+
+
+    def readable(self):
+        return True
+
+
+    def seekable(self):
+        return True
+
+
+    def tell(self):
+        return self.position
+
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            position = offset
+        elif whence == io.SEEK_CUR:
+            position = self.position + offset
+        elif whence == io.SEEK_END:
+            position = self.size + offset
+        else:
+            raise ValueError(f"Invalid whence {whence}")
+        if position < 0:
+            raise ValueError(f"Negative seek position {position}")
+        self.position = position
+        return position
+
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = self.size - self.position
+        end = min(self.position + size, self.size)
+        if end <= self.position:
+            return b""
+
+        first_block = self.position // self.block_size
+        last_block = (end - 1) // self.block_size
+        data = self.read_blocks(first_block, last_block)
+        offset = self.position - first_block * self.block_size
+        length = end - self.position
+        self.position = end
+        return data[offset:offset + length]
+
+
+    def readinto(self, buffer):
+        data = self.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+
+    def read_blocks(self, first_block, last_block):
+        """Join blocks first..last, fetching each run of uncached blocks in one request"""
+        blocks = []
+        block = first_block
+        while block <= last_block:
+            if block in self.blocks:
+                self.blocks.move_to_end(block)
+                blocks.append(self.blocks[block])
+                block += 1
+                continue
+
+            run_end = block
+            while run_end < last_block and run_end + 1 not in self.blocks:
+                run_end += 1
+            data = self.fetch(block * self.block_size,
+                              min((run_end + 1) * self.block_size, self.size) - 1)
+            for run_block in range(block, run_end + 1):
+                offset = (run_block - block) * self.block_size
+                self.cache_block(run_block, data[offset:offset + self.block_size])
+                blocks.append(data[offset:offset + self.block_size])
+            block = run_end + 1
+        return b"".join(blocks)
+
+
+    def fetch(self, start, end):
+        with metrics.stage("range_read", source=self.name, start=start, end=end) as stage:
+            data = self.fetch_range(start, end)
+            stage.bytes = len(data)
+        if len(data) != end - start + 1:
+            err_msg = f"Range {start}-{end} of {self.name} returned {len(data)} bytes"
+            logger.error(err_msg)
+            raise Exception(err_msg)
+        self.bytes_fetched += len(data)
+        self.range_requests += 1
+        return data
+
+
+    def cache_block(self, block, data):
+        self.blocks[block] = data
+        if len(self.blocks) > self.max_cached_blocks:
+            self.blocks.popitem(last=False)
+
+
+def open_blob_range_file(blob, block_size=RANGE_BLOCK_SIZE):
+    """Ranged reads of a GCS blob, identified by its generation like the persisted zip index"""
+    if blob.size is None:
+        blob.reload()
+    return RangeFile(blob.name, blob.size,
+                     lambda start, end: blob.download_as_bytes(start=start, end=end),
+                     source={"generation": blob.generation, "size": blob.size},
+                     block_size=block_size)
@@ -0,0 +1,17 @@
+import logging
+import time
+
+logger = logging.getLogger('root')
+
+
+def retry_with_backoff(func, retries=3, backoff=1.0, exceptions=(Exception,)):
+    """Call func, retrying with exponential backoff when it raises one of exceptions"""
+    for attempt in range(retries + 1):
+        try:
+            return func()
+        except exceptions as err:
+            if attempt == retries:
+                raise
+            delay = backoff * 2 ** attempt
+            logger.warning(f"Attempt {attempt + 1} failed: {err}. Retrying in {delay}s")
+            time.sleep(delay)
@@ -0,0 +1,72 @@
+import io
+import logging
+from .schemas import read_csv, concat_frames, COUNT_COLUMN
+
+logger = logging.getLogger('root')
+
+# Labels each data set's rows are counted by per month. Stop and searches do not name
+# the force, so it is taken from the partition.
+ROLLUP_DIMENSIONS = {
+    "street": ["Falls within", "Crime type", "Last outcome category", "LSOA code"],
+    "outcomes": ["Falls within", "Outcome type", "LSOA code"],
+    "stop-and-search": ["Force", "Object of search", "Outcome"],
+}
+# Stands in for missing labels while grouping, as pandas drops null categorical groups
+MISSING_LABEL = ""
+
+
+def get_rollup_keys(data_set):
+    return ["Month"] + ROLLUP_DIMENSIONS[data_set]
+
+
+def count_rows(df, keys, counts=None):
+    """
+    Rows of df, or the sum of the counts column, by each combination of the keys
+    present. Categorical keys are grouped by code, so only observed combinations
+    are kept, and rows with missing labels are counted as their own group.
+    """
+    import pandas as pd
+    keys = [key for key in keys if key in df]
+    frame = {}
+    for key in keys:
+        values = df[key]
+        if isinstance(values.dtype, pd.CategoricalDtype):
+            if MISSING_LABEL not in values.cat.categories:
+                values = values.cat.add_categories(MISSING_LABEL)
+        frame[key] = values.fillna(MISSING_LABEL)
+    frame[COUNT_COLUMN] = df[counts] if counts else 1
+
+    rollup = pd.DataFrame(frame).groupby(keys, observed=True)[COUNT_COLUMN].sum().reset_index()
+    for key in keys:
+        if isinstance(rollup[key].dtype, pd.CategoricalDtype):
+            rollup[key] = rollup[key].cat.remove_categories(MISSING_LABEL)
+        else:
+            rollup[key] = rollup[key].mask(rollup[key] == MISSING_LABEL)
+    return rollup
+
+
+def compute_rollup(df, data_set, month, force):
+    """Counts of one force partition's rows for the month"""
+    labels = df[[column for column in ROLLUP_DIMENSIONS[data_set] if column in df]]
+    return count_rows(labels.assign(Month=month, Force=force), get_rollup_keys(data_set))
+
+
+def combine_rollups(rollups, data_set):
+    """Sum rollups over their keys, e.g. those of a month's force partitions"""
+    return count_rows(concat_frames(rollups, data_set), get_rollup_keys(data_set), counts=COUNT_COLUMN)
+
+
+def merge_rollups(existing, month_rollups, months, data_set):
+    """Replace the months' rows of an existing rollup table, or start one, ordered by month"""
+    rollups = list(month_rollups)
+    if existing is not None:
+        rollups.insert(0, existing[~existing["Month"].astype(str).isin(months)])
+    merged = concat_frames(rollups, data_set)
+    return merged.sort_values(get_rollup_keys(data_set), kind="stable", ignore_index=True)
+
+
+def read_rollup(data, data_set, output_format):
+    if output_format == "parquet":
+        import pandas as pd
+        return pd.read_parquet(io.BytesIO(data))
+    return read_csv(io.BytesIO(data), data_set)
@@ -0,0 +1,105 @@
+import io
+import logging
+from .schemas import SCHEMAS
+
+logger = logging.getLogger('root')
+
+COORDINATE_COLUMNS = ["Latitude", "Longitude"]
+# Coordinates are keyed as whole millionths of a degree, so float32 and float64 give the same key
+COORDINATE_SCALE = 10 ** 6
+NULL_COORDINATE = -(2 ** 63)
+
+
+def compute_row_keys(df, data_set, force, content_counts=None):
+    """
+    Stable uint64 key of each row's content, hashed column by column over the
+    data set's schema columns and the force, as stop and searches do not name it.
+    Identical rows, e.g. two incidents of the same type near the same place, are
+    told apart by how many came before them, counting earlier blocks of the same
+    file in content_counts when it is parsed a block at a time.
+    """
+    import pandas as pd
+    columns = {"force": pd.Series(force, index=df.index, dtype="category")}
+    for column in SCHEMAS[data_set]:
+        if column not in df:
+            continue
+        if column in COORDINATE_COLUMNS:
+            micro_degrees = (df[column].astype("float64") * COORDINATE_SCALE).round()
+            columns[column] = micro_degrees.fillna(NULL_COORDINATE).astype("int64")
+        elif df[column].dtype.kind == "f":
+            # An empty text column read without the schema, so its nulls hash as in typed frames
+            columns[column] = df[column].astype("string")
+        else:
+            columns[column] = df[column]
+    content_keys = pd.util.hash_pandas_object(pd.DataFrame(columns), index=False)
+    ordinals = content_keys.groupby(content_keys.to_numpy()).cumcount()
+    if content_counts is not None:
+        ordinals += content_counts.update(content_keys.to_numpy())
+    return pd.util.hash_pandas_object(pd.DataFrame({"content": content_keys, "ordinal": ordinals}),
+                                      index=False).to_numpy()
+
+
+class ContentCounts():
+    """Rows so far of each content key, across the blocks of one parsed file"""
+
+    def __init__(self) -> None:
+        import numpy as np
+        self.keys = np.empty(0, dtype="uint64")
+        self.counts = np.empty(0, dtype="int64")
+
+
+    def update(self, content_keys):
+        """Count a block's content keys, returning the rows of each seen in earlier blocks"""
+        import numpy as np
+        positions = np.minimum(np.searchsorted(self.keys, content_keys), max(len(self.keys) - 1, 0))
+        found = np.zeros(len(content_keys), dtype=bool) if not len(self.keys) else \
+            self.keys[positions] == content_keys
+        earlier = np.where(found, self.counts[positions] if len(self.keys) else 0, 0)
+
+        block_keys, block_counts = np.unique(content_keys, return_counts=True)
+        self.keys, inverse = np.unique(np.concatenate([self.keys, block_keys]), return_inverse=True)
+        self.counts = np.bincount(inverse, weights=np.concatenate([self.counts, block_counts]),
+                                  minlength=len(self.keys)).astype("int64")
+        return earlier
+
+
+class RowKeyIndex():
+    """
+    Sorted, unique row keys already written to a month's curated partitions,
+    persisted next to them as a .npy file so reloads only upload new rows
+    """
+
+    def __init__(self, keys=None) -> None:
+        import numpy as np
+        self.keys = keys if keys is not None else np.empty(0, dtype="uint64")
+
+
+    @classmethod
+    def from_bytes(cls, data):
+        import numpy as np
+        return cls(np.load(io.BytesIO(data), allow_pickle=False))
+
+
+    def to_bytes(self):
+        import numpy as np
+        out_file = io.BytesIO()
+        np.save(out_file, self.keys, allow_pickle=False)
+        return out_file.getvalue()
+
+
+    def contains(self, keys):
+        """Boolean mask of the keys already in the index"""
+        import numpy as np
+        positions = np.searchsorted(self.keys, keys)
+        found = positions < len(self.keys)
+        found[found] = self.keys[positions[found]] == keys[found]
+        return found
+
+
+    def add(self, keys):
+        import numpy as np
+        self.keys = np.union1d(self.keys, keys).astype("uint64")
+
+
+    def __len__(self):
+        return len(self.keys)
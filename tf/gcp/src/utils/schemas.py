@@ -0,0 +1,171 @@
+import io
+from functools import reduce
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+
+# Bytes parsed per block when a CSV is read as a stream of frames
+CSV_BLOCK_SIZE = 16 * 1024 * 1024
+
+# Column types of the curated files for each data set. Repeated labels are
+# categorical and everything else is kept as text. Coordinates have 6 decimal
+# places: float32 holds UK longitudes exactly, but latitudes need float64.
+SCHEMAS = {
+    "street": {
+        "Crime ID": "string",
+        "Month": "category",
+        "Reported by": "category",
+        "Falls within": "category",
+        "Longitude": "float32",
+        "Latitude": "float64",
+        "Location": "category",
+        "LSOA code": "category",
+        "LSOA name": "category",
+        "Crime type": "category",
+        "Last outcome category": "category",
+        "Context": "string",
+    },
+    "outcomes": {
+        "Crime ID": "string",
+        "Month": "category",
+        "Reported by": "category",
+        "Falls within": "category",
+        "Longitude": "float32",
+        "Latitude": "float64",
+        "Location": "category",
+        "LSOA code": "category",
+        "LSOA name": "category",
+        "Outcome type": "category",
+    },
+    "stop-and-search": {
+        "Type": "category",
+        "Date": "string",
+        "Part of a policing operation": "category",
+        "Policing operation": "string",
+        "Latitude": "float64",
+        "Longitude": "float32",
+        "Gender": "category",
+        "Age range": "category",
+        "Self-defined ethnicity": "category",
+        "Officer-defined ethnicity": "category",
+        "Legislation": "category",
+        "Object of search": "category",
+        "Outcome": "category",
+        "Outcome linked to object of search": "category",
+        "Removal of more than just outer clothing": "category",
+    },
+}
+
+# Content hash added to each row of the Hive-style partitions, see row_keys.py
+ROW_KEY_COLUMN = "Row key"
+# Row counts of the rollup tables, see rollups.py
+COUNT_COLUMN = "Count"
+
+ARROW_TYPES = {
+    "uint64": pa.uint64(),
+    "int64": pa.int64(),
+    "string": pa.string(),
+    "category": pa.dictionary(pa.int32(), pa.string()),
+    "float32": pa.float32(),
+    "float64": pa.float64(),
+}
+
+
+def apply_schema(df, data_set):
+    """Cast the known columns of a data frame to the data set's curated types"""
+    dtypes = {column: dtype for column, dtype in SCHEMAS[data_set].items() if column in df.columns}
+    return df.astype(dtypes)
+
+
+def get_dtypes(data_set):
+    """The data set's curated types, with the row key and count columns added by curation"""
+    return {**SCHEMAS[data_set], ROW_KEY_COLUMN: "uint64", COUNT_COLUMN: "int64"}
+
+
+def get_arrow_schema(data_set, columns):
+    """Arrow schema for the given columns, falling back to string for unknown columns"""
+    dtypes = get_dtypes(data_set)
+    return pa.schema([(column, ARROW_TYPES[dtypes.get(column, "string")]) for column in columns])
+
+
+def get_csv_convert_options(data_set):
+    # Empty fields are nulls, as with pandas read_csv. Row keys are read as uint64, as
+    # inference would read those of 2^63 and over as doubles and lose their low bits
+    column_types = {column: ARROW_TYPES[dtype] for column, dtype in get_dtypes(data_set).items()}
+    return pa_csv.ConvertOptions(column_types=column_types, strings_can_be_null=True)
+
+
+def read_csv(source, data_set, columns=None):
+    """
+    Parse a crime CSV straight into the data set's curated types with pyarrow,
+    which dictionary encodes the labels so they arrive as categoricals
+    """
+    convert_options = get_csv_convert_options(data_set)
+    if columns:
+        convert_options.include_columns = columns
+    return pa_csv.read_csv(source, convert_options=convert_options).to_pandas()
+
+
+def read_curated(data, data_set, output_format, columns=None):
+    """Read a curated CSV or Parquet file, or just the given columns of it"""
+    if output_format == "parquet":
+        import pyarrow.parquet as pq
+        return pq.read_table(io.BytesIO(data), columns=columns).to_pandas()
+    return read_csv(io.BytesIO(data), data_set, columns)
+
+
+class PrefixedReader(io.RawIOBase):
+    """The bytes already read from the start of a binary file, then the rest of it"""
+
+    def __init__(self, prefix, rest) -> None:
+        self.prefix = io.BytesIO(prefix)
+        self.rest = rest
+
+
+    def readable(self):
+        return True
+
+
+    def readinto(self, buffer):
+        data = self.prefix.read(len(buffer)) or self.rest.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+
+def iter_csv_frames(source, data_set, block_size=None):
+    """
+    Parse a crime CSV as typed frames of about block_size bytes each. A CSV within
+    one block is parsed whole, which also gives a header-only CSV its empty frame
+    where the streaming reader of pyarrow 11 aborts.
+    """
+    block_size = block_size or CSV_BLOCK_SIZE
+    head = source.read(block_size)
+    if len(head) < block_size:
+        yield read_csv(io.BytesIO(head), data_set)
+        return
+    source = io.BufferedReader(PrefixedReader(head, source))
+    reader = pa_csv.open_csv(source, read_options=pa_csv.ReadOptions(block_size=block_size),
+                             convert_options=get_csv_convert_options(data_set))
+    for batch in reader:
+        yield batch.to_pandas()
+
+
+def concat_frames(df_list, data_set):
+    """
+    Concatenate typed frames on column name. Categoricals are given the union of
+    their categories first, otherwise pandas would fall back to object columns.
+    """
+    import pandas as pd
+    categories = {}
+    for column in df_list[0].columns:
+        dtypes = [df[column].dtype for df in df_list if column in df]
+        if len(dtypes) == len(df_list) and all(isinstance(dtype, pd.CategoricalDtype) for dtype in dtypes):
+            categories[column] = pd.CategoricalDtype(
+                reduce(lambda left, right: left.union(right), [dtype.categories for dtype in dtypes]))
+    concat_frame = pd.concat([df.astype(categories) for df in df_list], axis=0, ignore_index=True)
+    # Columns missing from some frames come back as objects, so cast them again
+    return apply_schema(concat_frame, data_set)
+
+
+def to_arrow_table(df, data_set):
+    df = apply_schema(df, data_set)
+    return pa.Table.from_pandas(df, schema=get_arrow_schema(data_set, df.columns), preserve_index=False)
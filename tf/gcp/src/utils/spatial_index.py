@@ -0,0 +1,172 @@
+import io
+import logging
+from .schemas import ROW_KEY_COLUMN
+from .curated_layout import STATS_TYPE_COLUMNS
+
+logger = logging.getLogger('root')
+
+# Cell size in degrees, about 1.1 km north to south and 0.7 km east to west across the UK
+GRID_RESOLUTION = 0.01
+
+
+def get_grid_columns(resolution):
+    return int(round(360 / resolution))
+
+
+def get_grid_cells(latitude, longitude, resolution=GRID_RESOLUTION):
+    """
+    Cell of each coordinate on a fixed latitude and longitude grid. Cells are numbered
+    a grid row at a time from (-90, -180), so the cells of one row are contiguous.
+    """
+    import numpy as np
+    grid_rows = np.floor((np.asarray(latitude, dtype="float64") + 90) / resolution).astype("int64")
+    grid_columns = np.floor((np.asarray(longitude, dtype="float64") + 180) / resolution).astype("int64")
+    return grid_rows * get_grid_columns(resolution) + grid_columns
+
+
+def expand_ranges(starts, ends):
+    """Concatenation of range(start, end) for each pair, without a Python loop"""
+    import numpy as np
+    lengths = ends - starts
+    return np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(lengths.sum())
+
+
+class SpatialIndexBuilder():
+    """Collects the located rows of a month's force partitions as they are curated"""
+
+    def __init__(self, data_set, resolution=GRID_RESOLUTION) -> None:
+        self.data_set = data_set
+        self.resolution = resolution
+        self.frames = []
+
+
+    def add(self, df):
+        type_column = STATS_TYPE_COLUMNS[self.data_set]
+        located = df[df["Latitude"].notna() & df["Longitude"].notna()]
+        self.frames.append({
+            "latitude": located["Latitude"].to_numpy(dtype="float64"),
+            "longitude": located["Longitude"].to_numpy(dtype="float64"),
+            "row_keys": located[ROW_KEY_COLUMN].to_numpy(dtype="uint64"),
+            "types": located[type_column].astype(object).fillna("").to_numpy(dtype=str),
+        })
+
+
+    def build(self):
+        """Sort the rows by cell and count each cell's rows by type"""
+        import numpy as np
+        columns = {name: np.concatenate([frame[name] for frame in self.frames])
+                   for name in ["latitude", "longitude", "row_keys", "types"]} if self.frames else \
+            {"latitude": np.empty(0), "longitude": np.empty(0), "row_keys": np.empty(0, dtype="uint64"),
+             "types": np.empty(0, dtype=str)}
+
+        cells = get_grid_cells(columns["latitude"], columns["longitude"], self.resolution)
+        order = np.argsort(cells, kind="stable")
+        cells = cells[order]
+        unique_cells, starts = np.unique(cells, return_index=True)
+        offsets = np.append(starts, len(cells)).astype("int64")
+
+        types, type_codes = np.unique(columns["types"], return_inverse=True)
+        type_codes = type_codes[order].astype("int32")
+        cell_positions = np.repeat(np.arange(len(unique_cells)), np.diff(offsets))
+        cell_type_counts = np.bincount(cell_positions * len(types) + type_codes,
+                                       minlength=len(unique_cells) * len(types))
+        return SpatialIndex(self.data_set, self.resolution, unique_cells, offsets,
+                            columns["latitude"][order], columns["longitude"][order],
+                            columns["row_keys"][order], type_codes, types,
+                            cell_type_counts.reshape(len(unique_cells), len(types)).astype("int32"))
+
+
+class SpatialIndex():
+    """
+    Grid index of a month's located rows, persisted as a .npz next to its partitions.
+    Rows are held sorted by cell, with the sorted cells and each cell's offsets into
+    the rows, so a bounding box is read as one slice of cells per grid row. Counts
+    of each cell's rows by type are precomputed for hotspot queries.
+    """
+
+    ARRAYS = ["cells", "offsets", "latitude", "longitude", "row_keys", "type_codes", "types", "cell_type_counts"]
+
+    def __init__(self, data_set, resolution, cells, offsets, latitude, longitude,
+                 row_keys, type_codes, types, cell_type_counts) -> None:
+        self.data_set = data_set
+        self.resolution = resolution
+        self.cells = cells
+        self.offsets = offsets
+        self.latitude = latitude
+        self.longitude = longitude
+        self.row_keys = row_keys
+        self.type_codes = type_codes
+        self.types = types
+        self.cell_type_counts = cell_type_counts
+
+
+    @classmethod
+    def from_bytes(cls, data):
+        import numpy as np
+        with np.load(io.BytesIO(data), allow_pickle=False) as arrays:
+            return cls(str(arrays["data_set"]), float(arrays["resolution"]),
+                       *[arrays[name] for name in cls.ARRAYS])
+
+
+    def to_bytes(self):
+        import numpy as np
+        out_file = io.BytesIO()
+        np.savez_compressed(out_file, data_set=self.data_set, resolution=self.resolution,
+                            **{name: getattr(self, name) for name in self.ARRAYS})
+        return out_file.getvalue()
+
+
+    def __len__(self):
+        return len(self.row_keys)
+
+
+    def get_cell_positions(self, min_latitude, min_longitude, max_latitude, max_longitude):
+        """Positions in cells of the cells overlapping the bounding box"""
+        import numpy as np
+        first_cell, last_cell = get_grid_cells([min_latitude, max_latitude], [min_longitude, max_longitude],
+                                               self.resolution)
+        columns = get_grid_columns(self.resolution)
+        row_starts = np.arange(first_cell // columns, last_cell // columns + 1) * columns
+        firsts = np.searchsorted(self.cells, row_starts + first_cell % columns, side="left")
+        lasts = np.searchsorted(self.cells, row_starts + last_cell % columns, side="right")
+        return expand_ranges(firsts, lasts)
+
+
+    def query_bbox(self, min_latitude, min_longitude, max_latitude, max_longitude):
+        """Row keys, coordinates and types of the rows inside the bounding box"""
+        import pandas as pd
+        positions = self.get_cell_positions(min_latitude, min_longitude, max_latitude, max_longitude)
+        rows = expand_ranges(self.offsets[positions], self.offsets[positions + 1])
+        inside = (self.latitude[rows] >= min_latitude) & (self.latitude[rows] <= max_latitude) & \
+            (self.longitude[rows] >= min_longitude) & (self.longitude[rows] <= max_longitude)
+        rows = rows[inside]
+        return pd.DataFrame({
+            ROW_KEY_COLUMN: self.row_keys[rows],
+            "Latitude": self.latitude[rows],
+            "Longitude": self.longitude[rows],
+            STATS_TYPE_COLUMNS[self.data_set]: pd.Categorical.from_codes(self.type_codes[rows], self.types),
+        })
+
+
+    def hotspots(self, top=10, type_label=None, bbox=None):
+        """The cells with the most rows, optionally of one type and overlapping a bounding box"""
+        import numpy as np
+        import pandas as pd
+        positions = self.get_cell_positions(*bbox) if bbox else np.arange(len(self.cells))
+        if type_label is None:
+            counts = self.cell_type_counts[positions].sum(axis=1)
+        elif type_label in self.types:
+            counts = self.cell_type_counts[positions, np.searchsorted(self.types, type_label)]
+        else:
+            counts = np.zeros(len(positions), dtype="int32")
+
+        order = np.argsort(-counts, kind="stable")[:top]
+        order = order[counts[order] > 0]
+        cells = self.cells[positions[order]]
+        columns = get_grid_columns(self.resolution)
+        return pd.DataFrame({
+            "Cell": cells,
+            "Latitude": (cells // columns + 0.5) * self.resolution - 90,
+            "Longitude": (cells % columns + 0.5) * self.resolution - 180,
+            "Count": counts[order],
+        })
@@ -0,0 +1,28 @@
+import logging
+from functools import lru_cache
+import google.auth
+from google.auth.transport.requests import AuthorizedSession
+from google.cloud import storage
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger('root')
+
+# Upload, delete and range read threads share one pool, well past requests' default of 10
+HTTP_POOL_SIZE = 32
+
+
+def make_storage_client(pool_size=HTTP_POOL_SIZE):
+    """Storage client over one keep-alive session, pooling enough connections for our worker threads"""
+    credentials, project = google.auth.default(scopes=storage.Client.SCOPE)
+    session = AuthorizedSession(credentials)
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return storage.Client(project=project, credentials=credentials, _http=session)
+
+
+@lru_cache(maxsize=1)
+def get_storage_client():
+    """The process wide storage client, so every caller reuses its warm connections"""
+    logger.info("Creating storage client")
+    return make_storage_client()
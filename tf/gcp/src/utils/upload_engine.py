@@ -0,0 +1,78 @@
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from .retry import retry_with_backoff
+from .instrumentation import metrics
+
+logger = logging.getLogger('root')
+
+
+class ConcurrentUploader():
+    """
+    Upload blobs from a bounded thread pool. Submitting blocks while more than
+    max_bytes_in_flight are queued or uploading, so the caller cannot read the
+    whole archive into memory ahead of the network.
+    """
+
+    def __init__(self, max_workers=8, max_bytes_in_flight=256 * 1024 * 1024,
+                 retries=3, backoff=1.0) -> None:
+        self.max_workers = max_workers
+        self.max_bytes_in_flight = max_bytes_in_flight
+        self.retries = retries
+        self.backoff = backoff
+        self.bytes_in_flight = 0
+        self.condition = threading.Condition()
+        self.futures = []
+        self.executor = None
+
+
+    def __enter__(self):
+        self.executor = ThreadPoolExecutor(max_workers=self.max_workers)
+        return self
+
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.executor.shutdown(wait=True, cancel_futures=exc_type is not None)
+        if exc_type is None:
+            self.wait()
+
+
+    def submit(self, blob, data):
+        """Queue data for upload to blob, blocking until there is room in flight"""
+        size = len(data)
+        self.reserve(size)
+        future = self.executor.submit(self.upload, blob, data, size)
+        self.futures.append(future)
+        return future
+
+
+    def reserve(self, size):
+        with self.condition:
+            # Always admit one upload, even if it alone is larger than the limit
+            while self.bytes_in_flight and self.bytes_in_flight + size > self.max_bytes_in_flight:
+                self.condition.wait()
+            self.bytes_in_flight += size
+
+
+    def release(self, size):
+        with self.condition:
+            self.bytes_in_flight -= size
+            self.condition.notify_all()
+
+
+    def upload(self, blob, data, size):
+        try:
+            with metrics.stage("raw_upload", blob=blob.name) as stage:
+                retry_with_backoff(lambda: blob.upload_from_string(data),
+                                   retries=self.retries, backoff=self.backoff)
+                stage.bytes = size
+            logger.info(f"Blob '{blob.name}' uploaded")
+        finally:
+            self.release(size)
+
+
+    def wait(self):
+        """Wait for all queued uploads, raising the first failure"""
+        for future in self.futures:
+            future.result()
+        self.futures = []
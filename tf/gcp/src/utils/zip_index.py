@@ -0,0 +1,156 @@
+import io
+import re
+import json
+import zlib
+import struct
+import logging
+from zipfile import ZIP_DEFLATED, ZIP_STORED
+
+logger = logging.getLogger('root')
+
+# e.g. 2023-03/2023-03-avon-and-somerset-stop-and-search.csv
+MEMBER_PATTERN = re.compile(r"^(?:.*/)?(\d{4}-\d{2})-(.+)-(street|outcomes|stop-and-search)\.csv$")
+LOCAL_HEADER_FORMAT = "<4s2B4HL2L2H"
+LOCAL_HEADER_SIZE = struct.calcsize(LOCAL_HEADER_FORMAT)
+# Compressed bytes read from the archive at a time when a member is opened as a stream
+MEMBER_CHUNK_SIZE = 1024 * 1024
+
+
+def parse_member_name(member_name):
+    """(month, force, data_set) of a crime CSV's name, or None for any other file"""
+    match = MEMBER_PATTERN.match(member_name)
+    return match.groups() if match else None
+
+
+class ZipMemberIndex():
+    """
+    Index of the crime CSVs in an archive, keyed by (month, force, data_set).
+    Built from the central directory once, and holds each member's offset so it
+    can be persisted and used to read members without re-reading the directory.
+    """
+
+    def __init__(self, entries, source=None) -> None:
+        self.entries = entries
+        self.source = source
+        self.keys = {(entry["month"], entry["force"], entry["data_set"]): name
+                     for name, entry in entries.items()}
+
+
+    @classmethod
+    def from_zip_file(cls, zip_file, source=None):
+        entries = {}
+        for info in zip_file.infolist():
+            match = MEMBER_PATTERN.match(info.filename)
+            if match:
+                month, force, data_set = match.groups()
+                entries[info.filename] = {
+                    "month": month,
+                    "force": force,
+                    "data_set": data_set,
+                    "header_offset": info.header_offset,
+                    "compress_size": info.compress_size,
+                    "file_size": info.file_size,
+                    "compress_type": info.compress_type,
+                    "crc": info.CRC,
+                }
+        logger.info(f"Indexed {len(entries)} of {len(zip_file.infolist())} zip members")
+        return cls(entries, source)
+
+
+    @classmethod
+    def from_json(cls, index_json):
+        index_data = json.loads(index_json)
+        return cls(index_data["entries"], index_data["source"])
+
+
+    def to_json(self):
+        return json.dumps({"source": self.source, "entries": self.entries})
+
+
+    def select(self, record_months, data_sets):
+        """Names of the members for the requested months and data sets, in name order"""
+        record_months = set(record_months)
+        data_sets = set(data_sets)
+        return sorted(name for (month, _, data_set), name in self.keys.items()
+                      if month in record_months and data_set in data_sets)
+
+
+    def get_month_and_data_set(self, member_name):
+        entry = self.entries[member_name]
+        return entry["month"], entry["data_set"]
+
+
+    def read_member(self, archive_file, member_name):
+        """Read and decompress a member from its local header offset in a seekable archive file"""
+        with self.open_member(archive_file, member_name) as member_file:
+            return member_file.read()
+
+
+    def open_member(self, archive_file, member_name, chunk_size=MEMBER_CHUNK_SIZE):
+        """
+        Open a member as a binary file decompressed a chunk at a time from its local header
+        offset, so it can be streamed without the central directory or holding it whole
+        """
+        entry = self.entries[member_name]
+        if entry["compress_type"] not in (ZIP_DEFLATED, ZIP_STORED):
+            raise Exception(f"Unsupported compression type for {member_name}")
+        archive_file.seek(entry["header_offset"])
+        local_header = struct.unpack(LOCAL_HEADER_FORMAT, archive_file.read(LOCAL_HEADER_SIZE))
+        if local_header[0] != b"PK\x03\x04":
+            raise Exception(f"Bad local file header for {member_name}")
+        name_length, extra_length = local_header[-2:]
+
+        data_offset = entry["header_offset"] + LOCAL_HEADER_SIZE + name_length + extra_length
+        return io.BufferedReader(ZipMemberReader(archive_file, member_name, entry, data_offset, chunk_size),
+                                 buffer_size=chunk_size)
+
+
+class ZipMemberReader(io.RawIOBase):
+    """
+    A member's decompressed bytes, read from its data offset a chunk at a time and CRC
+    checked once all are read. Seeks before each read, so the archive can be shared.
+    """
+
+    def __init__(self, archive_file, member_name, entry, data_offset, chunk_size=MEMBER_CHUNK_SIZE) -> None:
+        self.archive_file = archive_file
+        self.member_name = member_name
+        self.entry = entry
+        self.position = data_offset
+        self.remaining = entry["compress_size"]
+        self.chunk_size = chunk_size
+        self.decompressor = zlib.decompressobj(-zlib.MAX_WBITS) if entry["compress_type"] == ZIP_DEFLATED else None
+        self.crc = 0
+        self.pending = memoryview(b"")
+        self.finished = False
+
+
+    def readable(self):
+        return True
+
+
+    def readinto(self, buffer):
+        while not self.pending and not self.finished:
+            self.pending = memoryview(self.read_chunk())
+        size = min(len(buffer), len(self.pending))
+        buffer[:size] = self.pending[:size]
+        self.pending = self.pending[size:]
+        return size
+
+
+    def read_chunk(self):
+        if self.remaining:
+            self.archive_file.seek(self.position)
+            data = self.archive_file.read(min(self.chunk_size, self.remaining))
+            if not data:
+                raise Exception(f"Archive ended inside {self.member_name}")
+            self.position += len(data)
+            self.remaining -= len(data)
+            chunk = self.decompressor.decompress(data) if self.decompressor else data
+        else:
+            chunk = self.decompressor.flush() if self.decompressor else b""
+            self.finished = True
+
+        self.crc = zlib.crc32(chunk, self.crc)
+        if self.finished and self.crc != self.entry["crc"]:
+            raise Exception(f"CRC check failed for {self.member_name}")
+        return chunk
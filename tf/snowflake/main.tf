@@ -73,12 +73,6 @@ resource "snowflake_table" "street_table" {
   name                = "STREET_LEVEL"
   change_tracking     = false
 
-  column {
-    name     = "ID"
-    type     = "STRING"
-    nullable = false
-  }
-
   column {
     name     = "CRIME_ID"
     type     = "STRING"
@@ -151,13 +145,20 @@ resource "snowflake_table" "street_table" {
     nullable = true
   }
 
+  # Content hash of the row, computed when it is curated
+  column {
+    name     = "ROW_KEY"
+    type     = "NUMBER(20,0)"
+    nullable = false
+  }
+
 }
 
 resource "snowflake_table_constraint" "primary_key" {
   name     = "STREET_KEY"
   type     = "PRIMARY KEY"
   table_id = snowflake_table.street_table.id
-  columns  = ["ID"]
+  columns  = ["ROW_KEY"]
 }
 
 
@@ -176,7 +177,6 @@ resource "snowflake_procedure" "street_proc" {
       MERGE INTO ${upper(var.project_id)}.${snowflake_schema.schema.name}.${snowflake_table.street_table.name} AS dest
       USING
       (
-      WITH staged_data AS (
           SELECT
             t.$1 AS crime_id
           , t.$2 AS month
@@ -190,45 +190,16 @@ resource "snowflake_procedure" "street_proc" {
           , t.$10 AS crime_type
           , t.$11 AS last_outcome_category
           , t.$12 AS context
-          FROM @STREET_DATA_STAGE (file_format => GCS_CSV_FORMAT) t
-      )
-      SELECT
-        UUID_STRING() AS id
-      , crime_id
-      , month
-      , reported_by
-      , falls_within
-      , longitude
-      , latitude
-      , location
-      , lsoa_code
-      , lsoa_name
-      , crime_type
-      , last_outcome_category
-      , context
-      FROM staged_data
-      )
-      AS stg
-      ON dest.id = stg.id
-      WHEN MATCHED THEN
-      UPDATE SET
-        dest.crime_id              = stg.crime_id
-      , dest.month                 = stg.month
-      , dest.reported_by           = stg.reported_by
-      , dest.falls_within          = stg.falls_within
-      , dest.longitude             = stg.longitude
-      , dest.latitude              = stg.latitude
-      , dest.location              = stg.location
-      , dest.lsoa_code             = stg.lsoa_code
-      , dest.lsoa_name             = stg.lsoa_name
-      , dest.crime_type            = stg.crime_type
-      , dest.last_outcome_category = stg.last_outcome_category
-      , dest.context               = stg.context
+          , t.$13 AS row_key
+          -- Part files only, not the _stats.json sidecars next to them
+          FROM @STREET_DATA_STAGE (file_format => GCS_CSV_FORMAT, pattern => '.*/part-[0-9]+[.]csv') t
+      ) AS stg
+      -- Row keys hash each row's content, so a row already loaded is never inserted again
+      ON dest.row_key = stg.row_key
       WHEN NOT MATCHED THEN
       INSERT
       (
-        id
-      , crime_id
+        crime_id
       , month
       , reported_by
       , falls_within
@@ -240,11 +211,11 @@ resource "snowflake_procedure" "street_proc" {
       , crime_type
       , last_outcome_category
       , context
+      , row_key
       )
       VALUES
       (
-        stg.id
-      , stg.crime_id
+        stg.crime_id
       , stg.month
       , stg.reported_by
       , stg.falls_within
@@ -256,6 +227,7 @@ resource "snowflake_procedure" "street_proc" {
       , stg.crime_type
       , stg.last_outcome_category
       , stg.context
+      , stg.row_key
       )
       ;
   STATUS := TRUE;
@@ -9,7 +9,8 @@ resource "snowflake_storage_integration" "gcs_storage_int" {
   comment = "A storage integration for Google Cloud Storage."
   type    = "EXTERNAL_STAGE"
   enabled = true
-  storage_allowed_locations = ["gcs://${var.project_id_hyphens}/street", "gcs://${var.project_id_hyphens}/outcomes", "gcs://${var.project_id_hyphens}/stop-and-search"]
+  # Curated files are Hive-style partitions, e.g. data_set=street/month=2023-03/force=avon-and-somerset/part-0.csv
+  storage_allowed_locations = ["gcs://${var.project_id_hyphens}/data_set=street", "gcs://${var.project_id_hyphens}/data_set=outcomes", "gcs://${var.project_id_hyphens}/data_set=stop-and-search"]
   storage_provider = "GCS"
   storage_gcp_service_account = "k4g200000@gcpuscentral1-1dfa.iam.gserviceaccount.com"
 }